@@ -41,6 +41,10 @@ class ReRe:
     USE_AARE_AGING = True
     USE_THD_AGING = False
     AGE_POWER = 2.5
+    AGEING_KERNEL = 'polynomial'
+    # 'polynomial' - the ageing coefficients of the window are recalculated in every timestep,
+    # 'exponential' - every timestep multiplies the coefficients by the same factor, AARE and thd are updated in O(1)
+    HALF_LIFE = None  # 'exponential': the age [timesteps] of half weight, sets AGE_POWER (None: keep AGE_POWER)
 
     USE_AUTOMATIC_WS_AP = True
 
@@ -53,6 +57,10 @@ class ReRe:
     # LSTM parameters
     NUM_EPOCHS = 30  # number of epochs
     NUM_NEURONS = 30  # number of neurons
+    LSTM_BACKEND = 'keras'  # 'keras' or 'numpy' (the same model trained in NumPy, without TensorFlow)
+    ADAPTIVE_RETRAIN = False  # retrains start from the live model and stop once the loss stops improving
+    RETRAIN_TOLERANCE = .01  # ADAPTIVE_RETRAIN: the ratio an epoch has to lower the loss by to count as an improvement
+    RETRAIN_PATIENCE = 2  # ADAPTIVE_RETRAIN: the number of epochs in a row without improvement that stop a retrain
 
     # implementation parameters
     FILENAME = 'ec2_cpu_utilization_ac20cd.csv'  # the name of the imported file
@@ -66,6 +74,7 @@ class ReRe:
     NOTES = 'AnDePeD test'  # type notes here to be saved with the hyperparameters
     STATUS_BAR = True  # replaces the #/# lines showing the algorithm operation with a status bar if DEBUG == False
     BATCH_STATUS_BAR = True
+    BOUNDED_MEMORY = False  # whether to keep only the timesteps that the algorithm can still read (online only)
 
     ###############################
     # END OF USER SET PARAMETERS! #
@@ -84,8 +93,19 @@ class ReRe:
         SIGNAL_THRESHOLD_COEFF = B  # the coefficient when calculating percentage threshold of 'freq_retrain'
         TOO_LONG_ANOM_COEFF = 2.5  # this times B is the maximum allowed length of an anomaly
 
-    def __init__(self):
-        from AnDePeD.ReRe.lstm_func import Lstm
+    def __init__(self, lstm_backend: str = None):
+        if lstm_backend is not None:
+            self.LSTM_BACKEND = lstm_backend
+        # TensorFlow is only imported with the Keras backend
+        if self.LSTM_BACKEND == 'numpy':
+            from AnDePeD.ReRe.numpy_lstm import NumpyLstm as Lstm
+        elif self.LSTM_BACKEND == 'keras':
+            from AnDePeD.ReRe.lstm_func import Lstm
+        else:
+            raise ValueError(f'Unknown LSTM backend: {self.LSTM_BACKEND}')
+
+        self.history_horizon = 2 * self.B  # the initial values, enlarged to get_horizon() once the parameters are set
+        self.window_clamps = 0
 
         self.b_s = None
         self.thr_s = None
@@ -111,22 +131,25 @@ class ReRe:
         self.tmp_lstm_model_1 = Lstm(self.B, self.NUM_NEURONS)
         self.tmp_lstm_model_2 = Lstm(self.B, self.NUM_NEURONS)
 
-        # create lists
+        # create histories
         self.values = np.empty(self.length)
-        self.predicted_1 = list()
-        self.predicted_2 = list()
-        self.AARE_1 = list()
-        self.AARE_2 = list()
-        self.threshold_1 = list()
-        self.threshold_2 = list()
-        self.anomaly_1 = list()
-        self.anomaly_2 = list()
-        self.anomaly_aggr = list()
-        self.pattern_change_1 = list()
-        self.pattern_change_2 = list()
+        self.predicted_1 = self.new_history()
+        self.predicted_2 = self.new_history()
+        self.AARE_1 = self.new_history()
+        self.AARE_2 = self.new_history()
+        self.threshold_1 = self.new_history()
+        self.threshold_2 = self.new_history()
+        self.anomaly_1 = self.new_history(bool)
+        self.anomaly_2 = self.new_history(bool)
+        self.anomaly_aggr = self.new_history(bool)
+        self.pattern_change_1 = self.new_history(bool)
+        self.pattern_change_2 = self.new_history(bool)
 
         # aging
         self.window_beginning = 0
+        self.ageing_weights_key = None
+        self.ageing_weights_cache = None
+        self.exponential_sums = dict()
 
         self.DO_DIFF = None
         self.DO_SCAL = None
@@ -163,12 +186,14 @@ class ReRe:
             self.DEBUG = False
 
     from .initial import param_refresh, load, initialize_cons
-    from .main_algo import initialize_rere, next_timestep
+    from .main_algo import initialize_rere, next_timestep, retrain_lstm
     from .offset_comp import init_offset_compensation, compensate_offset
     from .auto_offset_comp import init_auto_offset_compensation, auto_tune_offset
     from .timer import init_timer, start_timestep, end_timestep
     from .preprocess import preprocess
     from .auto_ws_ap import init_auto_ws_ap, auto_tune_ws_ap
     from .to_csv import init_to_csv, dump_hyperparameters, dump_results, write_time
-    from .window_ageing import update_window_beginning, ageing_coefficient
+    from .window_ageing import update_window_beginning, ageing_coefficient, \
+        ageing_weights, invalidate_ageing_weights, exponential_decay, exponential_window_sums
     from .thd_aare_func import aare, thd_1, thd_2
+    from .history import new_history, get_horizon, update_horizon, get_oldest_timestep
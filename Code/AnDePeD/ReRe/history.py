@@ -0,0 +1,223 @@
+"""
+HISTORY OF PER-TIMESTEP VALUES
+
+The History class stores one value per timestep (e.g. AARE_1 or anomaly_1) in a typed NumPy array.
+The horizon functions keep the bounded histories of AnDePeD as long as the components reading them need.
+"""
+
+import numpy as np
+
+
+class History:
+    """
+    Per-timestep history, used in place of a Python list indexed by timestep: a preallocated NumPy array of the given
+    dtype that doubles its capacity when full, so storing the value of a timestep is O(1) and the values of a range of
+    timesteps are a contiguous view that vectorised statistics can use directly.
+    Missing values are NaN in float histories. Flag (dtype=bool) histories keep a mask of the missing values instead,
+    which read as NaN one by one (and are truthy, as NaN was in the lists) and are masked in slices.
+    A bounded history keeps only the last capacity timesteps, in a ring of twice that size whose halves mirror each
+    other, so any range of stored timesteps is still a contiguous view; it is still indexed by timestep.
+    """
+
+    def __init__(self, dtype=float, capacity: int = 1024, bounded: bool = False):
+        self.dtype = np.dtype(dtype)
+        self.bounded = bounded
+        self.capacity = capacity
+        size = 2 * capacity if bounded else capacity
+        self.data = np.zeros(size, dtype=self.dtype)
+        self.mask = np.zeros(size, dtype=bool) if self.dtype == bool else None
+        self.length = 0  # number of timesteps stored so far
+        self.first = 0  # the first timestep still stored
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if not self.bounded:
+            # only the used part of the arrays is saved
+            state['data'] = self.data[:self.length].copy()
+            state['mask'] = None if self.mask is None else self.mask[:self.length].copy()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not self.bounded:
+            self.data = np.concatenate((self.data, np.zeros(self.capacity - self.length, dtype=self.dtype)))
+            if self.mask is not None:
+                self.mask = np.concatenate((self.mask, np.zeros(self.capacity - self.length, dtype=bool)))
+
+    def __len__(self):
+        return self.length
+
+    def _grow(self, length):
+        capacity = self.capacity
+        while capacity < length:
+            capacity *= 2
+        self.data = np.concatenate((self.data, np.zeros(capacity - self.capacity, dtype=self.dtype)))
+        if self.mask is not None:
+            self.mask = np.concatenate((self.mask, np.zeros(capacity - self.capacity, dtype=bool)))
+        self.capacity = capacity
+
+    def set_capacity(self, capacity: int):
+        """
+        Keep at least the last capacity timesteps of a bounded history from now on. The timesteps already dropped
+        are not restored, so the history holds more timesteps only as new ones are stored.
+        :param capacity: number of timesteps to keep, a smaller capacity than the current one is ignored
+        :return:
+        """
+        if not self.bounded or capacity <= self.capacity:
+            return
+        timesteps = np.arange(self.first, self.length)
+        data = self.data[timesteps % self.capacity]
+        mask = None if self.mask is None else self.mask[timesteps % self.capacity]
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=self.dtype)
+        self.data[timesteps % capacity] = data
+        self.data[timesteps % capacity + capacity] = data
+        if self.mask is not None:
+            self.mask = np.zeros(2 * capacity, dtype=bool)
+            self.mask[timesteps % capacity] = mask
+            self.mask[timesteps % capacity + capacity] = mask
+
+    def _index(self, index):
+        if index < 0:
+            index += self.length
+        if not self.first <= index < self.length:
+            if 0 <= index < self.first:
+                raise IndexError(f'Timestep {index} is no longer stored in the history (first: {self.first})')
+            raise IndexError('History index out of range')
+        return index
+
+    def _store(self, index, value):
+        if self.mask is None:
+            self.data[index] = value
+        elif value is None or value != value:  # NaN
+            self.data[index] = False
+            self.mask[index] = True
+        else:
+            self.data[index] = value
+            self.mask[index] = False
+
+    def _store_timestep(self, index, value):
+        if self.bounded:
+            slot = index % self.capacity
+            self._store(slot, value)
+            self._store(slot + self.capacity, value)
+        else:
+            self._store(index, value)
+
+    def insert(self, index, value):
+        """
+        Store the value of a timestep.
+        AnDePeD inserts the value of a timestep either at the end of the history, or at the position of a timestep
+        already stored (e.g. a prediction is made again after a retrain), which replaces its value: with the lists
+        the older value was pushed past the end, where it was never read. Skipped timesteps are missing.
+        :param index: timestep
+        :param value: value of the timestep
+        :return:
+        """
+        if index < 0:
+            index = max(index + self.length, 0)
+        if index >= self.length:
+            if self.bounded:
+                for skipped in range(max(self.length, index - self.capacity), index):
+                    self._store_timestep(skipped, np.nan if self.dtype.kind == 'f' or self.mask is not None else 0)
+                self.first = max(self.first, index + 1 - self.capacity)
+            else:
+                if index >= self.capacity:
+                    self._grow(index + 1)
+                if self.mask is None:
+                    self.data[self.length:index] = np.nan if self.dtype.kind == 'f' else 0
+                else:
+                    self.mask[self.length:index] = True
+            self.length = index + 1
+        self._store_timestep(self._index(index), value)
+
+    def append(self, value):
+        self.insert(self.length, value)
+
+    def _range(self, begin, end):
+        # the position of the timesteps begin ... end - 1 in the arrays
+        if begin >= end:
+            return 0, 0
+        if begin < self.first:
+            raise IndexError(f'Timestep {begin} is no longer stored in the history (first: {self.first})')
+        if self.bounded:
+            begin, end = begin % self.capacity, begin % self.capacity + end - begin
+        return begin, end
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            begin, end, step = index.indices(self.length)
+            if step != 1:
+                raise ValueError('Histories can only be sliced with a step of 1')
+            begin, end = self._range(begin, end)
+            view = self.data[begin:end]
+            view.flags.writeable = False
+            if self.mask is not None:
+                return np.ma.masked_array(view, mask=self.mask[begin:end])
+            return view
+        index = self._index(index)
+        if self.bounded:
+            index %= self.capacity
+        if self.mask is not None and self.mask[index]:
+            return np.nan
+        return self.data[index]
+
+    def __setitem__(self, index, value):
+        self._store_timestep(self._index(index), value)
+
+    def flags(self, begin: int, end: int):
+        """
+        The truth values of the timesteps begin ... end - 1, as the lists had them (missing values are True).
+        :return: boolean array
+        """
+        begin, end = self._range(begin, min(end, self.length))
+        if self.mask is None:
+            return self.data[begin:end] != 0
+        return self.data[begin:end] | self.mask[begin:end]
+
+    def copy(self):
+        history = History(self.dtype, self.capacity, self.bounded)
+        history.data[:] = self.data
+        if self.mask is not None:
+            history.mask[:] = self.mask
+        history.length = self.length
+        history.first = self.first
+        return history
+
+
+# create a history that is bounded if AnDePeD runs with bounded memory
+def new_history(self, dtype=float):
+    if self.BOUNDED_MEMORY:
+        return History(dtype, self.history_horizon, bounded=True)
+    return History(dtype)
+
+
+# the number of past timesteps any component can still read
+def get_horizon(self):
+    # the sliding window; when it is tuned, the window of a larger WINDOW_SIZE is only complete if it has been kept
+    # before the tuning, so room is left for two of the largest steps of the tuning: after one step the histories
+    # still hold the window of the next one (faster growth is clamped, see update_window_beginning)
+    window = self.WINDOW_SIZE
+    if self.USE_AUTOMATIC_WS_AP:
+        window = self.WS_AP_COEFF ** 2 * self.WINDOW_SIZE
+    # the signal database of the WS/AP criteria, the offset window and the training data of the LSTM
+    other = max(self.SIGNAL_DATABASE_LEN if self.USE_AUTOMATIC_WS_AP else 0,
+                self.OFFSET_WINDOW_SIZE if self.USE_OFFSET_COMP else 0, self.B)
+    # the predictions are stored one timestep ahead
+    return int(max(window, other)) + 2
+
+
+# enlarge the bounded histories when the horizon grows (e.g. a larger WINDOW_SIZE after tuning)
+def update_horizon(self):
+    if self.BOUNDED_MEMORY:
+        horizon = self.get_horizon()
+        if horizon > self.history_horizon:
+            self.history_horizon = horizon
+            for history in vars(self).values():
+                if isinstance(history, History):
+                    history.set_capacity(horizon)
+
+
+# the first timestep that every history of the sliding window still stores
+def get_oldest_timestep(self):
+    return max(self.values.first, self.predicted_1.first, self.AARE_1.first)
@@ -7,6 +7,7 @@ The initialize_cons function sets parameters to a self-consistent value.
 """
 
 import pandas as pd
+from .window_ageing import equivalent_age_power
 
 
 # set or update algorithm parameters from file
@@ -67,6 +68,9 @@ def initialize_cons(self):
         self.USE_AARE_AGING = False
         self.USE_THD_AGING = False
         self.AGE_POWER = 0
+    elif self.AGEING_KERNEL == 'exponential' and self.HALF_LIFE is not None:
+        # the half-life is tuned through AGE_POWER, the two are equivalent for the window size
+        self.AGE_POWER = equivalent_age_power(self.WINDOW_SIZE, self.HALF_LIFE)
     if (not self.USE_AGING) or (not self.USE_WINDOW):
         self.USE_AUTOMATIC_WS_AP = False
     if self.USE_OFFSET_COMP:
@@ -56,7 +56,7 @@ def next_timestep(self, time):
         if self.DEBUG:
             print('\tStep 2')
         # training the model
-        self.lstm_model_1.train_lstm(self.values[0:self.B], self.NUM_EPOCHS, self.DEBUG)
+        self.retrain_lstm(time, self.lstm_model_1, self.values[0:self.B], adaptive=False)
         # self.lstm_model_2.set_weights(self.lstm_model_1)
         # predicting using the model
         self.predicted_1.insert(time + 1, self.lstm_model_1.predict_lstm(self.values[1:self.B], time, self.DEBUG,
@@ -72,7 +72,7 @@ def next_timestep(self, time):
         self.AARE_1.insert(time, self.aare(time, self.predicted_1))
         self.AARE_2 = self.AARE_1.copy()
         # training the model
-        self.lstm_model_1.train_lstm(self.values[time - self.B + 1:time + 1], self.NUM_EPOCHS, self.DEBUG)
+        self.retrain_lstm(time, self.lstm_model_1, self.values[time - self.B + 1:time + 1])
         self.lstm_model_2.set_weights(self.lstm_model_1)
         # predicting using the model
         self.predicted_1.insert(time + 1, self.lstm_model_1.predict_lstm(self.values[time - self.B + 2:time + 1], time,
@@ -100,8 +100,7 @@ def next_timestep(self, time):
         else:
             # it MIGHT BE an anomaly - further investigation needed
             # retrain lstm model with the last B data points
-            self.tmp_lstm_model_1.train_lstm(self.values[time - self.B:time],
-                                             self.NUM_EPOCHS, self.DEBUG)
+            self.retrain_lstm(time, self.tmp_lstm_model_1, self.values[time - self.B:time], self.lstm_model_1)
             # predict the next value again using the new model
             if time < self.length - 1:
                 self.predicted_1[time] = self.tmp_lstm_model_1.predict_lstm(self.values[time - self.B + 1:time], time,
@@ -166,6 +165,20 @@ def next_timestep(self, time):
                 print('NO anomaly at timestep {}!'.format(time))
 
 
+# train an LSTM model on a window of values and log the number of epochs used
+def retrain_lstm(self, time, lstm_model, train_data, live_lstm_model=None, adaptive=True):
+    tolerance = None
+    if self.ADAPTIVE_RETRAIN and adaptive:
+        tolerance = self.RETRAIN_TOLERANCE
+        # a temporary model starts from the weights of the live one instead of those of its previous retrain
+        if live_lstm_model is not None:
+            lstm_model.set_weights(live_lstm_model)
+    epochs = lstm_model.train_lstm(train_data, self.NUM_EPOCHS, self.DEBUG, tolerance, self.RETRAIN_PATIENCE)
+    if time < len(self.retrain_epochs):
+        epochs += self.retrain_epochs[time]
+    self.retrain_epochs.insert(time, epochs)
+
+
 def detection_is_not_anomaly(rere, time, anomaly_list, pattern_change_list, predicted_list, lstm_model):
     anomaly_list.insert(time, False)
     pattern_change_list.insert(time, False)
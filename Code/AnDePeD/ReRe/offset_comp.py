@@ -9,18 +9,19 @@ import numpy as np
 
 def init_offset_compensation(self):
     if self.USE_OFFSET_COMP:
-        self.diff_avg_1 = list()
-        # self.diff_avg_2 = list()
-        self.values_mean = list()
-        self.pred_mean_1 = list()
-        # self.pred_mean_2 = list()
-        self.offset_retrain_threshold = list()
-        self.offset_retrain_trigger_1 = list()
-        # self.offset_retrain_trigger_2 = list()
-        self.offset_retrain_signal_1 = list()
-        # self.offset_retrain_signal_2 = list()
+        self.diff_avg_1 = self.new_history()
+        # self.diff_avg_2 = self.new_history()
+        self.values_mean = self.new_history()
+        self.pred_mean_1 = self.new_history()
+        # self.pred_mean_2 = self.new_history()
+        self.offset_retrain_threshold = self.new_history()
+        self.offset_retrain_trigger_1 = self.new_history(bool)
+        # self.offset_retrain_trigger_2 = self.new_history(bool)
+        self.offset_retrain_signal_1 = self.new_history(bool)
+        # self.offset_retrain_signal_2 = self.new_history(bool)
         self.offset_ws_actual = 0
         self.offset_window_beg = 0
+        self.offset_sums = dict()
         self.offset_percentage_curr_1 = self.OFFSET_PERCENTAGE
         # self.offset_percentage_curr_2 = self.OFFSET_PERCENTAGE
 
@@ -38,85 +39,155 @@ def init_offset_compensation(self):
                 self.offset_retrain_signal_1.insert(i, np.NaN)
                 # self.offset_retrain_signal_2.insert(i, np.NaN)
 
-# criteria for triggering a retrain
-def check_signal_in_ow(ow, time, signal):
-    for i in range(ow, time + 1):
-        if signal[i]:
-            return False
-    return True
+
+class SlidingWindowSums:
+    """
+    The sum and the variance of x_y over the offset window y = window_beginning ... time, updated in O(1) per
+    timestep: the newest finished timestep is added to the sums of x_y and x_y ** 2 and the ones leaving the window are
+    subtracted. As in ExponentialWindowSums, the item of the current timestep is only added to the returned values,
+    and the sums are rebuilt once per window length. The sums are of x_y - shift (the first item at the last rebuild),
+    so the variance of items far from zero does not cancel out.
+    """
+
+    def __init__(self):
+        self.begin = 0  # the finished timesteps begin ... end - 1 are in the sums
+        self.end = 0
+        self.shift = 0.0
+        self.sums = np.zeros(2)
+        self.updates = 0
+
+    def _shifted(self, values):
+        values = np.asarray(values, dtype=float) - self.shift
+        return values, np.array([values.sum(), np.dot(values, values)])
+
+    def _rebuild(self, begin, end, items):
+        values = np.asarray(items(begin, end), dtype=float)
+        self.shift = values[0] if len(values) > 0 else 0.0
+        _, self.sums = self._shifted(values)
+        self.begin = begin
+        self.end = end
+        self.updates = 0
+
+    def get(self, time, window_beginning, items):
+        """
+        :param time: current timestep
+        :param window_beginning: first timestep of the window
+        :param items: items(begin, end) returns the items of the timesteps begin ... end - 1 as an array
+        :return: the sum of the items over the window and their variance (as np.var), including the item of time
+        """
+        # a NaN item is only forgotten by a rebuild, as in np.mean the whole window is NaN while it is in there
+        if not self.begin <= window_beginning <= self.end or time < self.end or \
+                time - self.end + self.updates > self.end - self.begin or not np.isfinite(self.sums).all():
+            self._rebuild(window_beginning, time, items)
+        else:
+            self.sums = self.sums + self._shifted(items(self.end, time))[1]
+            self.updates += time - self.end
+            self.end = time
+            if window_beginning > self.begin:
+                self.sums = self.sums - self._shifted(items(self.begin, window_beginning))[1]
+                self.begin = window_beginning
+        count = time - window_beginning + 1
+        total, square_total = self.sums + self._shifted(items(time, time + 1))[1]
+        return self.shift * count + total, max(square_total / count - (total / count) ** 2, 0.0)
+
+
+# the sum and the variance of a series over the offset window, kept separately for each series (e.g. 'values')
+def offset_window_sums(self, name, time, items):
+    if name not in self.offset_sums:
+        self.offset_sums[name] = SlidingWindowSums()
+    return self.offset_sums[name].get(time, self.offset_window_beg, items)
 
 
 def compensate_offset(self, time):
     # offset compensation component
     if self.USE_OFFSET_COMP and time >= 2 * self.B - 1:
-        # calculating offset window size and beginning
-        window_beg = time - self.WINDOW_SIZE if time - self.WINDOW_SIZE > self.B else self.B
-        self.offset_ws_actual = self.OFFSET_WINDOW_SIZE if not self.USE_WINDOW else \
-            self.OFFSET_WINDOW_SIZE if self.WINDOW_SIZE > self.OFFSET_WINDOW_SIZE else self.WINDOW_SIZE
-        self.offset_window_beg = (time - self.offset_ws_actual + 1) if (time > (2 * self.B - 1 + self.offset_ws_actual)) \
-            else (2 * self.B - 1)
-        # calculating averages
+        update_offset_window(self, time)
         if self.offset_window_beg == 2 * self.B - 1:
-            self.diff_avg_1.insert(time, np.NaN)
-            # self.diff_avg_2.insert(time, np.NaN)
-            self.values_mean.insert(time, np.NaN)
-            self.pred_mean_1.insert(time, np.NaN)
-            # self.pred_mean_2.insert(time, np.NaN)
-            self.offset_retrain_trigger_1.insert(time, np.NaN)
-            # self.offset_retrain_trigger_2.insert(time, np.NaN)
-            self.offset_retrain_signal_1.insert(time, np.NaN)
-            # self.offset_retrain_signal_2.insert(time, np.NaN)
-            self.offset_retrain_threshold.insert(time, np.NaN)
+            skip_offset_window(self, time)
         else:
-            self.values_mean.insert(time, np.mean(self.values[self.offset_window_beg:time + 1]))
-            self.pred_mean_1.insert(time, np.mean(self.predicted_1[self.offset_window_beg:time + 1]))
-            # self.pred_mean_2.insert(time, np.mean(self.predicted_2[self.offset_window_beg:time + 1]))
-            self.diff_avg_1.insert(time, abs(self.values_mean[time] - self.pred_mean_1[time]))
-            # self.diff_avg_2.insert(time, abs(self.values_mean[time] - self.pred_mean_2[time]))
-
-        # decide when to trigger LSTM retrain
-        if time > 2 * self.B - 1 + self.offset_ws_actual:
-            above_counter_1 = 0
-            # above_counter_2 = 0
-            self.offset_retrain_threshold.insert(time, np.std(self.values[self.offset_window_beg:time + 1]))
-            for y in range(self.offset_window_beg, time + 1):
-                if self.diff_avg_1[y] > self.offset_retrain_threshold[y]:
-                    above_counter_1 += 1
-                # if self.diff_avg_2[y] > self.offset_retrain_threshold[y]:
-                #     above_counter_2 += 1
-            if above_counter_1 > int(self.offset_ws_actual * self.offset_percentage_curr_1):
-                self.offset_retrain_signal_1.insert(time, True)
-            else:
-                self.offset_retrain_signal_1.insert(time, False)
-            # if above_counter_2 > int(self.offset_ws_actual * self.offset_percentage_curr_2):
-            #     self.offset_retrain_signal_2.insert(time, True)
-            # else:
-            #     self.offset_retrain_signal_2.insert(time, False)
-
-            # actually trigger LSTM retrain if necessary for detector 1
-            if self.offset_retrain_signal_1[self.offset_window_beg] and \
-                    check_signal_in_ow(self.offset_window_beg, time, self.pattern_change_1) and \
-                    check_signal_in_ow(self.offset_window_beg, time, self.anomaly_1) and \
-                    self.offset_retrain_signal_1[time]:
-                trigger_lstm_retrain(self, time, self.lstm_model_1, self.tmp_lstm_model_1, self.predicted_1)
-                self.offset_retrain_trigger_1.insert(time, True)
-            else:
-                self.offset_retrain_trigger_1.insert(time, False)
-
-            # actually trigger LSTM retrain if necessary for detector 2
-            # if self.offset_retrain_signal_2[self.offset_window_beg] and \
-            #         check_signal_in_ow(self.offset_window_beg, time, self.pattern_change_2) and \
-            #         check_signal_in_ow(self.offset_window_beg, time, self.anomaly_2) and \
-            #         self.offset_retrain_signal_2[time]:
-            #     trigger_lstm_retrain(self, time, self.lstm_model_2, self.tmp_lstm_model_2, self.predicted_2)
-            #     self.offset_retrain_trigger_2.insert(time, True)
-            # else:
-            #     self.offset_retrain_trigger_2.insert(time, False)
+            update_offset_averages(self, time)
+            update_offset_signals(self, time)
+            trigger_offset_retrains(self, time)
+
+
+# calculating offset window size and beginning
+def update_offset_window(self, time):
+    self.offset_ws_actual = self.OFFSET_WINDOW_SIZE if not self.USE_WINDOW else \
+        self.OFFSET_WINDOW_SIZE if self.WINDOW_SIZE > self.OFFSET_WINDOW_SIZE else self.WINDOW_SIZE
+    self.offset_window_beg = (time - self.offset_ws_actual + 1) if (time > (2 * self.B - 1 + self.offset_ws_actual)) \
+        else (2 * self.B - 1)
+
+
+# the offset window is not full yet
+def skip_offset_window(self, time):
+    self.diff_avg_1.insert(time, np.NaN)
+    self.values_mean.insert(time, np.NaN)
+    self.pred_mean_1.insert(time, np.NaN)
+    self.offset_retrain_trigger_1.insert(time, np.NaN)
+    self.offset_retrain_signal_1.insert(time, np.NaN)
+    self.offset_retrain_threshold.insert(time, np.NaN)
+    # self.diff_avg_2.insert(time, np.NaN)
+    # self.pred_mean_2.insert(time, np.NaN)
+    # self.offset_retrain_trigger_2.insert(time, np.NaN)
+    # self.offset_retrain_signal_2.insert(time, np.NaN)
+
+
+# calculating averages and the standard deviation of the values over the offset window
+def update_offset_averages(self, time):
+    length = time - self.offset_window_beg + 1
+    values_sum, values_var = offset_window_sums(self, 'values', time, lambda begin, end: self.values[begin:end])
+    self.values_mean.insert(time, values_sum / length)
+    self.offset_retrain_threshold.insert(time, np.sqrt(values_var))
+    pred_sum_1, _ = offset_window_sums(self, 'predicted_1', time, lambda begin, end: self.predicted_1[begin:end])
+    self.pred_mean_1.insert(time, pred_sum_1 / length)
+    self.diff_avg_1.insert(time, abs(self.values_mean[time] - self.pred_mean_1[time]))
+    # pred_sum_2, _ = offset_window_sums(self, 'predicted_2', time, lambda begin, end: self.predicted_2[begin:end])
+    # self.pred_mean_2.insert(time, pred_sum_2 / length)
+    # self.diff_avg_2.insert(time, abs(self.values_mean[time] - self.pred_mean_2[time]))
+
+
+# signal a retrain if the difference of the averages is above the threshold in enough of the offset window
+def update_offset_signals(self, time):
+    above_counter_1, _ = offset_window_sums(
+        self, 'above_1', time,
+        lambda begin, end: self.diff_avg_1[begin:end] > self.offset_retrain_threshold[begin:end])
+    self.offset_retrain_signal_1.insert(time, above_counter_1 > int(self.offset_ws_actual *
+                                                                    self.offset_percentage_curr_1))
+    # above_counter_2, _ = offset_window_sums(
+    #     self, 'above_2', time,
+    #     lambda begin, end: self.diff_avg_2[begin:end] > self.offset_retrain_threshold[begin:end])
+    # self.offset_retrain_signal_2.insert(time, above_counter_2 > int(self.offset_ws_actual *
+    #                                                                 self.offset_percentage_curr_2))
+
+
+# criteria for triggering a retrain: a signal at both ends of the offset window and no detection in it
+def check_offset_retrain(self, time, name, signal, pattern_change, anomaly):
+    detections, _ = offset_window_sums(self, name, time,
+                                       lambda begin, end: pattern_change.flags(begin, end) | anomaly.flags(begin, end))
+    return signal[self.offset_window_beg] and detections == 0 and signal[time]
+
+
+def trigger_offset_retrains(self, time):
+    # actually trigger LSTM retrain if necessary for detector 1
+    if check_offset_retrain(self, time, 'detections_1', self.offset_retrain_signal_1, self.pattern_change_1,
+                            self.anomaly_1):
+        trigger_lstm_retrain(self, time, self.lstm_model_1, self.tmp_lstm_model_1, self.predicted_1)
+        self.offset_retrain_trigger_1.insert(time, True)
+    else:
+        self.offset_retrain_trigger_1.insert(time, False)
+
+    # actually trigger LSTM retrain if necessary for detector 2
+    # if check_offset_retrain(self, time, 'detections_2', self.offset_retrain_signal_2, self.pattern_change_2,
+    #                         self.anomaly_2):
+    #     trigger_lstm_retrain(self, time, self.lstm_model_2, self.tmp_lstm_model_2, self.predicted_2)
+    #     self.offset_retrain_trigger_2.insert(time, True)
+    # else:
+    #     self.offset_retrain_trigger_2.insert(time, False)
 
 
 def trigger_lstm_retrain(self, time, lstm_model, tmp_lstm_model, predicted):
     # retrain lstm model with the last B data points
-    tmp_lstm_model.train_lstm(self.values[time - self.B:time], self.NUM_EPOCHS, self.DEBUG)
+    self.retrain_lstm(time, tmp_lstm_model, self.values[time - self.B:time], lstm_model)
     # predict the next value again using the new model
     if time < self.length - 1:
         predicted[time] = tmp_lstm_model.predict_lstm(self.values[time - self.B + 1:time], time, self.DEBUG,
@@ -7,44 +7,51 @@ These functions implement the necessary calculations of the AARE and thd values.
 import numpy as np
 
 
+# relative errors of the predictions of the timesteps begin ... end - 1, values equal to zero are left out
+def relative_errors(self, begin, end, predicted):
+    values = np.asarray(self.values[begin:end], dtype=float)
+    predictions = np.asarray(predicted[begin:end], dtype=float)
+    errors = np.zeros(len(values))
+    np.divide(np.abs(values - predictions), np.abs(values), out=errors, where=values != 0)
+    return errors
+
+
 # calculating AARE_t
 def aare(self, time, predicted):
-    # calculating aare
-    sum_ = 0.0
-    for y in range(self.window_beginning, time + 1, 1):
-        # calculating coefficient for ageing
-        value_coeff = self.ageing_coefficient(time, y)
+    if self.AGEING_KERNEL == 'exponential':
+        # exponentially aged mean of the errors, updated recursively
+        name = 'errors_1' if predicted is self.predicted_1 else 'errors_2'
+        weight_sum, sum_, _ = self.exponential_window_sums(
+            name, time, lambda begin, end: relative_errors(self, begin, end, predicted))
+        aare_ = sum_ / weight_sum
+    else:
+        # calculating aare over the whole window at once
+        errors = relative_errors(self, self.window_beginning, time + 1, predicted)
+        aare_ = float(np.dot(self.ageing_weights(time), errors)) / (time - self.window_beginning + 1)
 
-        if self.values[y] != 0:
-            sum_ += value_coeff * ((abs(self.values[y] - predicted[y])) / abs(self.values[y]))
-        elif predicted[y] != 0:
-            sum_ += 0
-        else:
-            sum_ += 0
     if self.DEBUG:
-        print('\t\tNew AARE calculated, value: {}'.format(
-            round(float((1 / (time - self.window_beginning + 1)) * sum_), 5)))
-    return (1 / (time - self.window_beginning + 1)) * sum_
+        print('\t\tNew AARE calculated, value: {}'.format(round(float(aare_), 5)))
+    return aare_
 
 
 # calculating thd_t for detector 1
 def thd_1(self, time):
-    # calculating threshold value
-    sum_ = 0.0
-    for y in range(self.window_beginning, time + 1, 1):
-        # calculating coefficient for ageing
-        aare_coeff = self.ageing_coefficient(time, y)
-        # actual calculation
-        sum_ += aare_coeff * self.AARE_1[y]
-    mu = sum_ / (time + 1 - self.window_beginning)
-
-    sum_ = 0.0
-    for y in range(self.window_beginning, time + 1):
-        # calculating coefficient for ageing
-        aare_coeff = self.ageing_coefficient(time, y)
-        # actual calculation
-        sum_ += aare_coeff * ((self.AARE_1[y] - mu) ** 2)
-    sigma = np.sqrt(sum_ / (time + 1 - self.window_beginning))
+    if self.AGEING_KERNEL == 'exponential':
+        # exponentially aged mean and variance of the AARE window, updated recursively
+        weight_sum, sum_, square_sum = self.exponential_window_sums(
+            'AARE_1', time, lambda begin, end: np.asarray(self.AARE_1[begin:end], dtype=float))
+        mu = sum_ / weight_sum
+        sigma = np.sqrt(max(square_sum / weight_sum - mu ** 2, 0.0))
+    else:
+        # calculating threshold value in one pass: weighted first and second moments of the AARE window
+        aare_window = np.asarray(self.AARE_1[self.window_beginning:time + 1], dtype=float)
+        weights = self.ageing_weights(time)
+        weighted = weights * aare_window
+        length = time + 1 - self.window_beginning
+        mu = weighted.sum() / length
+        # sum(w * (a - mu) ** 2) = sum(w * a ** 2) - 2 * mu * sum(w * a) + mu ** 2 * sum(w)
+        sum_ = np.dot(weighted, aare_window) - 2 * mu * weighted.sum() + mu ** 2 * weights.sum()
+        sigma = np.sqrt(max(sum_, 0.0) / length)
 
     if self.DEBUG:
         print('\t\tNew thd calculated, value: {}'.format(round(float(mu + self.THRESHOLD_STRENGTH * sigma), 5)))
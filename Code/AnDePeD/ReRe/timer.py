@@ -9,10 +9,11 @@ import time as timelib
 
 
 def init_timer(self):
-    self.timesteps_dur = list()
+    self.timesteps_dur = self.new_history()
     self.avg_dur_normal = 0.0
     self.avg_dur_lstm = 0.0
     self.retrain_count = 0
+    self.retrain_epochs = self.new_history(int)  # the number of epochs the retrains of a timestep used
     self.timestep_begin = 0.0
     self.current_duration = 0.0
 
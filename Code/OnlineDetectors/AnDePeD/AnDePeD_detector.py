@@ -8,13 +8,30 @@ from OnlineDetectors.AnDePeD.ReRe import ReRe
 
 class ANDEPEDDetector(OnlineAnomalyDetector):
 
-    def __init__(self, buffer_size: int, algorithm: str, *args, **kwargs):
+    def __init__(self, buffer_size: int, algorithm: str, *args, bounded: bool = False, lstm_backend: str = 'keras',
+                 async_retrain: bool = False, detector_2: bool = False, adaptive_retrain: bool = False, **kwargs):
+        """
+        :param buffer_size: number of values kept for ReRe, which indexes them by timestep
+        :param algorithm: 'AnDePeD' or 'AnDePeDPro'
+        :param bounded: keep only the timesteps that ReRe can still read in ring storage, instead of the buffer and
+                        the full histories, so that the memory of the detector stays constant on an unbounded stream
+        :param lstm_backend: 'keras' or 'numpy', the library that trains the LSTM models of ReRe and predicts with them
+        :param async_retrain: retrain in the background, so that a record costs a prediction instead of a training;
+                              suspected anomalies are scored 1 with a provisional verdict until their retrain finishes
+        :param detector_2: also run the second detector of ReRe, on a worker thread concurrently with the first one;
+                           a record is only an anomaly if both detectors find it one (the detectors only overlap
+                           with the 'keras' backend and more than one core, 'numpy' holds the GIL while training)
+        :param adaptive_retrain: retrains start from the live model and stop once the loss stops improving, instead of
+                                 training a new model for the full number of epochs
+        """
         super(ANDEPEDDetector, self).__init__(*args, **kwargs)
 
         self.algorithm = algorithm
+        self.bounded = bounded
 
-        self.buffer = obuff.CircularBuffer(buffer_size)
-        self.rere = ReRe.ReRe()
+        self.buffer = None if bounded else obuff.CircularBuffer(buffer_size)
+        self.rere = ReRe.ReRe(bounded=bounded, lstm_backend=lstm_backend, async_retrain=async_retrain,
+                              detector_2=detector_2, adaptive_retrain=adaptive_retrain)
 
     def initialize(self):
         if self.algorithm == 'AnDePeDPro':
@@ -26,8 +43,11 @@ class ANDEPEDDetector(OnlineAnomalyDetector):
         self.rere.init_offset_compensation()
         self.rere.init_auto_offset_compensation()
         self.rere.init_auto_ws_ap()
+        self.rere.init_async_retrain()
 
         self.rere.param_refresh(0)
+        self.rere.AGEING_KERNEL = conf.ANDEPED_AGEING_KERNEL
+        self.rere.HALF_LIFE = conf.ANDEPED_HALF_LIFE
         self.rere.inst_num = 0
         self.rere.progress_for_executions = {}
         self.rere.executions_max = {}
@@ -35,6 +55,7 @@ class ANDEPEDDetector(OnlineAnomalyDetector):
         self.rere.DEBUG = False
 
         self.rere.initialize_cons()
+        self.rere.update_horizon()
         self.rere.preprocess()
 
         self.rere.initialize_rere()
@@ -44,8 +65,11 @@ class ANDEPEDDetector(OnlineAnomalyDetector):
     def handleRecord(self, inputData):
         # add new element to buffer, and import it into ReRe
         new_value = inputData['value']
-        self.buffer.add_item(new_value)
-        self.rere.set_values(self.buffer.get_all_items())
+        if self.bounded:
+            self.rere.add_value(new_value)
+        else:
+            self.buffer.add_item(new_value)
+            self.rere.set_values(self.buffer.get_all_items())
 
         # start time measurement
         self.rere.start_timestep()
@@ -68,6 +92,9 @@ class ANDEPEDDetector(OnlineAnomalyDetector):
         if self.rere.USE_AUTOMATIC_WS_AP:
             self.rere.auto_tune_ws_ap(self.time)
 
+        # keep the timesteps that a tuned WINDOW_SIZE can read
+        self.rere.update_horizon()
+
         # stop time measurement and update averages
         self.rere.end_timestep(self.time)
 
@@ -77,4 +104,24 @@ class ANDEPEDDetector(OnlineAnomalyDetector):
 
         gc.collect()
 
-        return [anomaly_score]
+        return [anomaly_score, self.rere.get_latest_verdict(self.time)]
+
+    def getAdditionalHeaders(self):
+        # whether the anomaly score of the record is final or may still be revised by pop_final_verdicts
+        return ['verdict']
+
+    def get_verdict(self, record: int):
+        return self.rere.get_latest_verdict(record)
+
+    def pop_final_verdicts(self, wait: bool = False):
+        """
+        Returns the final verdicts of the records that were scored with a provisional one, as their background
+        retrains finish.
+        :param wait: wait for the retrain in flight (e.g. at the end of the stream), so no verdict stays provisional
+        :return: list of (record index, anomaly score)
+        """
+        return [(time, 1.0 if anomaly else 0.0) for time, anomaly in self.rere.pop_final_verdicts(wait)]
+
+    def close(self):
+        # the background retrainer and the worker of detector 2
+        self.rere.close()
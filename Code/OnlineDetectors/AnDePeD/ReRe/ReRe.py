@@ -8,6 +8,7 @@ These variables contain the hyperparameters for AnDePeD operation.
 import numpy as np
 import pandas as pd
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 
 class ReRe:
@@ -41,6 +42,10 @@ class ReRe:
     USE_AARE_AGING = True
     USE_THD_AGING = False
     AGE_POWER = 2.5
+    AGEING_KERNEL = 'polynomial'
+    # 'polynomial' - the ageing coefficients of the window are recalculated in every timestep,
+    # 'exponential' - every timestep multiplies the coefficients by the same factor, AARE and thd are updated in O(1)
+    HALF_LIFE = None  # 'exponential': the age [timesteps] of half weight, sets AGE_POWER (None: keep AGE_POWER)
 
     USE_AUTOMATIC_WS_AP = True
 
@@ -53,6 +58,12 @@ class ReRe:
     # LSTM parameters
     NUM_EPOCHS = 30  # number of epochs
     NUM_NEURONS = 30  # number of neurons
+    LSTM_BACKEND = 'keras'  # 'keras' or 'numpy' (the same model trained in NumPy, without TensorFlow)
+    ADAPTIVE_RETRAIN = False  # retrains start from the live model and stop once the loss stops improving
+    RETRAIN_TOLERANCE = .01  # ADAPTIVE_RETRAIN: the ratio an epoch has to lower the loss by to count as an improvement
+    RETRAIN_PATIENCE = 2  # ADAPTIVE_RETRAIN: the number of epochs in a row without improvement that stop a retrain
+    ASYNC_RETRAIN = False  # retrain detector 1 on a worker thread, suspected anomalies get a provisional verdict
+    USE_DETECTOR_2 = False  # run detector 2 on a worker thread next to detector 1, anomalies need both of them
 
     # implementation parameters
     FILENAME = 'ec2_cpu_utilization_ac20cd.csv'  # the name of the imported file
@@ -66,6 +77,7 @@ class ReRe:
     NOTES = 'AnDePeD test'  # type notes here to be saved with the hyperparameters
     STATUS_BAR = True  # replaces the #/# lines showing the algorithm operation with a status bar if DEBUG == False
     BATCH_STATUS_BAR = True
+    BOUNDED_MEMORY = False  # whether to keep only the timesteps that the algorithm can still read
 
     ###############################
     # END OF USER SET PARAMETERS! #
@@ -84,9 +96,27 @@ class ReRe:
         SIGNAL_THRESHOLD_COEFF = B  # the coefficient when calculating percentage threshold of 'freq_retrain'
         TOO_LONG_ANOM_COEFF = 2.5  # this times B is the maximum allowed length of an anomaly
 
-    def __init__(self):
-        from OnlineDetectors.AnDePeD.ReRe.lstm_func import Lstm
-
+    def __init__(self, bounded: bool = False, lstm_backend: str = None, async_retrain: bool = None,
+                 detector_2: bool = None, adaptive_retrain: bool = None):
+        if lstm_backend is not None:
+            self.LSTM_BACKEND = lstm_backend
+        if adaptive_retrain is not None:
+            self.ADAPTIVE_RETRAIN = adaptive_retrain
+        if async_retrain is not None:
+            self.ASYNC_RETRAIN = async_retrain
+        if detector_2 is not None:
+            self.USE_DETECTOR_2 = detector_2
+        # TensorFlow is only imported with the Keras backend
+        if self.LSTM_BACKEND == 'numpy':
+            from OnlineDetectors.AnDePeD.ReRe.numpy_lstm import NumpyLstm as Lstm
+        elif self.LSTM_BACKEND == 'keras':
+            from OnlineDetectors.AnDePeD.ReRe.lstm_func import Lstm
+        else:
+            raise ValueError(f'Unknown LSTM backend: {self.LSTM_BACKEND}')
+
+        self.BOUNDED_MEMORY = bounded
+        self.history_horizon = 2 * self.B  # the initial values, enlarged to get_horizon() once the parameters are set
+        self.window_clamps = 0
         self.values = list()
 
         self.b_s = None
@@ -113,26 +143,53 @@ class ReRe:
         self.tmp_lstm_model_1 = Lstm(self.B, self.NUM_NEURONS)
         self.tmp_lstm_model_2 = Lstm(self.B, self.NUM_NEURONS)
 
-        # create lists
-        self.values = np.empty(self.length)
-        self.predicted_1 = list()
-        self.predicted_2 = list()
-        self.AARE_1 = list()
-        self.AARE_2 = list()
-        self.threshold_1 = list()
-        self.threshold_2 = list()
-        self.anomaly_1 = list()
-        self.anomaly_2 = list()
-        self.anomaly_aggr = list()
-        self.pattern_change_1 = list()
-        self.pattern_change_2 = list()
+        # create histories
+        self.values = self.new_history() if self.BOUNDED_MEMORY else np.empty(self.length)
+        self.predicted_1 = self.new_history()
+        self.predicted_2 = self.new_history()
+        self.AARE_1 = self.new_history()
+        self.AARE_2 = self.new_history()
+        self.threshold_1 = self.new_history()
+        self.threshold_2 = self.new_history()
+        self.anomaly_1 = self.new_history(bool)
+        self.anomaly_2 = self.new_history(bool)
+        self.anomaly_aggr = self.new_history(bool)
+        self.pattern_change_1 = self.new_history(bool)
+        self.pattern_change_2 = self.new_history(bool)
 
         # aging
         self.window_beginning = 0
+        self.ageing_weights_key = None
+        self.ageing_weights_cache = None
+        self.exponential_sums = dict()
 
         self.DO_DIFF = None
         self.DO_SCAL = None
 
+        # background retraining (init_async_retrain)
+        self.retrainer = None
+        # the worker of detector 2, its thread is only started by the first timestep
+        self.detector_2_executor = ThreadPoolExecutor(max_workers=1) if self.USE_DETECTOR_2 else None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['detector_2_executor'] = None
+        self.save_async_retrain(state)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.detector_2_executor = ThreadPoolExecutor(max_workers=1) if self.USE_DETECTOR_2 else None
+        self.restore_async_retrain()
+
+    def close(self):
+        # decide the provisional verdicts and wait for the step of detector 2 in flight, then stop the threads
+        if self.retrainer is not None:
+            self.finish_retrains(wait=True)
+            self.retrainer.close()
+        if self.detector_2_executor is not None:
+            self.detector_2_executor.shutdown()
+
     def read_testrun_data(self):
         # reading parameters from the specified file
         if self.OPERATION == 'file':
@@ -197,12 +254,18 @@ class ReRe:
         return
 
     from OnlineDetectors.AnDePeD.ReRe.initial import param_refresh, load, initialize_cons
-    from OnlineDetectors.AnDePeD.ReRe.main_algo import initialize_rere, set_values, next_timestep, get_latest_anomaly
+    from OnlineDetectors.AnDePeD.ReRe.main_algo import initialize_rere, set_values, add_value, next_timestep, \
+        get_latest_anomaly, retrain_lstm, prepare_retrain, log_retrain
+    from OnlineDetectors.AnDePeD.ReRe.async_retrain import init_async_retrain, suspect_anomaly, \
+        request_offset_retrain, finish_retrains, get_latest_verdict, pop_final_verdicts, save_async_retrain, \
+        restore_async_retrain
     from OnlineDetectors.AnDePeD.ReRe.offset_comp import init_offset_compensation, compensate_offset
     from OnlineDetectors.AnDePeD.ReRe.auto_offset_comp import init_auto_offset_compensation, auto_tune_offset
     from OnlineDetectors.AnDePeD.ReRe.timer import init_timer, start_timestep, end_timestep
     from OnlineDetectors.AnDePeD.ReRe.preprocess import preprocess
     from OnlineDetectors.AnDePeD.ReRe.auto_ws_ap import init_auto_ws_ap, auto_tune_ws_ap
     from OnlineDetectors.AnDePeD.ReRe.to_csv import init_to_csv, dump_hyperparameters, dump_results, write_time
-    from OnlineDetectors.AnDePeD.ReRe.window_ageing import update_window_beginning, ageing_coefficient
-    from OnlineDetectors.AnDePeD.ReRe.thd_aare_func import aare, thd_1, thd_2
+    from OnlineDetectors.AnDePeD.ReRe.window_ageing import update_window_beginning, ageing_coefficient, \
+        ageing_weights, invalidate_ageing_weights, exponential_decay, exponential_window_sums
+    from OnlineDetectors.AnDePeD.ReRe.thd_aare_func import aare, aare_newest_weight, thd_1, thd_2
+    from OnlineDetectors.AnDePeD.ReRe.history import new_history, get_horizon, update_horizon, get_oldest_timestep
@@ -0,0 +1,271 @@
+"""
+BACKGROUND RETRAINING
+
+With ASYNC_RETRAIN, the retrains of detector 1 run on a worker thread, so a timestep costs an LSTM prediction instead
+of an LSTM training. The retrains train the temporary model, which the live model never shares, and the two models
+are swapped (double buffering) instead of copying the weights of one into the other.
+A timestep that might be an anomaly gets the provisional verdict ANOMALY, which the synchronous algorithm would also
+give it; its final verdict (anomaly or pattern change) is decided once the retrain it waits for has finished. The
+timesteps suspected while a retrain is in flight wait for one more retrain, on the values before the last of them.
+Saving AnDePeD does not wait for the retrain in flight: the temporary model is saved as it was when the retrain was
+submitted, and the restored AnDePeD submits the retrain again.
+"""
+
+import collections
+import pickle
+import queue
+import threading
+
+import numpy as np
+
+
+class BackgroundRetrainer:
+    """
+    Runs retrains one after the other on a daemon thread. The results (or the errors) of the finished retrains are
+    collected by the caller, which is the only one to touch the models of AnDePeD between the retrains.
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.finished = []
+        self.lock = threading.Lock()
+        self.pending = 0  # the number of submitted retrains whose results have not been collected yet
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+        return
+
+    def __getstate__(self):
+        # the running thread is not saved, only the results of the finished retrains, without waiting for the others
+        return {'finished': self.get_finished()}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.finished = state['finished']
+        self.pending = len(self.finished)
+
+    def get_finished(self):
+        """
+        Returns the results (or the errors) of the retrains that have finished but have not been collected yet,
+        without waiting for the others.
+        """
+        with self.lock:
+            return list(self.finished)
+
+    def submit(self, function, *args):
+        """
+        Queue a retrain.
+        :param function: the training function, e.g. the train_lstm of the temporary model
+        :param args: arguments of function
+        :return:
+        """
+        self.pending += 1
+        self.jobs.put((function, args))
+        return
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                function, args = job
+                try:
+                    result = (function(*args), None)
+                except Exception as error:
+                    result = (None, error)
+                with self.lock:
+                    self.finished.append(result)
+            finally:
+                self.jobs.task_done()
+
+    def wait(self):
+        """
+        Wait until every submitted retrain has finished.
+        """
+        self.jobs.join()
+        return
+
+    def collect(self):
+        """
+        Returns the results of the retrains finished since the previous call, in the order of submission.
+        """
+        with self.lock:
+            finished, self.finished = self.finished, []
+        self.pending -= len(finished)
+        for _, error in finished:
+            if error is not None:
+                raise RuntimeError('A background retrain of AnDePeD failed.') from error
+        return [result for result, _ in finished]
+
+    def close(self):
+        """
+        Wait for the submitted retrains, then stop the background thread.
+        """
+        if not self.thread.is_alive():
+            return
+        self.wait()
+        self.jobs.put(None)
+        self.thread.join()
+        return
+
+
+def init_async_retrain(self):
+    self.retrainer = BackgroundRetrainer() if self.ASYNC_RETRAIN else None
+    self.retrain_time_1 = None  # the timestep the retrain in flight was started at
+    self.retrain_job_1 = None  # the temporary model (pickled) and the arguments the retrain in flight started with
+    self.retrain_suspects_1 = []  # the timesteps waiting for the retrain in flight to decide their verdict
+    self.next_suspects_1 = []  # the timesteps suspected since, waiting for the next retrain
+    self.next_train_data_1 = None  # the training data of the next retrain
+    self.retrain_swap_1 = False  # whether the retrained model replaces the live one whatever the verdicts are
+    self.provisional_timesteps = set()
+    self.final_verdicts = collections.deque()  # (timestep, anomaly) of the verdicts decided since the last pop
+
+
+# the timestep might be an anomaly: give it a provisional verdict and let a background retrain decide it
+def suspect_anomaly(self, time):
+    # what the re-prediction of the timestep and its AARE need, as the window moves on meanwhile
+    suspect = (time, np.array(self.values[time - self.B + 1:time], dtype=float), float(self.values[time]),
+               float(self.predicted_1[time]), float(self.AARE_1[time]), float(self.threshold_1[time]),
+               self.aare_newest_weight(time, self.predicted_1))
+    self.anomaly_1.insert(time, True)
+    self.pattern_change_1.insert(time, False)
+    self.provisional_timesteps.add(time)
+    if not self.STATUS_BAR:
+        print('ANOMALY_1 (provisional) at timestep {}!'.format(time))
+    # predict the next value with the live model, as after an anomaly
+    self.predicted_1.insert(time + 1, self.lstm_model_1.predict_lstm(self.values[time - self.B + 2:time + 1]))
+    if self.retrain_time_1 is None:
+        self.retrain_suspects_1.append(suspect)
+        start_background_retrain(self, time, self.values[time - self.B:time])
+    else:
+        # the timestep waits for the next retrain, which only trains on the values before the last such timestep
+        self.next_suspects_1.append(suspect)
+        self.next_train_data_1 = np.array(self.values[time - self.B:time], dtype=float)
+
+
+# the offset compensation asks for the retrained model to replace the live one
+def request_offset_retrain(self, time):
+    # a retrain already in flight trained on almost the same values
+    self.retrain_swap_1 = True
+    if self.retrain_time_1 is None:
+        start_background_retrain(self, time, self.values[time - self.B:time])
+
+
+def start_background_retrain(self, time, train_data):
+    # the warm start copies the weights on this thread, before the training touches the temporary model
+    tolerance = self.prepare_retrain(self.tmp_lstm_model_1, self.lstm_model_1)
+    self.retrain_time_1 = time
+    self.retrain_job_1 = (pickle.dumps(self.tmp_lstm_model_1, protocol=pickle.HIGHEST_PROTOCOL),
+                          np.array(train_data, dtype=float), tolerance)
+    submit_retrain(self)
+
+
+def submit_retrain(self):
+    _, train_data, tolerance = self.retrain_job_1
+    self.retrainer.submit(self.tmp_lstm_model_1.train_lstm, train_data, self.NUM_EPOCHS, False, tolerance,
+                          self.RETRAIN_PATIENCE)
+
+
+# the state of AnDePeD to save, without waiting for the retrain in flight
+def save_async_retrain(self, state):
+    if self.retrainer is None:
+        return
+    # the results are taken once, so the saved retrainer and the saved temporary model agree on what has finished
+    state['retrainer'] = finished = self.retrainer.get_finished()
+    if len(finished) < self.retrainer.pending:
+        # the temporary model is being trained, it is restored from retrain_job_1
+        state['tmp_lstm_model_1'] = None
+
+
+# restart the background retrains of AnDePeD restored from a state saved by save_async_retrain
+def restore_async_retrain(self):
+    if self.retrainer is None:
+        return
+    finished = self.retrainer
+    self.retrainer = BackgroundRetrainer()
+    self.retrainer.finished = finished
+    self.retrainer.pending = len(finished)
+    if self.tmp_lstm_model_1 is None:
+        self.tmp_lstm_model_1 = pickle.loads(self.retrain_job_1[0])
+        submit_retrain(self)
+
+
+# decide the provisional verdicts whose retrain has finished, with wait: every provisional verdict
+def finish_retrains(self, wait=False):
+    while self.retrainer is not None and self.retrain_time_1 is not None:
+        if wait:
+            self.retrainer.wait()
+        results = self.retrainer.collect()
+        if not results:
+            return
+        finish_retrain(self, results[0])
+
+
+def finish_retrain(self, epochs):
+    if self.retrain_time_1 >= self.retrain_epochs.first:
+        self.log_retrain(self.retrain_time_1, epochs)
+
+    trained = self.tmp_lstm_model_1
+    swap = self.retrain_swap_1
+    for time, prev_data, value, prediction, aare, threshold, weight in self.retrain_suspects_1:
+        # predict the timestep again with the retrained model, only the error of the timestep changes in its AARE
+        new_prediction = trained.predict_lstm(prev_data)
+        aare += weight * (relative_error(value, new_prediction) - relative_error(value, prediction))
+        anomaly = aare > threshold
+        swap = swap or not anomaly
+        if time >= self.anomaly_1.first:
+            self.anomaly_1[time] = anomaly
+            self.pattern_change_1[time] = not anomaly
+            if self.USE_AUTOMATIC_WS_AP:
+                # the WS/AP criteria index the signals again from the decided timestep
+                self.anomaly_runs_1.truncate(time)
+                self.pattern_change_runs_1.truncate(time)
+        if time < len(self.anomaly_aggr) and time >= self.anomaly_aggr.first:
+            self.anomaly_aggr[time] = anomaly and (not self.USE_DETECTOR_2 or bool(self.anomaly_2[time]))
+        self.provisional_timesteps.discard(time)
+        self.final_verdicts.append((time, anomaly))
+        if self.DEBUG:
+            print('\t\t{} found at timestep {}.'.format('ANOMALY_1' if anomaly else 'PATTERN CHANGE_1', time))
+
+    # a pattern change or an offset retrain replaces the live model with the retrained one
+    if swap:
+        swap_lstm_models(self)
+    self.retrain_time_1 = None
+    self.retrain_job_1 = None
+    self.retrain_swap_1 = False
+
+    # the timesteps suspected meanwhile get their retrain now
+    self.retrain_suspects_1, self.next_suspects_1 = self.next_suspects_1, []
+    if self.retrain_suspects_1:
+        start_background_retrain(self, self.retrain_suspects_1[-1][0], self.next_train_data_1)
+        self.next_train_data_1 = None
+
+
+def relative_error(value, prediction):
+    return abs(value - prediction) / abs(value) if value != 0 else 0.0
+
+
+def swap_lstm_models(self):
+    live, trained = self.lstm_model_1, self.tmp_lstm_model_1
+    # the live model goes on from its own state, as if the retrained weights had been copied into it
+    live.state, trained.state = trained.state, live.state
+    for lstm_model in (live, trained):
+        if hasattr(lstm_model, 'state_changed'):
+            lstm_model.state_changed = True
+    self.lstm_model_1, self.tmp_lstm_model_1 = trained, live
+
+
+# 'provisional' if the verdict of the timestep still waits for a background retrain, 'final' otherwise
+def get_latest_verdict(self, time):
+    return 'provisional' if time in self.provisional_timesteps else 'final'
+
+
+# the (timestep, anomaly) pairs of the verdicts decided since the previous call, with wait: every pending one
+def pop_final_verdicts(self, wait=False):
+    if wait:
+        self.finish_retrains(wait=True)
+    verdicts = list(self.final_verdicts)
+    self.final_verdicts.clear()
+    return verdicts
@@ -5,41 +5,44 @@ This file contains the algorithm for automatically tuning offset compensation pa
 """
 
 import numpy as np
+from OnlineDetectors.AnDePeD.ReRe.offset_comp import offset_window_sums
 
 
 def init_auto_offset_compensation(self):
     if self.USE_OFFSET_COMP and self.USE_AUTOMATIC_OFFSET:
-        self.offset_percentage_1 = list()
-        # self.offset_percentage_2 = list()
-        self.retrain_percentage_1 = list()
-        # self.retrain_percentage_2 = list()
+        self.offset_percentage_1 = self.new_history()
+        self.offset_percentage_2 = self.new_history()
+        self.retrain_percentage_1 = self.new_history()
+        self.retrain_percentage_2 = self.new_history()
 
         # the first 2B-2 indices won't be used for these (first used at t = 2B - 1)
         for i in range(0, 2 * self.B - 1):
             self.offset_percentage_1.insert(i, np.NaN)
-            # self.offset_percentage_2.insert(i, np.NaN)
             self.retrain_percentage_1.insert(i, np.NaN)
-            # self.retrain_percentage_2.insert(i, np.NaN)
+            if self.USE_DETECTOR_2:
+                self.offset_percentage_2.insert(i, np.NaN)
+                self.retrain_percentage_2.insert(i, np.NaN)
 
 
 def auto_tune_offset(self, time):
     # automatic tuning of parameters, if allowed:
     if self.USE_AUTOMATIC_OFFSET:
         if time > 2 * self.B - 1 + 2 * self.offset_ws_actual:
-            # count the number of retrains in the offset window
-            rp_tmp_1 = 0
-            rp_tmp_2 = 0
-            for y in range(self.offset_window_beg, time + 1):
-                if self.pattern_change_1[y] or self.anomaly_1[y] or self.offset_retrain_trigger_1[y]:
-                    rp_tmp_1 += 1
-                # if self.pattern_change_2[y] or self.anomaly_2[y] or self.offset_retrain_trigger_2[y]:
-                #     rp_tmp_2 += 1
+            # count the number of retrains in the offset window, with a sliding count
+            rp_tmp_1, _ = offset_window_sums(self, 'retrains_1', time, lambda begin, end: (
+                self.pattern_change_1.flags(begin, end) | self.anomaly_1.flags(begin, end) |
+                self.offset_retrain_trigger_1.flags(begin, end)))
             # calculate RP for both detectors
             self.retrain_percentage_1.insert(time, rp_tmp_1 / self.offset_ws_actual)
-            # self.retrain_percentage_2.insert(time, rp_tmp_2 / self.offset_ws_actual)
+            if self.USE_DETECTOR_2:
+                rp_tmp_2, _ = offset_window_sums(self, 'retrains_2', time, lambda begin, end: (
+                    self.pattern_change_2.flags(begin, end) | self.anomaly_2.flags(begin, end) |
+                    self.offset_retrain_trigger_2.flags(begin, end)))
+                self.retrain_percentage_2.insert(time, rp_tmp_2 / self.offset_ws_actual)
 
             # calculate RP_MAX
-            # for ReRe, we divide ACCEPTABLE_AVG_DURATION by two as both detectors compete for resources
+            # ACCEPTABLE_AVG_DURATION is not divided by two for detector 2: the detectors retrain concurrently, and
+            # avg_dur_lstm is the duration of a timestep in which either or both of them retrain
             RETRAIN_PERCENTAGE_LIMIT = ((self.offset_ws_actual - 1) / self.offset_ws_actual) * \
                                        (((self.ACCEPTABLE_AVG_DURATION / 1) - self.avg_dur_normal) /
                                         (self.avg_dur_lstm - self.avg_dur_normal))
@@ -55,21 +58,24 @@ def auto_tune_offset(self, time):
                     self.offset_percentage_curr = 0
 
             # if RP is above a limit, raise OP to the maximum for detector 2
-            # if self.retrain_percentage_2[time] > RETRAIN_PERCENTAGE_LIMIT:
-            #     self.offset_percentage_curr_2 = 1
-            # # otherwise reduce it gradually over the offset window
-            # else:
-            #     if self.offset_percentage_curr_2 > 1 / self.offset_ws_actual:
-            #         self.offset_percentage_curr_2 -= 1 / self.offset_ws_actual
-            #     else:
-            #         self.offset_percentage_curr = 0
+            if self.USE_DETECTOR_2:
+                if self.retrain_percentage_2[time] > RETRAIN_PERCENTAGE_LIMIT:
+                    self.offset_percentage_curr_2 = 1
+                # otherwise reduce it gradually over the offset window
+                else:
+                    if self.offset_percentage_curr_2 > 1 / self.offset_ws_actual:
+                        self.offset_percentage_curr_2 -= 1 / self.offset_ws_actual
+                    else:
+                        self.offset_percentage_curr_2 = 0
 
             # save settings
             self.offset_percentage_1.insert(time, self.offset_percentage_curr_1)
-            # self.offset_percentage_2.insert(time, self.offset_percentage_curr_2)
+            if self.USE_DETECTOR_2:
+                self.offset_percentage_2.insert(time, self.offset_percentage_curr_2)
 
         else:
             self.retrain_percentage_1.insert(time, np.NaN)
-            # self.retrain_percentage_2.insert(time, np.NaN)
             self.offset_percentage_1.insert(time, np.NaN)
-            # self.offset_percentage_2.insert(time, np.NaN)
+            if self.USE_DETECTOR_2:
+                self.retrain_percentage_2.insert(time, np.NaN)
+                self.offset_percentage_2.insert(time, np.NaN)
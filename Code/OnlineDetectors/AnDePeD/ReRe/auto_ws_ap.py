@@ -7,16 +7,20 @@ These parameters are tuned based on the output of Detector 1.
 
 import AnDePeD.ReRe.auto_ws_ap_criteria as criteria
 import numpy as np
+from OnlineDetectors.AnDePeD.ReRe.window_ageing import equivalent_half_life
 
 
 def init_auto_ws_ap(self):
     if self.USE_AUTOMATIC_WS_AP:
-        self.window_size = list()
-        self.age_power = list()
-        self.anom_flap = list()
-        self.freq_sig = list()
-        self.long_anom = list()
-        self.no_sig = list()
+        self.window_size = self.new_history(int)
+        self.age_power = self.new_history()
+        self.anom_flap = self.new_history(bool)
+        self.freq_sig = self.new_history(bool)
+        self.long_anom = self.new_history(bool)
+        self.no_sig = self.new_history(bool)
+        self.anomaly_runs_1 = criteria.SignalRuns()
+        self.pattern_change_runs_1 = criteria.SignalRuns()
+        self.squared_difference_sums = self.new_history()
         self.window_size.insert(0, self.WINDOW_SIZE)
         self.age_power.insert(0, self.AGE_POWER)
         self.last_correction = 0
@@ -32,6 +36,9 @@ def auto_tune_ws_ap(self, time):
     if self.USE_AUTOMATIC_WS_AP:
         # if the last adjustment happened more than B timesteps ago (and we are past the initial timesteps)
         if (time >= self.last_correction + self.DECISION_FREQ) and (time >= (2 * self.B - 1) + self.B):
+            # the criteria read the signals of detector 1 from their run-length indices
+            criteria.update_signal_runs(self, time, self.anomaly_1, self.pattern_change_1)
+
             # adjusting WS
             if self.op == 0:
                 self.op = 1
@@ -39,15 +46,16 @@ def auto_tune_ws_ap(self, time):
                     print('\t\tAutomatic WS & AP/Step WS. Checking conditions...')
 
                 # WS_MIN = anomaly flapping or frequent signals
-                ws_min_1 = criteria.check_anom_flap(self, time, self.anomaly_1, self.pattern_change_1)
+                ws_min_1 = criteria.check_anom_flap(self, time, self.anomaly_runs_1, self.pattern_change_runs_1)
                 self.anom_flap.insert(time, ws_min_1)
-                ws_min_2 = criteria.check_freq_sig(self, time, self.anomaly_1, self.pattern_change_1, self.values)
+                ws_min_2 = criteria.check_freq_sig(self, time, self.anomaly_runs_1, self.pattern_change_runs_1,
+                                                   self.values)
                 self.freq_sig.insert(time, ws_min_2)
                 ws_min_3 = criteria.check_small_area(self, self.window_size[time-1], self.age_power[time-1])
                 WS_MIN = ws_min_1 or ws_min_2 or ws_min_3
 
                 # WS_MAX = long anomalies or no signals
-                ws_max_1 = criteria.check_long_anom(self, time, self.anomaly_1)
+                ws_max_1 = criteria.check_long_anom(self, time, self.anomaly_runs_1)
                 self.long_anom.insert(time, ws_max_1)
                 ws_max_2 = criteria.check_no_sig(self, time, self.anomaly_1, self.pattern_change_1)
                 self.no_sig.insert(time, ws_max_2)
@@ -92,15 +100,16 @@ def auto_tune_ws_ap(self, time):
                     print('\t\tAutomatic WS & AP/Step AP. Checking conditions...')
 
                 # AP_MAX = anomaly flapping or frequent signals
-                ap_max_1 = criteria.check_anom_flap(self, time, self.anomaly_1, self.pattern_change_1)
+                ap_max_1 = criteria.check_anom_flap(self, time, self.anomaly_runs_1, self.pattern_change_runs_1)
                 self.anom_flap.insert(time, ap_max_1)
-                ap_max_2 = criteria.check_freq_sig(self, time, self.anomaly_1, self.pattern_change_1, self.values)
+                ap_max_2 = criteria.check_freq_sig(self, time, self.anomaly_runs_1, self.pattern_change_runs_1,
+                                                   self.values)
                 self.freq_sig.insert(time, ap_max_2)
                 ap_max_3 = criteria.check_small_area(self, self.window_size[time - 1], self.age_power[time - 1])
                 AP_MAX = ap_max_1 or ap_max_2 or ap_max_3
 
                 # AP_MIN = long anomalies or no signals or a smaller than one AP
-                ap_min_1 = criteria.check_long_anom(self, time, self.anomaly_1)
+                ap_min_1 = criteria.check_long_anom(self, time, self.anomaly_runs_1)
                 self.long_anom.insert(time, ap_min_1)
                 ap_min_2 = criteria.check_no_sig(self, time, self.anomaly_1, self.pattern_change_1)
                 self.no_sig.insert(time, ap_min_2)
@@ -150,9 +159,16 @@ def auto_tune_ws_ap(self, time):
             self.long_anom.insert(time, np.NaN)
             self.no_sig.insert(time, np.NaN)
 
+        # the cached ageing weights belong to the old WINDOW_SIZE and AGE_POWER
+        # (with exponential ageing, these two set the half-life, so it is tuned along with them)
+        if self.WINDOW_SIZE != self.window_size[time - 1] or self.AGE_POWER != self.age_power[time - 1]:
+            self.invalidate_ageing_weights()
+
         # after tuning, insert parameters into the lists
         self.window_size.insert(time, self.WINDOW_SIZE)
         self.age_power.insert(time, self.AGE_POWER)
 
         if self.DEBUG:
             print('\t\t\tWINDOW_SIZE: {}, AGE_POWER: {}'.format(self.WINDOW_SIZE, self.AGE_POWER))
+            if self.AGEING_KERNEL == 'exponential':
+                print('\t\t\tHALF_LIFE: {}'.format(equivalent_half_life(self.WINDOW_SIZE, self.AGE_POWER)))
@@ -2,40 +2,130 @@
 CRITERIA FUNCTIONS FOR EXTREME VALUES OF WS AND AP
 
 These functions detect signs of too high or too low values of the WINDOW_SIZE and AGE_POWER parameters.
+The signals of the signal database are read from run-length indices (SignalRuns) and the squared differences of the
+values from their prefix sums, so a criterion costs the number of signals in the database instead of its length.
 """
 
+import bisect
+
+import numpy as np
+
+
+class SignalRuns:
+    """
+    Run-length index of a flag history (e.g. anomaly_1): the runs of consecutive truthy timesteps, by their starts and
+    ends (the end is excluded, None while the run goes on). Each update indexes the timesteps stored since the previous
+    one, and the runs that have left the signal database are forgotten. A flag changed after it has been indexed
+    (e.g. by a background retrain) truncates the index back to its timestep.
+    A run already going on at the first indexed timestep starts there, which no criterion counts as a start.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.begin = None  # the first indexed timestep
+        self.end = None  # the timesteps before end are indexed
+
+    def update(self, flags, time, begin):
+        """
+        Index the flags up to time.
+        :param flags: flag history
+        :param time: current timestep
+        :param begin: the first timestep to index when the index is empty
+        :return:
+        """
+        if self.end is None:
+            self.begin = self.end = begin
+        if time < self.end:
+            return
+        running = len(self.ends) > 0 and self.ends[-1] is None
+        changes = np.diff(np.concatenate(([running], flags.flags(self.end, time + 1))).astype(np.int8))
+        for position in np.flatnonzero(changes):
+            if changes[position] > 0:
+                self.starts.append(self.end + int(position))
+                self.ends.append(None)
+            else:
+                self.ends[-1] = self.end + int(position)
+        self.end = time + 1
+
+    def truncate(self, timestep):
+        """
+        Forget the flags indexed from timestep on, the next update indexes them again.
+        """
+        if self.end is None or timestep >= self.end:
+            return
+        if timestep <= self.begin:
+            self.__init__()
+            return
+        while self.starts and self.starts[-1] >= timestep:
+            self.starts.pop()
+            self.ends.pop()
+        if self.ends and (self.ends[-1] is None or self.ends[-1] >= timestep):
+            self.ends[-1] = None
+        self.end = timestep
+
+    def forget(self, before):
+        """
+        Forget the runs that end before the timestep before.
+        """
+        count = 0
+        while count < len(self.ends) and self.ends[count] is not None and self.ends[count] <= before:
+            count += 1
+        del self.starts[:count]
+        del self.ends[:count]
+
+    def runs(self, begin):
+        """
+        :return: (start, end) of the runs starting after the timestep begin, an ongoing run ends with the index
+        """
+        first = bisect.bisect_right(self.starts, begin)
+        return [(start, self.end if end is None else end) for start, end in zip(self.starts[first:], self.ends[first:])]
+
+    def any(self, begin, end):
+        """
+        :return: whether any of the timesteps begin ... end - 1 is in a run
+        """
+        # the runs do not overlap, so of those starting before end, the last one ends the latest
+        last = bisect.bisect_left(self.starts, end) - 1
+        return last >= 0 and (self.ends[last] is None or self.ends[last] > begin)
+
+
+# calculating database
+def get_database_beginning(self, time):
+    if time - self.SIGNAL_DATABASE_LEN + 1 <= self.B:
+        return self.B
+    return time - self.SIGNAL_DATABASE_LEN + 1
+
+
+# index the anomalies and pattern changes of the signal database up to time
+def update_signal_runs(self, time, anom, patt):
+    database_beginning = get_database_beginning(self, time)
+    for runs, flags in ((self.anomaly_runs_1, anom), (self.pattern_change_runs_1, patt)):
+        runs.update(flags, time, database_beginning)
+        runs.forget(database_beginning)
+
+
+# the sum of the squared differences of the values over the timesteps begin ... time, from their prefix sums
+def squared_difference_sum(self, values, begin, time):
+    sums = self.squared_difference_sums
+    if len(sums) == 0:
+        sums.insert(self.B, 0.0)
+    for y in range(len(sums), time + 1):
+        sums.insert(y, sums[y - 1] + (float(values[y]) - float(values[y - 1])) ** 2)
+    return sums[time] - sums[begin]
+
 
 def check_anom_flap(self, time, anom, patt):
-    # calculating database
-    if time - self.SIGNAL_DATABASE_LEN + 1 <= self.B:
-        database_beginning = self.B
-    else:
-        database_beginning = time - self.SIGNAL_DATABASE_LEN + 1
-
-    # detect flapping
-    for y in range(database_beginning + 1, time + 1):
-        anom_length = 0
-        no_length = 0
-        # if the start of an anomaly is detected, ...
-        if (not anom[y - 1]) and anom[y]:
-            # ... start counting its length
-            for z in range(y, time + 1):
-                # if the anomaly is over, stop the count
-                if anom[z - 1] and (not anom[z]):
-                    break
-                else:
-                    anom_length += 1
-            # we have counted the length of the anomaly, then let's count the no's after it
-            for zz in range(y + anom_length, time + 1):
-                # if we have reached the anomaly length, or found a pattern change, break, there is no flapping
-                if no_length > self.FLAPPING_LENGTH_COEFF * anom_length or patt[zz]:
-                    break
-                elif (not anom[zz - 1]) and anom[zz]:
-                    if self.DEBUG:
-                        print('\t\t\tanomaly flapping: True')
-                    return True
-                else:
-                    no_length += 1
+    database_beginning = get_database_beginning(self, time)
+
+    # detect flapping: another anomaly starts at most FLAPPING_LENGTH_COEFF times the length of an anomaly after it,
+    # with no pattern change in between
+    runs = anom.runs(database_beginning)
+    for (start, end), (next_start, _) in zip(runs, runs[1:]):
+        if next_start - end <= self.FLAPPING_LENGTH_COEFF * (end - start) and not patt.any(end, next_start + 1):
+            if self.DEBUG:
+                print('\t\t\tanomaly flapping: True')
+            return True
 
     if self.DEBUG:
         print('\t\t\tanomaly flapping: False')
@@ -43,25 +133,17 @@ def check_anom_flap(self, time, anom, patt):
 
 
 def check_freq_sig(self, time, anom, patt, orig):
-    # calculating database
-    if time - self.SIGNAL_DATABASE_LEN + 1 <= self.B:
-        database_beginning = self.B
-    else:
-        database_beginning = time - self.SIGNAL_DATABASE_LEN + 1
+    database_beginning = get_database_beginning(self, time)
 
     # calculate the signal threshold based on the original data in the window
-    sum_ = 0
-    for y in range(self.window_beginning, time):
-        # sum_ += abs(orig[y + 1] - orig[y])
-        sum_ += (orig[y + 1] - orig[y]) ** 2
+    sum_ = squared_difference_sum(self, orig, self.window_beginning, time)
     signal_threshold = self.SIGNAL_THRESHOLD_COEFF * sum_ / (time - self.window_beginning)
 
-    # calculate the signal ratio based on the number of signals in the signal database
-    signalcount = 0
-    for y in range(database_beginning + 1, time + 1):
-        if ((not anom[y - 1]) and anom[y]) or (patt[y] and not patt[y - 1]):
-            signalcount += 1
-    signal_ratio_dat = signalcount / (time - database_beginning)
+    # calculate the signal ratio based on the number of signals (beginning of an anomaly or of a pattern change)
+    # in the signal database
+    signals = {start for start, _ in anom.runs(database_beginning)} | \
+        {start for start, _ in patt.runs(database_beginning)}
+    signal_ratio_dat = len(signals) / (time - database_beginning)
 
     if self.DEBUG:
         print('\t\t\tfrequent signalling: {}'.format(str(signal_ratio_dat > signal_threshold)))
@@ -69,29 +151,14 @@ def check_freq_sig(self, time, anom, patt, orig):
 
 
 def check_long_anom(self, time, anom):
-    # calculating database
-    if time - self.SIGNAL_DATABASE_LEN + 1 <= self.B:
-        database_beginning = self.B
-    else:
-        database_beginning = time - self.SIGNAL_DATABASE_LEN + 1
-
-    # detect long anomalies (longer than TOO_LONG_ANOM_COEFF*B)
-    for y in range(database_beginning + 1, time + 1):
-        anom_length = 0
-        # if the start of an anomaly is detected, ...
-        if (not anom[y - 1]) and anom[y]:
-            # ... start counting its length
-            for z in range(y, time + 1):
-                # if the anomaly is over, stop the count
-                if anom[z - 1] and (not anom[z]):
-                    break
-                else:
-                    anom_length += 1
-            # if the counted length is larger than TOO_LONG_ANOM_COEFF*B, signal a long anomaly
-            if anom_length > self.TOO_LONG_ANOM_COEFF * self.B:
-                if self.DEBUG:
-                    print('\t\t\tlong anomalies: True')
-                return True
+    database_beginning = get_database_beginning(self, time)
+
+    # detect long anomalies (longer than TOO_LONG_ANOM_COEFF*B), an ongoing one counts until time
+    for start, end in anom.runs(database_beginning):
+        if end - start > self.TOO_LONG_ANOM_COEFF * self.B:
+            if self.DEBUG:
+                print('\t\t\tlong anomalies: True')
+            return True
 
     if self.DEBUG:
         print('\t\t\tlong anomalies: False')
@@ -4,28 +4,84 @@ LSTM FUNCTIONS
 Designed for the AnDePeD algorithm.
 """
 
+import numpy as np
 from keras.models import Sequential
 from keras.layers import Input
 from keras.layers import LSTM
 from keras.layers import Dense
+from keras.callbacks import Callback
+
+from OnlineDetectors.AnDePeD.ReRe.numpy_lstm import export_weights, lstm_forward, EarlyStopping
+
+
+class EarlyStoppingCallback(Callback):
+    # stops model.fit once the EarlyStopping of numpy_lstm says so
+    def __init__(self, early_stopping):
+        super().__init__()
+        self.early_stopping = early_stopping
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.early_stopping.stop(logs['loss']):
+            self.model.stop_training = True
 
 
 class Lstm:
+    # predict with the NumPy forward pass of numpy_lstm instead of Keras, only turn it on once
+    # benchmark.check_lstm_inference_parity has passed with the TensorFlow and Keras versions in use
+    NUMPY_INFERENCE = False
+
     def __init__(self, b, num_neurons):
+        self.b = b
+        self.num_neurons = num_neurons
         self.model = Sequential()
         self.model.add(Input(shape=(b-1, 1), batch_size=1))
         self.model.add(LSTM(units=num_neurons, return_sequences=False, stateful=True))
         self.model.add(Dense(1))
         self.model.compile(loss='mse', optimizer='adam')
 
-    def train_lstm(self, train_data, num_epochs, debug):
+        # copies of the weights and of the state of the LSTM layer for the NumPy forward pass; while predictions are
+        # made with it, the state of the Keras layer is only updated before the next training
+        self.weights = export_weights(self.model.get_weights())
+        self.state = self.get_layer_state()
+        self.state_changed = False
+
+    def get_layer_state(self):
+        layer_states = getattr(self.model.layers[0], 'states', None) or []
+        state = [np.zeros((1, self.num_neurons), dtype=np.float32) if s is None else
+                 np.array(s, dtype=np.float32).reshape(1, self.num_neurons) for s in layer_states]
+        return state if len(state) == 2 else [np.zeros((1, self.num_neurons), dtype=np.float32) for _ in range(2)]
+
+    def set_layer_state(self, state):
+        layer_states = getattr(self.model.layers[0], 'states', None) or []
+        for layer_state, value in zip(layer_states, state):
+            if layer_state is not None and value is not None:
+                layer_state.assign(np.reshape(value, layer_state.shape))
+
+    def train_lstm(self, train_data, num_epochs, debug, tolerance=None, patience=1):
+        """
+        Train the model on one window of values, the last of which is the value to predict.
+        :param train_data: B values
+        :param num_epochs: the (largest) number of epochs
+        :param debug: print when the training is done
+        :param tolerance: stop early once patience epochs in a row have not lowered the loss by at least this ratio,
+                          None: train for num_epochs
+        :param patience: see tolerance
+        :return: the number of epochs used
+        """
+        if self.state_changed:
+            self.set_layer_state(self.state)
+            self.state_changed = False
+
         # splitting and reshaping data:
         x_train = train_data[:-1]
         y_train = train_data[-1]
         x_train = x_train.reshape(1, x_train.shape[0], 1)
         y_train = y_train.reshape(1)
 
-        self.model.fit(x_train, y_train, batch_size=1, epochs=num_epochs, verbose=0, shuffle=False)
+        callbacks = [] if tolerance is None else [EarlyStoppingCallback(EarlyStopping(tolerance, patience))]
+        history = self.model.fit(x_train, y_train, batch_size=1, epochs=num_epochs, verbose=0, shuffle=False,
+                                 callbacks=callbacks)
+        epochs = len(history.history['loss'])
 
         # for count in range(num_epochs):
         #     self.model.fit(x_train,
@@ -35,18 +91,42 @@ class Lstm:
         #                    verbose=0,
         #                    shuffle=False)
         #     self.model.reset_states()
+        self.weights = export_weights(self.model.get_weights())
+        self.state = self.get_layer_state()
         if debug:
-            print('\t\tLSTM training done.')
+            print('\t\tLSTM training done in {} epochs.'.format(epochs))
+        return epochs
 
     def predict_lstm(self, prev_data):
         # def predict_lstm(self, prev_data, time, debug, total_length, next_val):
-        prev_data = prev_data.reshape(1, prev_data.shape[0], 1)
-        pred = self.model.predict(prev_data, verbose=0)
+        if self.NUMPY_INFERENCE:
+            pred, self.state[0], self.state[1] = lstm_forward(self.weights, prev_data, *self.state)
+            self.state_changed = True
+        else:
+            if self.state_changed:
+                self.set_layer_state(self.state)
+                self.state_changed = False
+            prev_data = prev_data.reshape(1, prev_data.shape[0], 1)
+            pred = self.model.predict(prev_data, verbose=0)[0, 0]
+            self.state = self.get_layer_state()
         # if debug:
-        #     print('\t\tNew prediction made, value: {}'.format(round(float(pred[0, 0]), 5)))
+        #     print('\t\tNew prediction made, value: {}'.format(round(float(pred), 5)))
         #     if time < total_length - 1:
         #         print('\t\t(Actual value: {})'.format(round(float(next_val), 5)))
-        return pred[0, 0]
+        return pred
 
     def set_weights(self, lstm):
-        self.model.set_weights(lstm.model.get_weights())
+        self.model.set_weights(lstm.weights)
+        self.weights = [weight.copy() for weight in lstm.weights]
+
+    def __getstate__(self):
+        # Keras models are saved as their weights and the state of the stateful LSTM layer
+        return {'b': self.b, 'num_neurons': self.num_neurons, 'weights': self.model.get_weights(),
+                'states': [s.copy() for s in self.state]}
+
+    def __setstate__(self, state):
+        self.__init__(state['b'], state['num_neurons'])
+        self.model.set_weights(state['weights'])
+        self.weights = export_weights(state['weights'])
+        self.set_layer_state(state['states'])
+        self.state = self.get_layer_state()
@@ -15,18 +15,17 @@ def initialize_rere(self):
     # the first B-1 indices won't be used for predicted and AARE (first used at t=B)
     for i in range(0, self.B):
         self.predicted_1.insert(i, np.NaN)
-        # self.predicted_2.insert(i, np.NaN)
         self.AARE_1.insert(i, np.NaN)
-        # self.AARE_2.insert(i, np.NaN)
     # the first 2B-2 indices won't be used for threshold, anomaly and pattern_change (first used at t = 2B - 1)
     for i in range(0, 2 * self.B - 1):
         self.threshold_1.insert(i, np.NaN)
-        # self.threshold_2.insert(i, np.NaN)
         self.anomaly_1.insert(i, np.NaN)
-        # self.anomaly_2.insert(i, np.NaN)
         self.anomaly_aggr.insert(i, np.NaN)
         self.pattern_change_1.insert(i, np.NaN)
-        # self.pattern_change_2.insert(i, np.NaN)
+        if self.USE_DETECTOR_2:
+            self.threshold_2.insert(i, np.NaN)
+            self.anomaly_2.insert(i, np.NaN)
+            self.pattern_change_2.insert(i, np.NaN)
 
     # if self.OPERATION == 'file':
     #     print('\n' + '/' + '-' * 30)
@@ -39,7 +38,15 @@ def set_values(self, values_in):
     return
 
 
+# with bounded memory, the values are stored in a history instead of being set from a buffer
+def add_value(self, value):
+    self.values.append(value)
+    return
+
+
 def get_latest_anomaly(self):
+    if self.USE_DETECTOR_2:
+        return self.anomaly_aggr[-1]
     return self.anomaly_1[-1]
 
 
@@ -67,7 +74,7 @@ def next_timestep(self, time):
             print('\tStep 2')
         # training the model
 
-        self.lstm_model_1.train_lstm(self.values[0:self.B], self.NUM_EPOCHS, self.DEBUG)
+        self.retrain_lstm(time, self.lstm_model_1, self.values[0:self.B], adaptive=False)
         # self.lstm_model_2.set_weights(self.lstm_model_1)
         # predicting using the model
         self.predicted_1.insert(time + 1, self.lstm_model_1.predict_lstm(self.values[1:self.B]))
@@ -81,22 +88,32 @@ def next_timestep(self, time):
         self.AARE_1.insert(time, self.aare(time, self.predicted_1))
         self.AARE_2 = self.AARE_1.copy()
         # training the model
-        self.lstm_model_1.train_lstm(self.values[time - self.B + 1:time + 1], self.NUM_EPOCHS, self.DEBUG)
+        self.retrain_lstm(time, self.lstm_model_1, self.values[time - self.B + 1:time + 1])
         self.lstm_model_2.set_weights(self.lstm_model_1)
         # predicting using the model
         self.predicted_1.insert(time + 1, self.lstm_model_1.predict_lstm(self.values[time - self.B + 2:time + 1]))
-        # self.predicted_2 = self.predicted_1.copy()
+        if self.USE_DETECTOR_2:
+            self.predicted_2 = self.predicted_1.copy()
 
     # step 4: anomaly detection with ReRe and the two detectors
     elif time >= 2 * self.B - 1:
         if self.DEBUG:
             print('\tStep 4')
 
+        # finish the background retrains that are done
+        if self.ASYNC_RETRAIN:
+            self.finish_retrains()
+
         # DETECTOR 1
         # adding the new AARE value to the list
         self.AARE_1.insert(time, self.aare(time, self.predicted_1))
         # calculating the threshold value
         self.threshold_1.insert(time, self.thd_1(time))
+
+        # DETECTOR 2 runs on its worker meanwhile
+        if self.USE_DETECTOR_2:
+            detector_2 = self.detector_2_executor.submit(detector_2_timestep, self, time)
+
         # decide if there is an anomaly
         if self.AARE_1[time] <= self.threshold_1[time]:
             if self.DEBUG:
@@ -104,11 +121,13 @@ def next_timestep(self, time):
             # it ISN'T an anomaly
             detection_is_not_anomaly(self, time, self.anomaly_1, self.pattern_change_1, self.predicted_1,
                                      self.lstm_model_1)
+        elif self.ASYNC_RETRAIN:
+            # it MIGHT BE an anomaly - the retrain runs in the background, meanwhile the verdict is provisional
+            self.suspect_anomaly(time)
         else:
             # it MIGHT BE an anomaly - further investigation needed
             # retrain lstm model with the last B data points
-            self.tmp_lstm_model_1.train_lstm(self.values[time - self.B:time],
-                                             self.NUM_EPOCHS, self.DEBUG)
+            self.retrain_lstm(time, self.tmp_lstm_model_1, self.values[time - self.B:time], self.lstm_model_1)
             # predict the next value again using the new model
             if time < self.length - 1:
                 self.predicted_1[time] = self.tmp_lstm_model_1.predict_lstm(self.values[time - self.B + 1:time])
@@ -125,41 +144,10 @@ def next_timestep(self, time):
                 detection_is_anomaly(self, time, self.anomaly_1, self.pattern_change_1, self.predicted_1,
                                      self.lstm_model_1, 'ANOMALY_1')
 
-        # DETECTOR 2
-        # adding the new AARE value to the list
-        # self.AARE_2.insert(time, self.aare(time, self.predicted_2))
-        # # calculating the threshold value
-        # self.threshold_2.insert(time, self.thd_2(time))
-        # # decide if there is an anomaly
-        # if self.AARE_2[time] <= self.threshold_2[time]:
-        #     if self.DEBUG:
-        #         print('\t\tNO_2 anomaly found.')
-        #     # it ISN'T an anomaly
-        #     detection_is_not_anomaly(self, time, self.anomaly_2, self.pattern_change_2, self.predicted_2,
-        #                              self.lstm_model_2)
-        # else:
-        #     # it MIGHT BE an anomaly - further investigation needed
-        #     # retrain lstm model with the last B data points
-        #     self.tmp_lstm_model_2.train_lstm(self.values[time - self.B:time],
-        #                                      self.NUM_EPOCHS, self.DEBUG)
-        #     # predict the next value again using the new model
-        #     if time < self.length - 1:
-        #         self.predicted_2[time] = self.tmp_lstm_model_2.predict_lstm(self.values[time - self.B + 1:time])
-        #     # recalculate current AARE
-        #     self.AARE_2[time] = self.aare(time, self.predicted_2)
-        #     if self.AARE_2[time] <= self.threshold_2[time]:
-        #         if self.DEBUG:
-        #             print('\t\tPATTERN CHANGE_2 found.')
-        #         # it ISN'T an anomaly, only the patterns are changing
-        #         detection_is_not_anomaly_but_pattern_change(self, time, self.anomaly_2, self.pattern_change_2,
-        #                                                     self.predicted_2, self.lstm_model_2, self.tmp_lstm_model_2)
-        #     else:
-        #         # it IS an anomaly
-        #         detection_is_anomaly(self, time, self.anomaly_2, self.pattern_change_2, self.predicted_2,
-        #                              self.lstm_model_2, 'ANOMALY_2')
-
         # deciding if both detectors show an anomaly
-        if self.anomaly_1[time]:  # and self.anomaly_2[time]:
+        if self.USE_DETECTOR_2:
+            detector_2.result()
+        if self.anomaly_1[time] and (not self.USE_DETECTOR_2 or self.anomaly_2[time]):
             self.anomaly_aggr.insert(time, True)
             if not self.STATUS_BAR:
                 print('ANOMALY at timestep {}!'.format(time))
@@ -169,6 +157,67 @@ def next_timestep(self, time):
                 print('NO anomaly at timestep {}!'.format(time))
 
 
+# train an LSTM model on a window of values and log the number of epochs used
+def retrain_lstm(self, time, lstm_model, train_data, live_lstm_model=None, adaptive=True, retrain_epochs=None):
+    tolerance = self.prepare_retrain(lstm_model, live_lstm_model, adaptive)
+    epochs = lstm_model.train_lstm(train_data, self.NUM_EPOCHS, self.DEBUG, tolerance, self.RETRAIN_PATIENCE)
+    self.log_retrain(time, epochs, retrain_epochs)
+
+
+# warm start the model of a retrain if ADAPTIVE_RETRAIN is on, returns the early stopping tolerance of train_lstm
+def prepare_retrain(self, lstm_model, live_lstm_model=None, adaptive=True):
+    if not (self.ADAPTIVE_RETRAIN and adaptive):
+        return None
+    # a temporary model starts from the weights of the live one instead of those of its previous retrain
+    if live_lstm_model is not None:
+        lstm_model.set_weights(live_lstm_model)
+    return self.RETRAIN_TOLERANCE
+
+
+# retrain_epochs: the history of the detector (retrain_epochs_2 for detector 2, None: detector 1)
+def log_retrain(self, time, epochs, retrain_epochs=None):
+    if retrain_epochs is None:
+        retrain_epochs = self.retrain_epochs
+    if time < len(retrain_epochs):
+        epochs += retrain_epochs[time]
+    retrain_epochs.insert(time, epochs)
+
+
+# step 4 of detector 2, which only reads the values and the state of detector 1 that are final before it starts
+def detector_2_timestep(self, time):
+    # adding the new AARE value to the list
+    self.AARE_2.insert(time, self.aare(time, self.predicted_2))
+    # calculating the threshold value
+    self.threshold_2.insert(time, self.thd_2(time))
+    # decide if there is an anomaly
+    if self.AARE_2[time] <= self.threshold_2[time]:
+        if self.DEBUG:
+            print('\t\tNO_2 anomaly found.')
+        # it ISN'T an anomaly
+        detection_is_not_anomaly(self, time, self.anomaly_2, self.pattern_change_2, self.predicted_2,
+                                 self.lstm_model_2)
+    else:
+        # it MIGHT BE an anomaly - further investigation needed
+        # retrain lstm model with the last B data points
+        self.retrain_lstm(time, self.tmp_lstm_model_2, self.values[time - self.B:time], self.lstm_model_2,
+                          retrain_epochs=self.retrain_epochs_2)
+        # predict the next value again using the new model
+        if time < self.length - 1:
+            self.predicted_2[time] = self.tmp_lstm_model_2.predict_lstm(self.values[time - self.B + 1:time])
+        # recalculate current AARE
+        self.AARE_2[time] = self.aare(time, self.predicted_2)
+        if self.AARE_2[time] <= self.threshold_2[time]:
+            if self.DEBUG:
+                print('\t\tPATTERN CHANGE_2 found.')
+            # it ISN'T an anomaly, only the patterns are changing
+            detection_is_not_anomaly_but_pattern_change(self, time, self.anomaly_2, self.pattern_change_2,
+                                                        self.predicted_2, self.lstm_model_2, self.tmp_lstm_model_2)
+        else:
+            # it IS an anomaly
+            detection_is_anomaly(self, time, self.anomaly_2, self.pattern_change_2, self.predicted_2,
+                                 self.lstm_model_2, 'ANOMALY_2')
+
+
 def detection_is_not_anomaly(rere, time, anomaly_list, pattern_change_list, predicted_list, lstm_model):
     anomaly_list.insert(time, False)
     pattern_change_list.insert(time, False)
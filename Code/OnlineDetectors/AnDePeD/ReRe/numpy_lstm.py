@@ -0,0 +1,214 @@
+"""
+NUMPY LSTM FUNCTIONS
+
+The model of Lstm (a stateful LSTM layer and a Dense layer) in NumPy: the forward pass, which spares the per-call
+overhead of Keras for the one-sample predictions of AnDePeD, and NumpyLstm, which also trains the model (Adam,
+backpropagation through time) without TensorFlow.
+"""
+
+import numpy as np
+
+
+def sigmoid(x):
+    # the same as 1 / (1 + exp(-x)), without overflowing for large negative inputs
+    return .5 * (1 + np.tanh(.5 * x))
+
+
+def export_weights(weights):
+    """
+    Converts the weights of the Keras model of Lstm (model.get_weights()) to the float32 arrays of lstm_forward.
+    :param weights: LSTM kernel (1, 4n), LSTM recurrent kernel (n, 4n), LSTM bias (4n), Dense kernel (n, 1), Dense bias
+    :return: list of the same arrays, the gates in the Keras order (input, forget, cell, output)
+    """
+    return [np.array(weight, dtype=np.float32) for weight in weights]
+
+
+def lstm_forward(weights, sequence, h, c):
+    """
+    Runs the LSTM layer over a sequence from the given state, then the Dense layer on its last output, as the
+    stateful Keras model of Lstm does for a batch of one sample.
+    :param weights: output of export_weights
+    :param sequence: input values, shape (timesteps,) or (1, timesteps, 1)
+    :param h: hidden state of the LSTM at the beginning of the sequence, shape (1, n)
+    :param c: cell state of the LSTM at the beginning of the sequence, shape (1, n)
+    :return: prediction (float32), hidden state and cell state at the end of the sequence
+    """
+    kernel, recurrent_kernel, bias, dense_kernel, dense_bias = weights
+    n = recurrent_kernel.shape[0]
+    # the input part of every timestep at once, only the recurrent part has to be computed step by step
+    inputs = np.asarray(sequence, dtype=kernel.dtype).reshape(-1, 1) * kernel + bias
+    for input_part in inputs:
+        z = input_part + h @ recurrent_kernel
+        gates = sigmoid(z)
+        c = gates[:, n:2 * n] * c + gates[:, :n] * np.tanh(z[:, 2 * n:3 * n])
+        h = gates[:, 3 * n:] * np.tanh(c)
+    return (h @ dense_kernel + dense_bias)[0, 0], h, c
+
+
+def initial_weights(num_neurons, rng):
+    """
+    Random weights initialised as Keras does for the model of Lstm: Glorot uniform kernels, orthogonal recurrent
+    kernel, zero biases except the forget gate bias of 1.
+    :param num_neurons: number of neurons of the LSTM layer
+    :param rng: NumPy random generator
+    :return: weights in the format of export_weights
+    """
+    n = num_neurons
+    limit = np.sqrt(6 / (1 + 4 * n))
+    kernel = rng.uniform(-limit, limit, (1, 4 * n))
+    q, r = np.linalg.qr(rng.standard_normal((4 * n, n)))
+    recurrent_kernel = (q * np.sign(np.diag(r))).T
+    bias = np.zeros(4 * n)
+    bias[n:2 * n] = 1
+    limit = np.sqrt(6 / (n + 1))
+    dense_kernel = rng.uniform(-limit, limit, (n, 1))
+    return export_weights([kernel, recurrent_kernel, bias, dense_kernel, np.zeros(1)])
+
+
+def lstm_gradients(weights, sequence, target, h, c):
+    """
+    Squared error of the prediction of lstm_forward for a sequence, and its gradient with respect to the weights by
+    backpropagation through time. As in the stateful Keras model, the initial state is a constant of the sequence.
+    :param weights: output of export_weights
+    :param sequence: input values, shape (timesteps,)
+    :param target: the value to predict
+    :param h: hidden state of the LSTM at the beginning of the sequence, shape (1, n)
+    :param c: cell state of the LSTM at the beginning of the sequence, shape (1, n)
+    :return: loss, gradients in the format of the weights, hidden state and cell state at the end of the sequence
+    """
+    kernel, recurrent_kernel, bias, dense_kernel, dense_bias = weights
+    n = recurrent_kernel.shape[0]
+    inputs = np.asarray(sequence, dtype=kernel.dtype).reshape(-1, 1)
+    length = len(inputs)
+
+    # forward pass, keeping the states and the activations of the gates of every timestep
+    hs = np.empty((length + 1, n), dtype=kernel.dtype)
+    cs = np.empty((length + 1, n), dtype=kernel.dtype)
+    activations = np.empty((length, 4 * n), dtype=kernel.dtype)
+    hs[0], cs[0] = h, c
+    input_parts = inputs * kernel + bias
+    for t in range(length):
+        z = input_parts[t] + hs[t] @ recurrent_kernel
+        activations[t] = sigmoid(z)
+        activations[t, 2 * n:3 * n] = np.tanh(z[2 * n:3 * n])
+        cs[t + 1] = activations[t, n:2 * n] * cs[t] + activations[t, :n] * activations[t, 2 * n:3 * n]
+        hs[t + 1] = activations[t, 3 * n:] * np.tanh(cs[t + 1])
+    prediction = hs[length] @ dense_kernel[:, 0] + dense_bias[0]
+    error = prediction - target
+
+    # backward pass: the gradient of the pre-activations of every timestep, then of the weights at once
+    d_prediction = 2 * error
+    dz = np.empty((length, 4 * n), dtype=kernel.dtype)
+    dh = d_prediction * dense_kernel[:, 0]
+    dc = np.zeros(n, dtype=kernel.dtype)
+    for t in range(length - 1, -1, -1):
+        i, f, g, o = (activations[t, k * n:(k + 1) * n] for k in range(4))
+        tanh_c = np.tanh(cs[t + 1])
+        dc = dc + dh * o * (1 - tanh_c ** 2)
+        dz[t, :n] = dc * g * i * (1 - i)
+        dz[t, n:2 * n] = dc * cs[t] * f * (1 - f)
+        dz[t, 2 * n:3 * n] = dc * i * (1 - g ** 2)
+        dz[t, 3 * n:] = dh * tanh_c * o * (1 - o)
+        dh = recurrent_kernel @ dz[t]
+        dc = dc * f
+    gradients = [inputs.T @ dz, hs[:length].T @ dz, dz.sum(axis=0), d_prediction * hs[length, :, None],
+                 np.array([d_prediction], dtype=kernel.dtype)]
+
+    return error ** 2, gradients, hs[length:], cs[length:]
+
+
+class Adam:
+    """
+    The Adam optimiser with the defaults of Keras. Its moments and number of iterations carry over from one
+    training to the next, as those of a compiled Keras model do.
+    """
+
+    def __init__(self, learning_rate=.001, beta_1=.9, beta_2=.999, epsilon=1e-7):
+        self.learning_rate = learning_rate
+        self.beta_1 = beta_1
+        self.beta_2 = beta_2
+        self.epsilon = epsilon
+        self.iterations = 0
+        self.m = None
+        self.v = None
+
+    def update(self, weights, gradients):
+        """
+        Take one step, changing the weights in place.
+        :param weights: list of arrays
+        :param gradients: list of arrays, the gradient of the loss with respect to each weight
+        :return:
+        """
+        if self.m is None:
+            self.m = [np.zeros_like(weight) for weight in weights]
+            self.v = [np.zeros_like(weight) for weight in weights]
+        self.iterations += 1
+        learning_rate = self.learning_rate * np.sqrt(1 - self.beta_2 ** self.iterations) / \
+            (1 - self.beta_1 ** self.iterations)
+        for weight, gradient, m, v in zip(weights, gradients, self.m, self.v):
+            m += (gradient - m) * (1 - self.beta_1)
+            v += (gradient ** 2 - v) * (1 - self.beta_2)
+            weight -= (learning_rate * m / (np.sqrt(v) + self.epsilon)).astype(weight.dtype)
+
+
+class EarlyStopping:
+    """
+    Tells when the loss of a training has stopped improving: once patience epochs in a row have not lowered the best
+    loss so far by at least tolerance times that loss.
+    """
+
+    def __init__(self, tolerance, patience=1):
+        self.tolerance = tolerance
+        self.patience = patience
+        self.best = np.inf
+        self.wait = 0
+
+    def stop(self, loss):
+        """
+        Count the loss of one more epoch.
+        :param loss: training loss of the epoch
+        :return: whether the training should stop
+        """
+        if loss < self.best * (1 - self.tolerance):
+            self.best = loss
+            self.wait = 0
+        else:
+            self.wait += 1
+        return self.wait >= self.patience
+
+
+class NumpyLstm:
+    """
+    The interface of Lstm (train_lstm, predict_lstm, set_weights) with the same model, trained in NumPy: every epoch
+    is one Adam step on the squared error of the single training sample, from the state the previous epoch or
+    prediction left behind, as with model.fit(batch_size=1) of the stateful Keras model.
+    The loss of an epoch is that of the weights before its step, as Keras reports it to early stopping.
+    """
+
+    def __init__(self, b, num_neurons, seed=None):
+        self.b = b
+        self.num_neurons = num_neurons
+        self.weights = initial_weights(num_neurons, np.random.default_rng(seed))
+        self.state = [np.zeros((1, num_neurons), dtype=np.float32) for _ in range(2)]
+        self.optimizer = Adam()
+
+    def train_lstm(self, train_data, num_epochs, debug, tolerance=None, patience=1):
+        early_stopping = None if tolerance is None else EarlyStopping(tolerance, patience)
+        epochs = 0
+        while epochs < num_epochs:
+            loss, gradients, self.state[0], self.state[1] = lstm_gradients(self.weights, train_data[:-1],
+                                                                           train_data[-1], *self.state)
+            self.optimizer.update(self.weights, gradients)
+            epochs += 1
+            if early_stopping is not None and early_stopping.stop(loss):
+                break
+        if debug:
+            print('\t\tLSTM training done in {} epochs.'.format(epochs))
+        return epochs
+
+    def predict_lstm(self, prev_data):
+        pred, self.state[0], self.state[1] = lstm_forward(self.weights, prev_data, *self.state)
+        return pred
+
+    def set_weights(self, lstm):
+        self.weights = [weight.copy() for weight in lstm.weights]
@@ -2,17 +2,19 @@
 TIMING ALGORITHM AND FUNCTIONS
 
 This file contains the necessary tools for keeping track of the duration of various types of self timesteps.
-WE ONLY MEASURE DETECTOR 1 AND INFER DATA FOR DETECTOR 2 FROM THAT.
+WE MEASURE THE WHOLE TIMESTEP: THE TWO DETECTORS RUN CONCURRENTLY, SO THEIR LSTM TIMES OVERLAP.
 """
 
 import time as timelib
 
 
 def init_timer(self):
-    self.timesteps_dur = list()
+    self.timesteps_dur = self.new_history()
     self.avg_dur_normal = 0.0
     self.avg_dur_lstm = 0.0
     self.retrain_count = 0
+    self.retrain_epochs = self.new_history(int)  # the number of epochs the retrains of a timestep used
+    self.retrain_epochs_2 = self.new_history(int)  # the same for detector 2
     self.timestep_begin = 0.0
     self.current_duration = 0.0
 
@@ -45,41 +47,31 @@ def end_timestep(self, time):
         self.retrain_count += 1
     # using offset compensation, retrains can occur due to either a pattern change, an anomaly or an offset retrain
     elif self.USE_OFFSET_COMP:
-        # LSTM_1 (+ LSTM_2 == 2) == 1 -> (2)1LSTM timestep
-        if (self.pattern_change_1[time] or self.anomaly_1[time] or self.offset_retrain_trigger_1[time]) == 1:
-            # (self.pattern_change_2[time] or self.anomaly_2[time] or self.offset_retrain_trigger_2[time]) == 2:
+        # the two detectors retrain concurrently, so a timestep with LSTM_1 and/or LSTM_2 is one LSTM timestep
+        lstm_timestep = \
+            (self.pattern_change_1[time] or self.anomaly_1[time] or self.offset_retrain_trigger_1[time]) == 1
+        if self.USE_DETECTOR_2:
+            lstm_timestep = lstm_timestep or \
+                (self.pattern_change_2[time] or self.anomaly_2[time] or self.offset_retrain_trigger_2[time]) == 1
+        if lstm_timestep:
             self.avg_dur_lstm = (self.retrain_count * self.avg_dur_lstm + (self.current_duration / 1)) * (
                         1 / (self.retrain_count + 1))
             self.retrain_count += 1
-        # LSTM_1 + LSTM_2 == 1 -> 1LSTM + 1normal ~ 1LSTM timestep
-        # elif (self.pattern_change_1[time] or self.anomaly_1[time] or self.offset_retrain_trigger_1[time]) + \
-        #         (self.pattern_change_2[time] or self.anomaly_2[time] or self.offset_retrain_trigger_2[time]) == 1:
-        #     self.avg_dur_lstm = (self.retrain_count * self.avg_dur_lstm + self.current_duration) * (
-        #                 1 / (self.retrain_count + 1))
-        #     self.retrain_count += 1
-        # LSTM_1 + LSTM_2 == 0 -> 2normal timestep
+        # no LSTM -> normal timestep
         else:
             self.avg_dur_normal = (self.avg_dur_normal * (time - self.retrain_count) + (self.current_duration / 1)) * \
                                   (1 / (time - self.retrain_count + 1))
     # if we don't use offset compensation, retrains can occur only as a result of a pattern change or an anomaly
     else:
-        if self.pattern_change_1[time] or self.anomaly_1[time]:
-        # LSTM_1 + LSTM_2 == 2 -> 2LSTM timestep
-        # if (self.pattern_change_1[time] or self.anomaly_1[time]) + \
-        #         (self.pattern_change_2[time] or self.anomaly_2[time]) == 2:
-        #     self.avg_dur_lstm = (self.retrain_count * self.avg_dur_lstm + (self.current_duration / 2)) * (
-        #                 1 / (self.retrain_count + 1))
-        #     self.retrain_count += 2
-        # LSTM_1 + LSTM_2 == 1 -> 1LSTM + 1normal ~ 1LSTM timestep
-        # elif (self.pattern_change_1[time] or self.anomaly_1[time]) + \
-        #         (self.pattern_change_2[time] or self.anomaly_2[time]) == 1:
+        # the two detectors retrain concurrently, so a timestep with LSTM_1 and/or LSTM_2 is one LSTM timestep
+        lstm_timestep = self.pattern_change_1[time] or self.anomaly_1[time]
+        if self.USE_DETECTOR_2:
+            lstm_timestep = lstm_timestep or self.pattern_change_2[time] or self.anomaly_2[time]
+        if lstm_timestep:
             self.avg_dur_lstm = (self.retrain_count * self.avg_dur_lstm + self.current_duration) * (
                         1 / (self.retrain_count + 1))
             self.retrain_count += 1
-        # LSTM_1 + LSTM_2 == 0 -> 2normal timestep
-        # else:
-        #     self.avg_dur_normal = (self.avg_dur_normal * (time - self.retrain_count) + (self.current_duration / 2)) * \
-        #                           (1 / (time - self.current_duration + 1))
+        # no LSTM -> normal timestep
         else:
             self.avg_dur_normal = (self.avg_dur_normal * (time - self.retrain_count) + (self.current_duration)) * \
                                   (1 / (time - self.retrain_count + 1))
@@ -4,6 +4,10 @@ SLIDING WINDOW AND AGEING IMPROVEMENT FUNCTIONS
 These functions calculate important values for AnDePeD.
 """
 
+import warnings
+
+import numpy as np
+
 
 # calculating window
 def update_window_beginning(self, time):
@@ -11,6 +15,14 @@ def update_window_beginning(self, time):
         self.window_beginning = self.B
     else:
         self.window_beginning = time - self.WINDOW_SIZE + 1
+    # with bounded memory, the window cannot reach further back than the histories
+    if self.BOUNDED_MEMORY and self.window_beginning < self.get_oldest_timestep():
+        if self.window_clamps == 0:
+            warnings.warn(f'WINDOW_SIZE grew faster than the bounded histories at timestep {time}: the sliding window '
+                          f'is cut to the last {time - self.get_oldest_timestep() + 1} timesteps, so the results can '
+                          f'differ from an unbounded run (counted in window_clamps).')
+        self.window_beginning = self.get_oldest_timestep()
+        self.window_clamps += 1
 
 
 # calculating the ageing coefficient Cy
@@ -22,3 +34,103 @@ def ageing_coefficient(self, time, y):
             return ((y - self.window_beginning) / (time - self.window_beginning)) ** self.AGE_POWER
     else:
         return 1
+
+
+# the ageing coefficients of the whole window (y = window_beginning ... time) as a vector,
+# cached until the window length, AGE_POWER or USE_AGING changes
+def ageing_weights(self, time):
+    length = time - self.window_beginning + 1
+    key = (length, self.AGE_POWER, self.USE_AGING)
+    if self.ageing_weights_key != key:
+        if self.USE_AGING and length > 1:
+            weights = (np.arange(length) / (length - 1)) ** self.AGE_POWER
+        else:
+            weights = np.ones(length)
+        weights.flags.writeable = False
+        self.ageing_weights_cache = weights
+        self.ageing_weights_key = key
+    return self.ageing_weights_cache
+
+
+def invalidate_ageing_weights(self):
+    self.ageing_weights_key = None
+    self.ageing_weights_cache = None
+    self.exponential_sums = dict()
+
+
+# the half-life [timesteps] at which the polynomial ageing coefficient of a window of window_size falls to one half
+def equivalent_half_life(window_size, age_power):
+    return (window_size - 1) * (1 - .5 ** (1 / age_power))
+
+
+# the AGE_POWER at which the polynomial ageing coefficient of a window of window_size falls to one half at half_life
+def equivalent_age_power(window_size, half_life):
+    return np.log(.5) / np.log(1 - half_life / (window_size - 1))
+
+
+# calculating the exponential ageing coefficient of the previous timestep, the weight of y is decay ** (time - y)
+def exponential_decay(self):
+    if self.USE_AGING and self.AGE_POWER > 0:
+        return .5 ** (1 / equivalent_half_life(self.WINDOW_SIZE, self.AGE_POWER))
+    else:
+        return 1.0
+
+
+# weighted sums of the window under exponential ageing, kept separately for each series (e.g. 'AARE_1')
+def exponential_window_sums(self, name, time, items):
+    if name not in self.exponential_sums:
+        self.exponential_sums[name] = ExponentialWindowSums()
+    return self.exponential_sums[name].get(time, self.window_beginning, self.exponential_decay(), items)
+
+
+class ExponentialWindowSums:
+    """
+    Sums of decay ** (time - y) * x_y ** p (p = 0, 1, 2) over the window y = window_beginning ... time, updated in O(1)
+    per timestep: the sums of the finished timesteps are decayed and extended by the newest one, and the items
+    leaving the window are subtracted. The item of the current timestep is only added to the returned sums, as it may
+    still change (e.g. AARE is recalculated after a retrain). The sums are rebuilt from the items once per window
+    length, so rounding errors of the subtractions cannot accumulate.
+    """
+
+    def __init__(self):
+        self.decay = None
+        self.begin = 0  # the finished timesteps begin ... end - 1 are in the sums
+        self.end = 0
+        self.sums = np.zeros(3)
+        self.updates = 0
+
+    def _rebuild(self, begin, end, decay, items):
+        values = items(begin, end)
+        weights = decay ** np.arange(end - begin - 1, -1, -1, dtype=float)
+        weighted = weights * values
+        self.sums = np.array([weights.sum(), weighted.sum(), np.dot(weighted, values)])
+        self.decay = decay
+        self.begin = begin
+        self.end = end
+        self.updates = 0
+
+    def get(self, time, window_beginning, decay, items):
+        """
+        :param time: current timestep
+        :param window_beginning: first timestep of the window
+        :param decay: weight of the previous timestep relative to the next one
+        :param items: items(begin, end) returns the items of the timesteps begin ... end - 1 as an array
+        :return: the three sums over the window, including the item of time
+        """
+        if decay != self.decay or not self.begin <= window_beginning <= self.end or time < self.end or \
+                time - self.end + self.updates > self.end - self.begin:
+            self._rebuild(window_beginning, time, decay, items)
+        else:
+            for value in items(self.end, time):
+                self.sums = decay * self.sums + (1.0, value, value * value)
+            self.updates += time - self.end
+            self.end = time
+            if window_beginning > self.begin:
+                values = items(self.begin, window_beginning)
+                weights = decay ** np.arange(self.end - self.begin - 1, self.end - window_beginning - 1, -1,
+                                             dtype=float)
+                weighted = weights * values
+                self.sums = self.sums - (weights.sum(), weighted.sum(), np.dot(weighted, values))
+                self.begin = window_beginning
+        value = items(time, time + 1)[0]
+        return decay * self.sums + (1.0, value, value * value)
@@ -5,6 +5,8 @@
 import abc
 from datetime import datetime, timedelta
 
+import numpy as np
+
 
 class OnlineAnomalyDetector(object, metaclass=abc.ABCMeta):
     """
@@ -82,3 +84,34 @@ class OnlineAnomalyDetector(object, metaclass=abc.ABCMeta):
         self.time += 1
 
         return detectorValues[0]
+
+    def next_batch(self, new_values):
+        """
+        Collects anomaly scores for several consecutive values.
+        Detectors that can score a whole batch at once MAY override this method, the results have to be the same as
+        calling next_timestep for each value, which is what happens by default.
+        """
+        return np.array([self.next_timestep(new_value) for new_value in new_values], dtype=float)
+
+    def get_verdict(self, record: int):
+        """
+        Returns 'provisional' if the anomaly score of a record may still be revised by pop_final_verdicts, 'final'
+        otherwise. Detectors that score some records provisionally MUST override this and pop_final_verdicts.
+        :param record: index of the record, counted from 0 like self.time
+        """
+        return 'final'
+
+    def close(self):
+        """
+        Stop the background threads of the detector, if any. The detector cannot be used afterwards.
+        This method MAY be overridden by detectors that start threads.
+        """
+        pass
+
+    def pop_final_verdicts(self, wait: bool = False):
+        """
+        Returns the final anomaly scores of the records scored provisionally, decided since the previous call.
+        :param wait: wait until no record is provisional
+        :return: list of (record index, anomaly score)
+        """
+        return []
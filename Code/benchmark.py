@@ -0,0 +1,862 @@
+import glob
+import os
+import time as timelib
+
+import numpy as np
+import pandas as pd
+
+import main_config as conf
+import online_use as use
+import printer
+import scaling
+import modes_star as mstar
+import vmd
+import AnDePeD.ReRe.auto_ws_ap_criteria as criteria
+from OnlineDetectors.AnDePeD.ReRe.history import History
+from OnlineDetectors.AnDePeD.ReRe.window_ageing import equivalent_half_life
+
+
+def make_synthetic_data(length: int, period: int = 288, seed: int = 0):
+    """
+    Creates a noisy periodic signal (one period per day at 5-minute sampling by default) and its sum of modes.
+    :param length: number of samples
+    :param period: length of one period
+    :param seed: seed of the random noise
+    :return: values, path of the csv file containing the sum of modes
+    """
+    rng = np.random.default_rng(seed)
+    periodic = np.sin(2 * np.pi * np.arange(period) / period)
+    values = np.tile(periodic, length // period + 1)[:length] + .1 * rng.standard_normal(length)
+
+    os.makedirs(conf.TEMP_DIR, exist_ok=True)
+    modes_star_path = conf.TEMP_DIR + '/benchmark_usum.csv'
+    pd.DataFrame({'timestep': np.arange(period), 'value': periodic}).to_csv(modes_star_path)
+
+    return values, modes_star_path
+
+
+def benchmark_run_batch(algorithm: str = 'windowedGaussian', offline_length: int = 4000, online_length: int = 12000,
+                        l: int = conf.L, repeats: int = 3):
+    """
+    Compares the per-sample Mode II path (next_timestep) with the batch replay (run_batch), end to end.
+    No detector scores a whole batch yet (they all use the default next_batch, one next_timestep per value), so only
+    the pre-processing is vectorised and the detector dominates: the end-to-end ratio is about 1x, within the noise
+    of the measurement (between 0.7x and 1.1x on different machines), see benchmark_mode_ii_preprocessing for the
+    pre-processing alone.
+    :param algorithm: name of anomaly detector
+    :param offline_length: number of samples used to load the buffer
+    :param online_length: number of samples to replay
+    :param l: length of the anomaly detection array
+    :param repeats: the two paths are run this many times, alternately, and the shortest durations are kept
+    :return: duration of the per-sample and the batch replay [seconds]
+    """
+    values, modes_star_path = make_synthetic_data(offline_length + online_length)
+    offline_data, online_data = values[:offline_length], values[offline_length:]
+    data_parameters = [l, -1.0, -1, -1, modes_star_path, np.min(offline_data), np.max(offline_data)]
+
+    per_sample_duration = batch_duration = np.inf
+    for _ in range(repeats):
+        per_sample = use.OnlineProcedure('II', data_parameters, algorithm, 'benchmark', offline_data)
+        begin = timelib.perf_counter()
+        for value in online_data:
+            per_sample.next_timestep(value)
+        per_sample_duration = min(per_sample_duration, timelib.perf_counter() - begin)
+
+        batch = use.OnlineProcedure('II', data_parameters, algorithm, 'benchmark', offline_data)
+        begin = timelib.perf_counter()
+        batch.run_batch(online_data)
+        batch_duration = min(batch_duration, timelib.perf_counter() - begin)
+
+        if not per_sample.save_data.to_dataframe().equals(batch.save_data.to_dataframe()):
+            raise AssertionError('run_batch returned different results than next_timestep!')
+
+    printer.template_beg()
+    printer.template_mid(f'RUN_BATCH BENCHMARK ({algorithm}, {online_length} samples, L={l}, best of {repeats})')
+    printer.template_mid(f'per-sample: {per_sample_duration:.3f} s, batch: {batch_duration:.3f} s, '
+                         f'end-to-end ratio (per-sample / batch): {per_sample_duration / batch_duration:.2f}x')
+    printer.template_end()
+
+    return per_sample_duration, batch_duration
+
+
+def benchmark_mode_ii_preprocessing(offline_length: int = 4000, online_length: int = 12000, l: int = conf.L):
+    """
+    Compares the Mode II pre-processing (scaling and mode removal) alone, without any anomaly detector:
+    the full-window path, the O(1) per-sample path and the vectorised batch path.
+    :param offline_length: number of samples used to load the buffer
+    :param online_length: number of samples to process
+    :param l: length of the anomaly detection array
+    :return: duration of the three paths [seconds]
+    """
+    values, modes_star_path = make_synthetic_data(offline_length + online_length)
+    offline_data, online_data = values[:offline_length], values[offline_length:]
+    size = l + l % 2
+    modes_star = mstar.load_modes_star(modes_star_path)
+
+    begin = timelib.perf_counter()
+    window = list(offline_data[-size:])
+    full_window = np.empty(online_length)
+    for t, value in enumerate(online_data):
+        window = window[1:] + [value]
+        scaled_values = scaling.preprocess(window)
+        full_window[t] = (scaled_values - modes_star.window(offline_length + t - size + 1, size))[-1]
+    full_window_duration = timelib.perf_counter() - begin
+
+    begin = timelib.perf_counter()
+    scaler = scaling.SlidingMinMaxScaler(size)
+    scaler.load(offline_data)
+    per_sample = np.empty(online_length)
+    for t, value in enumerate(online_data):
+        per_sample[t] = scaler.add_and_scale(value) - modes_star.value_at(offline_length + t)
+    per_sample_duration = timelib.perf_counter() - begin
+
+    begin = timelib.perf_counter()
+    batch = scaling.preprocess_sliding(offline_data, online_data, size) - modes_star.take(offline_length, online_length)
+    batch_duration = timelib.perf_counter() - begin
+
+    if not (np.array_equal(full_window, per_sample) and np.array_equal(per_sample, batch)):
+        raise AssertionError('The Mode II pre-processing paths returned different remainders!')
+
+    printer.template_beg()
+    printer.template_mid(f'MODE II PRE-PROCESSING BENCHMARK ({online_length} samples, L={l})')
+    printer.template_mid(f'full window: {full_window_duration:.3f} s, per-sample O(1): {per_sample_duration:.3f} s, '
+                         f'batch: {batch_duration:.3f} s')
+    printer.template_mid(f'batch speedup: {full_window_duration / batch_duration:.1f}x over full window, '
+                         f'{per_sample_duration / batch_duration:.1f}x over per-sample O(1)')
+    printer.template_end()
+
+    return full_window_duration, per_sample_duration, batch_duration
+
+
+def benchmark_vmd_warm_start(window_length: int = 400, steps: int = 200, alpha: float = vmd.ALPHA, k: int = 6):
+    """
+    Compares the warm-started VMD of Mode I with decomposing every window from scratch.
+    :param window_length: length of the decomposed window (l_vmd)
+    :param steps: number of timesteps
+    :param alpha: bandwidth constraint of VMD
+    :param k: number of modes
+    :return: statistics of WarmStartVMD
+    """
+    values, _ = make_synthetic_data(window_length + steps, period=50)
+    values = values + .5 * np.sin(2 * np.pi * np.arange(len(values)) / 13)
+    decomposer = vmd.WarmStartVMD(alpha, k, verify=True)
+    for t in range(steps):
+        decomposer.decompose(scaling.preprocess(values[t:t + window_length]))
+    stats = decomposer.get_stats()
+
+    printer.template_beg()
+    printer.template_mid(f'VMD WARM START BENCHMARK ({steps} steps, window={window_length}, alpha={alpha}, K={k})')
+    printer.template_mid(f'iterations per step: cold {stats["avg_cold_iterations"]:.1f}, '
+                         f'warm {stats["avg_iterations"]:.1f}')
+    printer.template_mid(f'time per step: cold {1000 * stats["avg_cold_duration"]:.2f} ms, '
+                         f'warm {1000 * stats["avg_duration"]:.2f} ms')
+    printer.template_mid(f'largest remainder error: {stats["max_remainder_error"]:.2e}, '
+                         f'fallbacks to cold start: {stats["fallbacks"]}')
+    printer.template_end()
+
+    return stats
+
+
+def benchmark_vmd_schedule(window_length: int = 400, steps: int = 300, alpha: float = vmd.ALPHA, k: int = 6,
+                           settings: list = None):
+    """
+    Compares decomposing the window of Mode I at every timestep with scheduled / drift-triggered recomputation.
+    :param window_length: length of the decomposed window (l_vmd)
+    :param steps: number of timesteps
+    :param alpha: bandwidth constraint of VMD
+    :param k: number of modes
+    :param settings: list of ScheduledVMD keyword arguments to try
+    :return: statistics of ScheduledVMD for each setting, extended with the RMS difference from per-sample VMD
+    """
+    if settings is None:
+        settings = [{'every': 10}, {'every': 50}, {'every': 50, 'drift_threshold': 3.0}, {'budget': .003}]
+    values, _ = make_synthetic_data(window_length + steps, period=50)
+    values = values + .5 * np.sin(2 * np.pi * np.arange(len(values)) / 13)
+    windows = [values[t + 1:t + window_length + 1] for t in range(steps)]
+
+    reference = vmd.ScheduledVMD(alpha, k)
+    reference_remainders = np.array([reference.next_timestep(window) for window in windows])
+    reference_stats = reference.get_stats()
+
+    printer.template_beg()
+    printer.template_mid(f'VMD SCHEDULE BENCHMARK ({steps} steps, window={window_length}, alpha={alpha}, K={k})')
+    printer.template_mid(f'every step: avg {1000 * reference_stats["avg_duration"]:.2f} ms, '
+                         f'p99 {1000 * reference_stats["p99_duration"]:.2f} ms')
+    all_stats = []
+    for setting in settings:
+        scheduler = vmd.ScheduledVMD(alpha, k, **setting)
+        remainders = np.array([scheduler.next_timestep(window) for window in windows])
+        stats = scheduler.get_stats()
+        stats['rms_difference'] = float(np.sqrt(np.mean((remainders - reference_remainders) ** 2)))
+        all_stats.append(stats)
+        printer.template_mid(f'{setting}: avg {1000 * stats["avg_duration"]:.2f} ms, '
+                             f'p99 {1000 * stats["p99_duration"]:.2f} ms, '
+                             f'{stats["recomputations"]} decompositions, '
+                             f'RMS difference {stats["rms_difference"]:.3f}')
+    printer.template_end()
+
+    return all_stats
+
+
+class _ReReWindow:
+    """
+    The part of ReRe that aare and thd_1 use: the sliding window, its ageing and the AARE history of detector 1.
+    """
+
+    def __init__(self, b: int, window_size: int, age_power: float, values: np.ndarray, predicted: list,
+                 ageing_kernel: str = 'polynomial'):
+        self.B = b
+        self.WINDOW_SIZE = window_size
+        self.AGE_POWER = age_power
+        self.AGEING_KERNEL = ageing_kernel
+        self.USE_AGING = True
+        self.DEBUG = False
+        self.BOUNDED_MEMORY = False
+        self.values = values
+        self.predicted_1 = predicted
+        self.AARE_1 = [np.nan] * b
+        self.window_beginning = 0
+        self.ageing_weights_key = None
+        self.ageing_weights_cache = None
+        self.exponential_sums = dict()
+
+    from OnlineDetectors.AnDePeD.ReRe.window_ageing import update_window_beginning, ageing_coefficient, \
+        ageing_weights, invalidate_ageing_weights, exponential_decay, exponential_window_sums
+    from OnlineDetectors.AnDePeD.ReRe.thd_aare_func import aare, thd_1
+
+
+def _aare_loop(rere, time, predicted):
+    # the element by element AARE of ReRe, for comparison
+    sum_ = 0.0
+    for y in range(rere.window_beginning, time + 1, 1):
+        value_coeff = rere.ageing_coefficient(time, y)
+        if rere.values[y] != 0:
+            sum_ += value_coeff * ((abs(rere.values[y] - predicted[y])) / abs(rere.values[y]))
+    return (1 / (time - rere.window_beginning + 1)) * sum_
+
+
+def _thd_1_loop(rere, time):
+    # the two-pass threshold of ReRe, for comparison
+    sum_ = 0.0
+    for y in range(rere.window_beginning, time + 1, 1):
+        sum_ += rere.ageing_coefficient(time, y) * rere.AARE_1[y]
+    mu = sum_ / (time + 1 - rere.window_beginning)
+    sum_ = 0.0
+    for y in range(rere.window_beginning, time + 1):
+        sum_ += rere.ageing_coefficient(time, y) * ((rere.AARE_1[y] - mu) ** 2)
+    sigma = np.sqrt(sum_ / (time + 1 - rere.window_beginning))
+    return mu + rere.THRESHOLD_STRENGTH * sigma
+
+
+def benchmark_andeped_thresholds(window_sizes: tuple = (100, 250, 500, 1000, 2000, 4000), steps: int = 200,
+                                 b: int = 30, age_power: float = 2.0, threshold_strength: float = 3.0):
+    """
+    Compares the per-step cost of AnDePeD's AARE and threshold (thd_1) calculation, element by element and
+    vectorised with cached ageing weights, for several WINDOW_SIZEs.
+    :param window_sizes: WINDOW_SIZE values to measure
+    :param steps: number of timesteps measured for each WINDOW_SIZE, after the window has been filled
+    :param b: B parameter of AnDePeD
+    :param age_power: AGE_POWER parameter of AnDePeD
+    :param threshold_strength: THRESHOLD_STRENGTH parameter of AnDePeD
+    :return: {WINDOW_SIZE: (loop duration, vectorised duration, largest relative difference)} per step [seconds]
+    """
+    rng = np.random.default_rng(0)
+    length = b + max(window_sizes) + steps
+    values = 1 + .1 * rng.standard_normal(length)
+    predicted = [np.nan] * b + list(values[b:] + .05 * rng.standard_normal(length - b))
+
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED AARE + THRESHOLD BENCHMARK ({steps} steps per WINDOW_SIZE, AGE_POWER={age_power})')
+    results = dict()
+    for window_size in window_sizes:
+        rere = _ReReWindow(b, window_size, age_power, values, predicted)
+        rere.THRESHOLD_STRENGTH = threshold_strength
+        # fill the window first, then measure
+        for time in range(b, b + window_size):
+            rere.update_window_beginning(time)
+            rere.AARE_1.append(rere.aare(time, predicted))
+
+        loop_duration = vectorised_duration = largest_difference = 0.0
+        for time in range(b + window_size, b + window_size + steps):
+            rere.update_window_beginning(time)
+
+            begin = timelib.perf_counter()
+            loop_aare = _aare_loop(rere, time, predicted)
+            rere.AARE_1.append(loop_aare)
+            loop_thd = _thd_1_loop(rere, time)
+            loop_duration += timelib.perf_counter() - begin
+            rere.AARE_1.pop()
+
+            begin = timelib.perf_counter()
+            rere.AARE_1.append(rere.aare(time, predicted))
+            thd = rere.thd_1(time)
+            vectorised_duration += timelib.perf_counter() - begin
+
+            largest_difference = max(largest_difference, abs(rere.AARE_1[time] - loop_aare) / abs(loop_aare),
+                                     abs(thd - loop_thd) / abs(loop_thd))
+
+        results[window_size] = (loop_duration / steps, vectorised_duration / steps, largest_difference)
+        printer.template_mid(f'WINDOW_SIZE={window_size}: loop {1e6 * loop_duration / steps:.1f} us, '
+                             f'vectorised {1e6 * vectorised_duration / steps:.1f} us, '
+                             f'speedup {loop_duration / vectorised_duration:.1f}x, '
+                             f'largest relative difference {largest_difference:.1e}')
+    printer.template_end()
+
+    return results
+
+
+def benchmark_andeped_ageing_kernels(data_dir: str = '../Data/Online', b: int = 30, window_size: int = 1000,
+                                     age_power: float = 2.0, threshold_strength: float = 3.0):
+    """
+    Compares the polynomial and the exponential ageing of AnDePeD (with the equivalent half-life) on the online
+    datasets: per-step cost of AARE + thd_1, how often the two flag the same timesteps, and how many of the labelled
+    anomalies each of them flags (within B timesteps).
+    The LSTM is replaced by a persistence forecast (the prediction of a timestep is the value before it) and the
+    retrain of suspected anomalies is left out, so only the ageing of AARE and thd differs between the two runs.
+    :param data_dir: directory of the online datasets, with a *labels*.csv file next to each *data*.csv file
+    :param b: B parameter of AnDePeD
+    :param window_size: WINDOW_SIZE parameter of AnDePeD
+    :param age_power: AGE_POWER parameter of AnDePeD, the half-life is its equivalent
+    :param threshold_strength: THRESHOLD_STRENGTH parameter of AnDePeD
+    :return: {dataset: {kernel: (duration per step [seconds], flagged timesteps, detected labels)}, 'agreement',
+             'labels'}
+    """
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED AGEING KERNEL COMPARISON (WINDOW_SIZE={window_size}, AGE_POWER={age_power}, '
+                         f'half-life={equivalent_half_life(window_size, age_power):.0f})')
+    results = dict()
+    for datapath in sorted(glob.glob(data_dir + '/*data*.csv')):
+        values = pd.read_csv(datapath)['value'].to_numpy(dtype=float)
+        labels = pd.read_csv(datapath.replace('data', 'labels', 1))['value'].to_numpy(dtype=int)
+        predicted = [np.nan] + list(values[:-1])
+
+        flags = dict()
+        results[datapath] = dict()
+        for kernel in ('polynomial', 'exponential'):
+            rere = _ReReWindow(b, window_size, age_power, values, predicted, kernel)
+            rere.THRESHOLD_STRENGTH = threshold_strength
+            anomaly = np.zeros(len(values), dtype=bool)
+            begin = timelib.perf_counter()
+            for time in range(b, len(values)):
+                rere.update_window_beginning(time)
+                rere.AARE_1.append(rere.aare(time, predicted))
+                if time >= 2 * b - 1:
+                    anomaly[time] = rere.AARE_1[time] > rere.thd_1(time)
+            duration = (timelib.perf_counter() - begin) / (len(values) - b)
+            detected = sum(bool(anomaly[max(label - b, 0):label + b + 1].any()) for label in labels)
+            flags[kernel] = anomaly
+            results[datapath][kernel] = (duration, int(anomaly.sum()), detected)
+
+        results[datapath]['agreement'] = float(np.mean(flags['polynomial'] == flags['exponential']))
+        results[datapath]['labels'] = len(labels)
+        printer.template_mid(f'{os.path.basename(datapath)}: ' + ', '.join(
+            f'{kernel} {1e6 * results[datapath][kernel][0]:.0f} us/step, {results[datapath][kernel][1]} flagged, '
+            f'{results[datapath][kernel][2]}/{len(labels)} labels' for kernel in ('polynomial', 'exponential')) +
+            f', agreement {100 * results[datapath]["agreement"]:.2f}%')
+    printer.template_end()
+
+    return results
+
+
+def benchmark_lstm_inference(b: int = 30, num_neurons: int = 30, steps: int = 200, num_epochs: int = 10):
+    """
+    Checks the NumPy forward pass of the AnDePeD LSTM against Keras and compares their predictions per second.
+    Two copies of the same trained Lstm predict the same sliding windows, one with model.predict of Keras, the other
+    with numpy_lstm; both are stateful, so the states are compared as well, through every step.
+    :param b: B parameter of AnDePeD
+    :param num_neurons: NUM_NEURONS parameter of AnDePeD
+    :param steps: number of predictions
+    :param num_epochs: number of epochs the LSTM is trained for before predicting
+    :return: Keras and NumPy predictions per second, largest difference of the predictions and of the states
+    """
+    from OnlineDetectors.AnDePeD.ReRe.lstm_func import Lstm
+
+    values, _ = make_synthetic_data(b + steps)
+    values = values.astype(np.float32)
+
+    keras_lstm = Lstm(b, num_neurons)
+    keras_lstm.NUMPY_INFERENCE = False
+    keras_lstm.train_lstm(values[:b], num_epochs, False)
+    numpy_lstm = Lstm(b, num_neurons)
+    numpy_lstm.NUMPY_INFERENCE = True
+    numpy_lstm.set_weights(keras_lstm)
+    numpy_lstm.set_layer_state(keras_lstm.state)
+    numpy_lstm.state = numpy_lstm.get_layer_state()
+
+    keras_duration = numpy_duration = prediction_difference = state_difference = 0.0
+    for time in range(b, b + steps):
+        window = values[time - b + 1:time]
+
+        begin = timelib.perf_counter()
+        keras_prediction = keras_lstm.predict_lstm(window)
+        keras_duration += timelib.perf_counter() - begin
+
+        begin = timelib.perf_counter()
+        numpy_prediction = numpy_lstm.predict_lstm(window)
+        numpy_duration += timelib.perf_counter() - begin
+
+        prediction_difference = max(prediction_difference, abs(float(keras_prediction) - float(numpy_prediction)))
+        state_difference = max(state_difference, *(float(np.abs(k - n).max())
+                                                   for k, n in zip(keras_lstm.state, numpy_lstm.state)))
+
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED LSTM INFERENCE BENCHMARK (B={b}, NUM_NEURONS={num_neurons}, {steps} predictions)')
+    printer.template_mid(f'Keras {steps / keras_duration:.0f} predictions/s, NumPy {steps / numpy_duration:.0f} '
+                         f'predictions/s, speedup {keras_duration / numpy_duration:.1f}x')
+    printer.template_mid(f'Largest difference: prediction {prediction_difference:.1e}, state {state_difference:.1e}')
+    printer.template_end()
+
+    return steps / keras_duration, steps / numpy_duration, prediction_difference, state_difference
+
+
+def check_lstm_inference_parity(b: int = 30, num_neurons: int = 30, steps: int = 100, num_epochs: int = 10,
+                                retrains: int = 3, tolerance: float = 1e-5):
+    """
+    Checks that the Lstm of both ReRe copies predicts the same with NUMPY_INFERENCE as with model.predict of Keras.
+    Two copies of the same Lstm, one predicting with each, go through the same stateful sequence: predictions,
+    retrains with train_lstm and weights replaced with set_weights (from a third model), as in AnDePeD.
+    NUMPY_INFERENCE should only be turned on once this check has passed with the TensorFlow and Keras versions in use
+    (requirements.txt pins tensorflow 2.9.1 and keras 2.9.0).
+    :param b: B parameter of AnDePeD
+    :param num_neurons: NUM_NEURONS parameter of AnDePeD
+    :param steps: number of predictions after each change of the weights
+    :param num_epochs: number of epochs of each training
+    :param retrains: number of rounds of train_lstm and of set_weights
+    :param tolerance: largest difference allowed between the predictions, and between the states
+    :return: {ReRe copy: (largest difference of the predictions, of the states)}, None if TensorFlow is not installed
+    """
+    try:
+        import tensorflow
+        import keras
+    except ImportError:
+        printer.template_beg()
+        printer.template_mid('ANDEPED LSTM INFERENCE PARITY CHECK skipped: TensorFlow and Keras are not installed')
+        printer.template_end()
+        return None
+
+    from AnDePeD.ReRe.lstm_func import Lstm as OfflineLstm
+    from OnlineDetectors.AnDePeD.ReRe.lstm_func import Lstm as OnlineLstm
+
+    values, _ = make_synthetic_data(b + 2 * retrains * (steps + b), period=4 * b)
+    values = values.astype(np.float32)
+
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED LSTM INFERENCE PARITY CHECK (TensorFlow {tensorflow.__version__}, '
+                         f'Keras {keras.__version__}, tolerance {tolerance:.0e})')
+    results = dict()
+    copies = (('offline', OfflineLstm, lambda lstm, window: lstm.predict_lstm(window, 0, False, 1, 0)),
+              ('online', OnlineLstm, lambda lstm, window: lstm.predict_lstm(window)))
+    for name, Lstm, predict in copies:
+        keras_lstm = Lstm(b, num_neurons)
+        keras_lstm.NUMPY_INFERENCE = False
+        numpy_lstm = Lstm(b, num_neurons)
+        numpy_lstm.NUMPY_INFERENCE = True
+        numpy_lstm.set_weights(keras_lstm)
+        other_lstm = Lstm(b, num_neurons)
+
+        prediction_difference = state_difference = 0.0
+        time = b
+        for retrain in range(2 * retrains):
+            # every other round, both copies are trained on the same window, in between they get the weights of a
+            # third model trained on it
+            if retrain % 2 == 0:
+                keras_lstm.train_lstm(values[time - b:time], num_epochs, False)
+                numpy_lstm.train_lstm(values[time - b:time], num_epochs, False)
+            else:
+                other_lstm.train_lstm(values[time - b:time], num_epochs, False)
+                keras_lstm.set_weights(other_lstm)
+                numpy_lstm.set_weights(other_lstm)
+
+            for time in range(time, time + steps + b):
+                window = values[time - b + 1:time]
+                keras_prediction = predict(keras_lstm, window)
+                numpy_prediction = predict(numpy_lstm, window)
+                prediction_difference = max(prediction_difference,
+                                            abs(float(keras_prediction) - float(numpy_prediction)))
+                state_difference = max(state_difference, *(float(np.abs(k - n).max())
+                                                           for k, n in zip(keras_lstm.state, numpy_lstm.state)))
+                if prediction_difference > tolerance or state_difference > tolerance:
+                    printer.template_end()
+                    raise AssertionError(f'The NumPy inference of the {name} Lstm differs from Keras at step {time} '
+                                         f'of round {retrain}: prediction {prediction_difference:.1e}, '
+                                         f'state {state_difference:.1e}.')
+            time += 1
+
+        results[name] = (prediction_difference, state_difference)
+        printer.template_mid(f'{name}: largest difference of the predictions {prediction_difference:.1e}, '
+                             f'of the states {state_difference:.1e}')
+    printer.template_end()
+
+    return results
+
+
+def benchmark_lstm_training(b: int = 30, num_neurons: int = 30, num_epochs: int = 30, retrains: int = 20,
+                            backends: tuple = ('keras', 'numpy')):
+    """
+    Compares the cost of the single-window retrains of AnDePeD with the LSTM backends of ReRe, and how well the
+    retrained models predict the next value of a noisy periodic signal.
+    :param b: B parameter of AnDePeD
+    :param num_neurons: NUM_NEURONS parameter of AnDePeD
+    :param num_epochs: NUM_EPOCHS parameter of AnDePeD
+    :param retrains: number of retrains, each followed by B predictions
+    :param backends: LSTM_BACKEND values to measure ('keras' needs TensorFlow)
+    :return: {backend: (duration of one retrain [seconds], mean absolute prediction error)}
+    """
+    values, _ = make_synthetic_data(b * (retrains + 1), period=4 * b)
+    values = values.astype(np.float32)
+
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED LSTM TRAINING BENCHMARK (B={b}, NUM_NEURONS={num_neurons}, NUM_EPOCHS={num_epochs}, '
+                         f'{retrains} retrains)')
+    results = dict()
+    for backend in backends:
+        if backend == 'numpy':
+            from OnlineDetectors.AnDePeD.ReRe.numpy_lstm import NumpyLstm as Lstm
+        else:
+            from OnlineDetectors.AnDePeD.ReRe.lstm_func import Lstm
+        lstm = Lstm(b, num_neurons)
+        duration = error = 0.0
+        for retrain in range(retrains):
+            begin = timelib.perf_counter()
+            lstm.train_lstm(values[retrain * b:(retrain + 1) * b], num_epochs, False)
+            duration += timelib.perf_counter() - begin
+            for time in range((retrain + 1) * b, (retrain + 2) * b):
+                error += abs(float(lstm.predict_lstm(values[time - b + 1:time])) - values[time])
+        results[backend] = (duration / retrains, error / (retrains * b))
+        printer.template_mid(f'{backend}: {1e3 * results[backend][0]:.1f} ms per retrain, '
+                             f'mean absolute error {results[backend][1]:.3f}')
+    printer.template_end()
+
+    return results
+
+
+def benchmark_andeped_adaptive_retrain(data_dir: str = '../Data/Online', algorithm: str = 'AnDePeD',
+                                       lstm_backend: str = 'numpy', length: int = None):
+    """
+    Compares AnDePeD with full-length retrains and with ADAPTIVE_RETRAIN (warm start, early stopping) on the online
+    datasets: epochs per retrain, duration per timestep, and how many of the labelled anomalies are flagged (within B
+    timesteps).
+    :param data_dir: directory of the online datasets, with a *labels*.csv file next to each *data*.csv file
+    :param algorithm: 'AnDePeD' or 'AnDePeDPro'
+    :param lstm_backend: LSTM backend of ReRe
+    :param length: only use the first length values of each dataset (None: all of them)
+    :return: {dataset: {'full' or 'adaptive': (epochs per retrain, duration per timestep [seconds], flagged timesteps,
+             detected labels)}, 'labels'}
+    """
+    from OnlineDetectors.AnDePeD.AnDePeD_detector import ANDEPEDDetector
+
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED ADAPTIVE RETRAIN COMPARISON ({algorithm}, {lstm_backend} LSTM)')
+    results = dict()
+    for datapath in sorted(glob.glob(data_dir + '/*data*.csv')):
+        values = pd.read_csv(datapath)['value'].to_numpy(dtype=float)[:length]
+        labels = pd.read_csv(datapath.replace('data', 'labels', 1))['value'].to_numpy(dtype=int)
+        labels = labels[labels < len(values)]
+
+        results[datapath] = {'labels': len(labels)}
+        for mode in ('full', 'adaptive'):
+            detector = ANDEPEDDetector(buffer_size=len(values), algorithm=algorithm, lstm_backend=lstm_backend,
+                                       adaptive_retrain=mode == 'adaptive', input_min=np.min(values),
+                                       input_max=np.max(values))
+            detector.initialize()
+            anomaly = np.zeros(len(values), dtype=bool)
+            for time, value in enumerate(values):
+                anomaly[time] = detector.next_timestep(value) > 0
+            # the timesteps of ReRe, as measured by its timer
+            duration = float(np.mean(detector.rere.timesteps_dur[:]))
+
+            # the initial training is never adaptive
+            b = detector.rere.B
+            epochs = detector.rere.retrain_epochs[b:]
+            epochs = epochs[epochs > 0]
+            detected = sum(bool(anomaly[max(label - b, 0):label + b + 1].any()) for label in labels)
+            results[datapath][mode] = (float(np.mean(epochs)) if len(epochs) else 0.0, duration, int(anomaly.sum()),
+                                       detected)
+        printer.template_mid(f'{os.path.basename(datapath)}: ' + ', '.join(
+            f'{mode} {results[datapath][mode][0]:.1f} epochs/retrain, {1e3 * results[datapath][mode][1]:.1f} ms/step, '
+            f'{results[datapath][mode][2]} flagged, {results[datapath][mode][3]}/{len(labels)} labels'
+            for mode in ('full', 'adaptive')))
+    printer.template_end()
+
+    return results
+
+
+def benchmark_andeped_async_retrain(datapath: str = '../Data/Online/grok_asg_anomaly_origdata.csv',
+                                    algorithm: str = 'AnDePeD', lstm_backend: str = 'numpy', length: int = None,
+                                    interval: float = 0.0):
+    """
+    Compares the duration of the timesteps of AnDePeD with the retrains run in the timestep and in the background
+    (ASYNC_RETRAIN), and counts the provisional verdicts that the background retrains revised.
+    :param datapath: path of the dataset
+    :param algorithm: 'AnDePeD' or 'AnDePeDPro'
+    :param lstm_backend: LSTM backend of ReRe
+    :param length: only use the first length values of the dataset (None: all of them)
+    :param interval: time between two records [seconds], the background retrains run meanwhile
+    :return: {'sync' or 'async': (median, 99th percentile and largest duration of a timestep [seconds], flagged
+             timesteps, provisional verdicts, revised verdicts)}
+    """
+    from OnlineDetectors.AnDePeD.AnDePeD_detector import ANDEPEDDetector
+
+    values = pd.read_csv(datapath)['value'].to_numpy(dtype=float)[:length]
+
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED BACKGROUND RETRAIN COMPARISON ({algorithm}, {lstm_backend} LSTM, '
+                         f'{os.path.basename(datapath)})')
+    results = dict()
+    for mode in ('sync', 'async'):
+        detector = ANDEPEDDetector(buffer_size=len(values), algorithm=algorithm, lstm_backend=lstm_backend,
+                                   async_retrain=mode == 'async', input_min=np.min(values), input_max=np.max(values))
+        detector.initialize()
+        anomaly = np.zeros(len(values), dtype=bool)
+        provisional = 0
+        for time, value in enumerate(values):
+            score, verdict = detector.handleRecord({'value': value})
+            detector.time += 1
+            anomaly[time] = score > 0
+            provisional += verdict == 'provisional'
+            if interval:
+                timelib.sleep(interval)
+        final = detector.pop_final_verdicts(wait=True)
+        for time, score in final:
+            anomaly[time] = score > 0
+        # the detection timesteps of ReRe, as measured by its timer
+        durations = detector.rere.timesteps_dur[2 * detector.rere.B:]
+        results[mode] = (float(np.percentile(durations, 50)), float(np.percentile(durations, 99)),
+                         float(np.max(durations)), int(anomaly.sum()), provisional,
+                         sum(score == 0 for _, score in final))
+        printer.template_mid(f'{mode}: p50 {1e3 * results[mode][0]:.2f} ms, p99 {1e3 * results[mode][1]:.2f} ms, '
+                             f'max {1e3 * results[mode][2]:.2f} ms per step, {results[mode][3]} flagged, '
+                             f'{results[mode][4]} provisional, {results[mode][5]} revised')
+    printer.template_end()
+
+    return results
+
+
+def benchmark_andeped_detector_2(datapath: str = '../Data/Online/grok_asg_anomaly_origdata.csv',
+                                 algorithm: str = 'AnDePeD', lstm_backend: str = 'numpy', length: int = None):
+    """
+    Compares the duration of the whole run and of the timesteps of AnDePeD with detector 1 only and with detector 2
+    running concurrently on its worker thread. The detectors only overlap with more than one core and an LSTM backend
+    that releases the GIL while training (Keras); the NumPy backend holds it.
+    :param datapath: path of the dataset
+    :param algorithm: 'AnDePeD' or 'AnDePeDPro'
+    :param lstm_backend: LSTM backend of ReRe
+    :param length: only use the first length values of the dataset (None: all of them)
+    :return: {'detector 1' or 'both': (wall-clock duration of the whole run, median and 99th percentile duration of a
+             timestep, average duration of an LSTM timestep as measured by the timer of ReRe [seconds], flagged
+             timesteps)}
+    """
+    from OnlineDetectors.AnDePeD.AnDePeD_detector import ANDEPEDDetector
+
+    values = pd.read_csv(datapath)['value'].to_numpy(dtype=float)[:length]
+
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED DETECTOR 2 COMPARISON ({algorithm}, {lstm_backend} LSTM, '
+                         f'{os.path.basename(datapath)}, {os.cpu_count()} cores)')
+    results = dict()
+    for mode in ('detector 1', 'both'):
+        detector = ANDEPEDDetector(buffer_size=len(values), algorithm=algorithm, lstm_backend=lstm_backend,
+                                   detector_2=mode == 'both', input_min=np.min(values), input_max=np.max(values))
+        detector.initialize()
+        anomaly = np.zeros(len(values), dtype=bool)
+        begin = timelib.perf_counter()
+        for time, value in enumerate(values):
+            anomaly[time] = detector.next_timestep(value) > 0
+        duration = timelib.perf_counter() - begin
+        # the detection timesteps of ReRe, as measured by its timer; the timesteps retraining the LSTM models are rare
+        # but long, so the median misses them and the whole run is the figure to compare
+        durations = detector.rere.timesteps_dur[2 * detector.rere.B:]
+        detector.close()
+        results[mode] = (duration, float(np.percentile(durations, 50)), float(np.percentile(durations, 99)),
+                         detector.rere.avg_dur_lstm, int(anomaly.sum()))
+        printer.template_mid(f'{mode}: whole run {results[mode][0]:.1f} s, p50 {1e3 * results[mode][1]:.2f} ms, '
+                             f'p99 {1e3 * results[mode][2]:.2f} ms per step, {1e3 * results[mode][3]:.2f} ms per LSTM '
+                             f'step, {results[mode][4]} flagged')
+    printer.template_mid(f'detector 2 makes the whole run {results["both"][0] / results["detector 1"][0]:.1f}x as '
+                         f'long')
+    printer.template_end()
+
+    return results
+
+
+class _ReReOffset:
+    # the parts of ReRe that the offset compensation reads, for benchmark_andeped_offset_compensation
+    def __init__(self, b, offset_window_size, values, predicted, anomaly):
+        self.B = b
+        self.USE_OFFSET_COMP = True
+        self.OFFSET_WINDOW_SIZE = offset_window_size
+        self.OFFSET_PERCENTAGE = 1.0  # the signal needs more than the whole window, so no retrain is triggered
+        self.USE_WINDOW = True
+        self.WINDOW_SIZE = 2 * offset_window_size
+        self.USE_DETECTOR_2 = False
+        self.ASYNC_RETRAIN = False
+        self.BOUNDED_MEMORY = False
+        self.values = values
+        self.predicted_1 = History()
+        self.anomaly_1 = History(bool)
+        self.pattern_change_1 = History(bool)
+        for time in range(len(values)):
+            self.predicted_1.append(predicted[time])
+            self.anomaly_1.append(anomaly[time])
+            self.pattern_change_1.append(False)
+
+    from OnlineDetectors.AnDePeD.ReRe.history import new_history
+    from OnlineDetectors.AnDePeD.ReRe.offset_comp import init_offset_compensation, compensate_offset
+
+
+def _offset_statistics_loop(rere, time):
+    # the offset window statistics as ReRe calculated them over the whole window, for comparison
+    begin = rere.offset_window_beg
+    above_counter = 0
+    for y in range(begin, time + 1):
+        if rere.diff_avg_1[y] > rere.offset_retrain_threshold[y]:
+            above_counter += 1
+    no_detection = not rere.pattern_change_1.flags(begin, time + 1).any() and \
+        not rere.anomaly_1.flags(begin, time + 1).any()
+    return np.mean(rere.values[begin:time + 1]), np.std(rere.values[begin:time + 1]), above_counter, no_detection
+
+
+def benchmark_andeped_offset_compensation(offset_window_sizes: tuple = (50, 200, 1000, 4000), steps: int = 200,
+                                          b: int = 30):
+    """
+    Compares the per-step cost of AnDePeD's offset compensation (compensate_offset, with sliding sums) with that of
+    the statistics of the whole offset window calculated again (means, standard deviation, count of the timesteps
+    above the threshold and scan for detections), for several OFFSET_WINDOW_SIZEs.
+    :param offset_window_sizes: OFFSET_WINDOW_SIZE values to measure
+    :param steps: number of timesteps measured for each OFFSET_WINDOW_SIZE, after the offset window has been filled
+    :param b: B parameter of AnDePeD
+    :return: {OFFSET_WINDOW_SIZE: (full window duration, sliding duration, largest relative difference of the mean and
+             the standard deviation, whether the counts and the scans agreed)} per step [seconds]
+    """
+    rng = np.random.default_rng(0)
+    length = 2 * b + max(offset_window_sizes) + steps
+    values = 1 + .1 * rng.standard_normal(length)
+    predicted = values + .05 * rng.standard_normal(length) + .01
+    anomaly = rng.random(length) < .002
+
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED OFFSET COMPENSATION BENCHMARK ({steps} steps per OFFSET_WINDOW_SIZE)')
+    results = dict()
+    for offset_window_size in offset_window_sizes:
+        rere = _ReReOffset(b, offset_window_size, values, predicted, anomaly)
+        rere.init_offset_compensation()
+        # fill the offset window first, then measure
+        for time in range(2 * b - 1, 2 * b + offset_window_size):
+            rere.compensate_offset(time)
+
+        loop_duration = sliding_duration = largest_difference = 0.0
+        agreed = True
+        for time in range(2 * b + offset_window_size, 2 * b + offset_window_size + steps):
+            begin = timelib.perf_counter()
+            rere.compensate_offset(time)
+            sliding_duration += timelib.perf_counter() - begin
+
+            begin = timelib.perf_counter()
+            mean, std, above_counter, no_detection = _offset_statistics_loop(rere, time)
+            loop_duration += timelib.perf_counter() - begin
+
+            largest_difference = max(largest_difference, abs(rere.values_mean[time] - mean) / abs(mean),
+                                     abs(rere.offset_retrain_threshold[time] - std) / std)
+            sums = rere.offset_sums
+            agreed = agreed and int(sums['above_1'].get(time, rere.offset_window_beg, lambda begin, end: (
+                rere.diff_avg_1[begin:end] > rere.offset_retrain_threshold[begin:end]))[0]) == above_counter
+            agreed = agreed and (sums['detections_1'].get(time, rere.offset_window_beg, lambda begin, end: (
+                rere.pattern_change_1.flags(begin, end) | rere.anomaly_1.flags(begin, end)))[0] == 0) == no_detection
+
+        results[offset_window_size] = (loop_duration / steps, sliding_duration / steps, largest_difference, agreed)
+        printer.template_mid(f'OFFSET_WINDOW_SIZE={offset_window_size}: full window {1e6 * loop_duration / steps:.1f} '
+                             f'us, sliding {1e6 * sliding_duration / steps:.1f} us, '
+                             f'largest relative difference {largest_difference:.1e}, counts agreed: {agreed}')
+    printer.template_end()
+
+    return results
+
+
+class _ReReSignals:
+    # the parts of ReRe that the WS/AP criteria read, for benchmark_andeped_ws_ap_criteria
+    def __init__(self, b, values, anomaly, pattern_change):
+        self.B = b
+        self.SIGNAL_DATABASE_LEN = b ** 2
+        self.FLAPPING_LENGTH_COEFF = 1.5
+        self.SIGNAL_THRESHOLD_COEFF = b
+        self.TOO_LONG_ANOM_COEFF = 2.5
+        self.DEBUG = False
+        self.values = values
+        self.anomaly_1 = History(bool)
+        self.pattern_change_1 = History(bool)
+        for time in range(len(values)):
+            self.anomaly_1.append(anomaly[time])
+            self.pattern_change_1.append(pattern_change[time])
+        self.anomaly_runs_1 = criteria.SignalRuns()
+        self.pattern_change_runs_1 = criteria.SignalRuns()
+        self.squared_difference_sums = History()
+        self.window_beginning = b
+
+
+def benchmark_andeped_ws_ap_criteria(bs: tuple = (30, 60, 120), anomaly_rates: tuple = (.001, .01), steps: int = 200):
+    """
+    Measures the per-step cost of the WS/AP tuning criteria of AnDePeD (anomaly flapping, frequent signals and long
+    anomalies), which read the signal database of B ** 2 timesteps from run-length indices, for several Bs and rates
+    of anomalies.
+    :param bs: B values to measure
+    :param anomaly_rates: probability of an anomaly starting at a timestep
+    :param steps: number of timesteps measured for each B, after the signal database has been filled
+    :return: {(B, anomaly rate): (duration of the criteria per step [seconds], anomalies in the signal database)}
+    """
+    rng = np.random.default_rng(0)
+
+    printer.template_beg()
+    printer.template_mid(f'ANDEPED WS/AP CRITERIA BENCHMARK ({steps} steps per B)')
+    results = dict()
+    for b in bs:
+        for anomaly_rate in anomaly_rates:
+            length = b + b ** 2 + steps
+            values = 1 + .1 * rng.standard_normal(length)
+            # anomalies of 1 to B timesteps, and a pattern change after some of them
+            anomaly = np.zeros(length, dtype=bool)
+            pattern_change = np.zeros(length, dtype=bool)
+            for start in np.flatnonzero(rng.random(length) < anomaly_rate):
+                end = min(start + int(rng.integers(1, b + 1)), length)
+                anomaly[start:end] = True
+                if end < length and rng.random() < .2:
+                    pattern_change[end] = True
+            rere = _ReReSignals(b, values, anomaly, pattern_change)
+            # index the signal database and the prefix sums first, then measure
+            rere.window_beginning = b
+            criteria.update_signal_runs(rere, b + b ** 2 - 1, rere.anomaly_1, rere.pattern_change_1)
+            criteria.check_freq_sig(rere, b + b ** 2 - 1, rere.anomaly_runs_1, rere.pattern_change_runs_1, rere.values)
+
+            duration = 0.0
+            for time in range(b + b ** 2, length):
+                rere.window_beginning = time - b ** 2 + 1
+                begin = timelib.perf_counter()
+                criteria.update_signal_runs(rere, time, rere.anomaly_1, rere.pattern_change_1)
+                criteria.check_anom_flap(rere, time, rere.anomaly_runs_1, rere.pattern_change_runs_1)
+                criteria.check_freq_sig(rere, time, rere.anomaly_runs_1, rere.pattern_change_runs_1, rere.values)
+                criteria.check_long_anom(rere, time, rere.anomaly_runs_1)
+                duration += timelib.perf_counter() - begin
+
+            anomalies = len(rere.anomaly_runs_1.starts)
+            results[(b, anomaly_rate)] = (duration / steps, anomalies)
+            printer.template_mid(f'B={b} (database of {b ** 2}), anomaly rate {anomaly_rate}: '
+                                 f'{1e6 * duration / steps:.1f} us per step, {anomalies} anomalies in the database')
+    printer.template_end()
+
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_mode_ii_preprocessing()
+    benchmark_run_batch()
+    benchmark_vmd_warm_start()
+    benchmark_vmd_schedule()
+    benchmark_andeped_thresholds()
+    benchmark_andeped_ageing_kernels()
+    check_lstm_inference_parity()
+    benchmark_lstm_inference()
+    benchmark_lstm_training()
+    benchmark_andeped_adaptive_retrain()
+    benchmark_andeped_async_retrain()
+    benchmark_andeped_detector_2()
+    benchmark_andeped_offset_compensation()
+    benchmark_andeped_ws_ap_criteria()
@@ -0,0 +1,130 @@
+import os
+import pickle
+import queue
+import threading
+import time as timelib
+import zlib
+
+SNAPSHOT_FORMAT = 'AnDePeD-online-snapshot'
+SNAPSHOT_VERSION = 1
+
+
+def serialise(obj):
+    """
+    Capture the state of an object (e.g. an OnlineProcedure) as bytes. This is the only step that has to run in the
+    thread using the object, compression and writing can happen later.
+    :param obj: any picklable object
+    :return: the pickled object
+    """
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write_snapshot(payload: bytes, path: str, compression_level: int = 1):
+    """
+    Write a snapshot file: a versioned header followed by the compressed payload.
+    The file is replaced atomically, so a crash while writing never leaves a broken snapshot behind.
+    :param payload: the output of serialise
+    :param path: path of the snapshot file
+    :param compression_level: zlib level, 1 is the fastest
+    :return:
+    """
+    header = {'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION, 'created': timelib.time(),
+              'size': len(payload)}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.write(zlib.compress(payload, compression_level))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    return
+
+
+def read_snapshot(path: str):
+    """
+    Read a snapshot file written by write_snapshot.
+    :param path: path of the snapshot file
+    :return: the object the snapshot was taken of
+    """
+    with open(path, 'rb') as file:
+        header = pickle.load(file)
+        if not isinstance(header, dict) or header.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f'{path} is not a snapshot of an online procedure.')
+        if header['version'] > SNAPSHOT_VERSION:
+            raise ValueError(f'{path} has snapshot version {header["version"]}, '
+                             f'only versions up to {SNAPSHOT_VERSION} are supported.')
+        payload = zlib.decompress(file.read())
+    if len(payload) != header['size']:
+        raise ValueError(f'{path} is truncated or corrupted.')
+    return pickle.loads(payload)
+
+
+class BackgroundSnapshotter:
+    """
+    Writes snapshots in a background thread. The state is captured (pickled) by the caller, so it is consistent;
+    compressing and writing it to disk does not block the caller. If a new snapshot arrives while the previous one
+    is still waiting to be written, only the newer one is written.
+    """
+
+    def __init__(self, path: str, compression_level: int = 1):
+        """
+        :param path: path of the snapshot file, overwritten by every snapshot
+        :param compression_level: zlib level, 1 is the fastest
+        """
+        self.path = path
+        self.compression_level = compression_level
+        self.pending = queue.Queue(maxsize=1)
+        self.written = 0
+        self.skipped = 0
+        self.error = None
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+        return
+
+    def submit(self, payload: bytes):
+        """
+        Queue a snapshot for writing, replacing the one still waiting (if any).
+        :param payload: the output of serialise
+        :return:
+        """
+        if self.error is not None:
+            raise RuntimeError(f'Writing the snapshot {self.path} failed.') from self.error
+        try:
+            self.pending.get_nowait()
+            self.pending.task_done()
+            self.skipped += 1
+        except queue.Empty:
+            pass
+        self.pending.put(payload)
+        return
+
+    def _run(self):
+        while True:
+            payload = self.pending.get()
+            try:
+                if payload is None:
+                    return
+                write_snapshot(payload, self.path, self.compression_level)
+                self.written += 1
+            except Exception as error:
+                self.error = error
+            finally:
+                self.pending.task_done()
+
+    def flush(self):
+        """
+        Wait until every submitted snapshot has been written.
+        """
+        self.pending.join()
+        return
+
+    def close(self):
+        """
+        Write the last submitted snapshot, then stop the background thread.
+        """
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+        return
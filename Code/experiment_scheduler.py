@@ -0,0 +1,184 @@
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+
+import data_handler
+import main_config as conf
+import offline_prep as prep
+import online_use as use
+import printer
+import read_files
+import write_files
+
+
+def get_online_results_path(algorithm: str, dataname_online: str, test_id: str = conf.TEST_ID):
+    return conf.RESULTS_DIR + f'/online_results_{test_id}_{algorithm}_{dataname_online}.csv'
+
+
+def count_rows(path: str):
+    """
+    Number of lines of a file, used to estimate how long the online use of a dataset takes.
+    """
+    with open(path, 'rb') as file:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: file.read(1 << 20), b''))
+
+
+def build_jobs(mode: str, algorithms: list, dh: data_handler.DataHandler):
+    """
+    Build the (dataset -> offline preparation -> online runs) graph of an experiment.
+    In Mode II the decomposition does not depend on the anomaly detector, so every dataset is prepared only once and
+    all detectors reuse it. In Mode I, alpha_star and k_star are optimised for the detector, so there is one
+    preparation per (dataset, detector) pair.
+    :param mode: 'I' or 'II'
+    :param algorithms: names of the anomaly detectors
+    :param dh: DataHandler pointing to the datasets
+    :return: list of preparation jobs {'offline', 'online', 'length', 'algorithms'}, longest online dataset first
+    """
+    dh.reset()
+    jobs = list()
+    more_datasets_left = bool(dh.dataset_names)
+    while more_datasets_left:
+        datapath_offline, _ = dh.get_next_dataset('offline')
+        datapath_online, more_datasets_left = dh.get_next_dataset('online')
+        length = count_rows(datapath_online)
+        if mode == 'II':
+            jobs.append({'offline': datapath_offline, 'online': datapath_online, 'length': length,
+                         'algorithms': list(algorithms)})
+        else:
+            for algorithm in algorithms:
+                jobs.append({'offline': datapath_offline, 'online': datapath_online, 'length': length,
+                             'algorithms': [algorithm]})
+
+    # stable sort: datasets of the same length keep the order of the DataHandler
+    jobs.sort(key=lambda job: -job['length'])
+    return jobs
+
+
+def run_preparation(mode: str, job: dict, test_id: str):
+    """
+    Offline preparation of one job, shared by every detector of the job.
+    :return: data_parameters without L: [alpha_star, k_star, l_vmd, modes_star_path, data_min, data_max]
+    """
+    algorithms = job['algorithms']
+    alpha_star, k_star, l_vmd, modes_star_path, data_min, data_max = \
+        prep.prepare_procedure(mode, algorithms[0], job['offline'], test_id, init_files=False)
+
+    # the other detectors get the same row in the optimal parameters file as if they had been prepared on their own
+    for algorithm in algorithms[1:]:
+        prep.save_optimal_results(mode, algorithm, job['offline'], -1.0, -1, [-1], -1, modes_star_path)
+
+    return [alpha_star, k_star, l_vmd, modes_star_path, data_min, data_max]
+
+
+def run_online(mode: str, algorithm: str, datapath_offline: str, datapath_online: str, data_parameters: list,
+               test_id: str):
+    """
+    Online use of one detector on one dataset, the results are saved to a file named after both.
+    :return: path of the results file
+    """
+    dataname_online = datapath_online.split('/')[-1][:-4]
+    printer.begin_online_use(algorithm, dataname_online)
+    offline_dataset = read_files.read_file_pandas(datapath_offline, column=conf.OFFLINE_COLUMN_NAME, to_numpy=True)
+    online_dataset = read_files.read_file_pandas(datapath_online, column=conf.ONLINE_COLUMN_NAME, to_numpy=True)
+    onl_p = use.OnlineProcedure(mode, [conf.L] + data_parameters, algorithm, dataname_online, offline_dataset)
+    for value in online_dataset:
+        onl_p.next_timestep(value)
+
+    savepath = get_online_results_path(algorithm, dataname_online, test_id)
+    onl_p.export_saved_data(savepath)
+    onl_p.close()
+
+    printer.end_online_use(algorithm, dataname_online)
+    return savepath
+
+
+@contextlib.contextmanager
+def single_threaded_workers():
+    """
+    One core per job: the numerical libraries of the processes spawned in this context are single-threaded.
+    They read their thread counts when they are loaded, which happens when a spawned worker imports this module,
+    before any initializer runs, so the variables are set in the parent, whose environment the workers inherit.
+    """
+    variables = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS')
+    previous = {variable: os.environ.get(variable) for variable in variables}
+    os.environ.update({variable: '1' for variable in variables})
+    try:
+        yield
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                del os.environ[variable]
+            else:
+                os.environ[variable] = value
+
+
+def _init_worker(lock):
+    write_files.set_lock(lock)
+    return
+
+
+def run_experiment(mode: str = conf.MODE, algorithms: list = None, test_id: str = conf.TEST_ID,
+                   max_workers: int = conf.NUM_WORKERS, dh: data_handler.DataHandler = None):
+    """
+    Run the offline preparation and the online use of every detector on every dataset in a process pool.
+    Every preparation runs once, and the online runs depending on it are submitted as soon as it finishes, longest
+    datasets first. In Mode I the preparations run one after the other, because they share the pre-processed data
+    directory and the temporary files of NAB and AnDePeD; in Mode II each dataset writes only its own files, so the
+    preparations run in parallel too.
+    :param mode: 'I' or 'II'
+    :param algorithms: names of the anomaly detectors (default: conf.ALGORITHMS)
+    :param test_id: any user_specified string to use when saving some files
+    :param max_workers: number of worker processes (None: one per CPU core)
+    :param dh: DataHandler pointing to the datasets (default: the directories of main_config)
+    :return: {(algorithm, online dataset path): results file path}
+    """
+    if algorithms is None:
+        algorithms = conf.ALGORITHMS
+    if dh is None:
+        dh = data_handler.DataHandler()
+
+    # create files in results to save optimal parameters achieved by offline preparation
+    if mode == 'I':
+        write_files.init_file_pandas(conf.OFFLINE_PREP_OPTIMAL_PARAMS_FILE.format('I'),
+                                     ['algorithm', 'dataset', 'alpha_star', 'k_star', 'omega_star', 'l_vmd'])
+        write_files.init_file_pandas(conf.OPTUNA_PARAMS_SAVE_FILE.format('f_score', test_id),
+                                     ['algorithm', 'dataset', 'alpha', 'k', 'f_score'])
+    elif mode == 'II':
+        write_files.init_file_pandas(conf.OFFLINE_PREP_OPTIMAL_PARAMS_FILE.format('II'),
+                                     ['algorithm', 'dataset', 'modes_star_path'])
+        write_files.init_file_pandas(conf.OPTUNA_PARAMS_SAVE_FILE.format('mse', test_id),
+                                     ['algorithm', 'dataset', 'alpha', 'k', 'mse'])
+
+    jobs = build_jobs(mode, algorithms, dh)
+
+    # spawned (not forked) workers, so that TensorFlow and the numerical libraries start from a clean state
+    context = multiprocessing.get_context('spawn')
+    lock = context.Lock()
+    write_files.set_lock(lock)
+    results = dict()
+    # the workers are spawned as jobs are submitted, so the environment is kept until the pool is shut down
+    with single_threaded_workers(), \
+            concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                                   initializer=_init_worker, initargs=(lock,)) as executor:
+        online_futures = dict()
+
+        def submit_online_runs(job: dict, data_parameters: list):
+            for algorithm in job['algorithms']:
+                future = executor.submit(run_online, mode, algorithm, job['offline'], job['online'],
+                                         data_parameters, test_id)
+                online_futures[future] = (algorithm, job['online'])
+
+        if mode == 'I':
+            for job in jobs:
+                submit_online_runs(job, run_preparation(mode, job, test_id))
+        else:
+            preparation_futures = {executor.submit(run_preparation, mode, job, test_id): job for job in jobs}
+            for future in concurrent.futures.as_completed(preparation_futures):
+                submit_online_runs(preparation_futures[future], future.result())
+
+        for future in concurrent.futures.as_completed(online_futures):
+            results[online_futures[future]] = future.result()
+
+    write_files.set_lock(None)
+    return results
@@ -0,0 +1,220 @@
+import asyncio
+import concurrent.futures
+import math
+import os
+
+
+class IngestionServer:
+    """
+    Asyncio based ingestion service in front of OnlineProcedure.
+    Lines of the form 'stream_id,timestamp,value' are accepted over a local TCP or Unix socket and routed to one
+    OnlineProcedure per stream through bounded queues. When the queue of a stream is full, reading from the
+    connection pauses, which propagates backpressure to the client.
+    Each processed line is answered with 'stream_id,timestamp,anomaly_score' over the same connection and/or written
+    to a file sink. Lines that cannot be parsed or processed are answered with an 'ERROR,...' line, which goes the same
+    ways as the scores (to the sink only if sink_errors is set). The timesteps of the procedures (VMD, LSTM
+    retrains...) run in an executor, so a slow stream does not stall the event loop or the other streams.
+    """
+
+    def __init__(self, procedure_factory, queue_size: int = 1000, executor=None, sink_path: str = None,
+                 reply: bool = True, sink_errors: bool = True):
+        """
+        :param procedure_factory: called with a stream id the first time the stream is seen, has to return an object
+                                  with a next_timestep(value) method returning the anomaly score (e.g. OnlineProcedure),
+                                  and optionally a close() method, called by close()
+        :param queue_size: maximum number of values waiting to be processed per stream
+        :param executor: concurrent.futures executor running the timesteps (default: a thread pool)
+        :param sink_path: file to append 'stream_id,timestamp,anomaly_score' lines to (None: no file sink)
+        :param reply: whether to send the anomaly scores and errors back over the connection the values arrived on
+        :param sink_errors: whether to write the 'ERROR,...' lines to the file sink too, so that errors are not lost
+                            when reply is False (False: the sink only holds anomaly scores)
+        """
+        self.procedure_factory = procedure_factory
+        self.queue_size = queue_size
+        self.executor = executor if executor is not None else concurrent.futures.ThreadPoolExecutor()
+        self.reply = reply
+        self.sink_errors = sink_errors
+
+        self.sink = open(sink_path, 'a') if sink_path is not None else None
+
+        self.queues = dict()  # stream id -> asyncio.Queue
+        self.workers = dict()  # stream id -> asyncio.Task
+        self.procedures = dict()  # stream id -> procedure
+        self.servers = list()
+
+        return
+
+    async def start_tcp(self, host: str = '127.0.0.1', port: int = 0):
+        """
+        Start listening on a local TCP socket.
+        :param host: address to bind to
+        :param port: port to bind to (0: any free port)
+        :return: (host, port) actually bound
+        """
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        self.servers.append(server)
+        return server.sockets[0].getsockname()[:2]
+
+    async def start_unix(self, path: str):
+        """
+        Start listening on a Unix socket.
+        :param path: path of the socket file (replaced if it already exists)
+        :return:
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self._handle_connection, path)
+        self.servers.append(server)
+        return
+
+    async def serve_forever(self):
+        await asyncio.gather(*(server.serve_forever() for server in self.servers))
+
+    async def close(self):
+        """
+        Stop accepting connections, wait until every queued value has been processed, then close the procedures (which
+        decides their provisional anomaly scores and stops their background threads) and stop the workers.
+        :return:
+        """
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        await asyncio.gather(*(queue.join() for queue in self.queues.values()))
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, procedure.close)
+                               for procedure in self.procedures.values() if hasattr(procedure, 'close')))
+        for worker in self.workers.values():
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        if self.sink is not None:
+            self.sink.close()
+        return
+
+    def _get_queue(self, stream_id: str):
+        if stream_id not in self.queues:
+            self.queues[stream_id] = asyncio.Queue(maxsize=self.queue_size)
+            self.workers[stream_id] = asyncio.get_running_loop().create_task(self._stream_worker(stream_id))
+        return self.queues[stream_id]
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        used_queues = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError as error:
+                    # the line is longer than the limit of the stream, the reader skips it
+                    await self._emit(writer, f'ERROR,,{error}\n')
+                    continue
+                except ConnectionError:
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                try:
+                    stream_id, timestamp, value = parse_line(line.decode().strip())
+                except ValueError as error:  # including UnicodeDecodeError
+                    await self._emit(writer, f'ERROR,{line.decode(errors="replace").strip()},{error}\n')
+                    continue
+
+                queue = self._get_queue(stream_id)
+                used_queues.add(queue)
+                # blocks while the stream's queue is full, so we stop reading from the connection (backpressure)
+                await queue.put((timestamp, value, writer))
+        finally:
+            # answer everything that arrived on this connection before closing it
+            await asyncio.gather(*(queue.join() for queue in used_queues))
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+        return
+
+    async def _stream_worker(self, stream_id: str):
+        loop = asyncio.get_running_loop()
+        queue = self.queues[stream_id]
+
+        try:
+            procedure = await loop.run_in_executor(self.executor, self.procedure_factory, stream_id)
+            self.procedures[stream_id] = procedure
+        except Exception as error:
+            procedure = None
+            failure = f'could not create procedure: {error}'
+
+        while True:
+            timestamp, value, writer = await queue.get()
+            try:
+                if procedure is None:
+                    await self._emit(writer, f'ERROR,{stream_id},{timestamp},{failure}\n')
+                else:
+                    score = await loop.run_in_executor(self.executor, procedure.next_timestep, value)
+                    await self._emit(writer, f'{stream_id},{timestamp},{score}\n')
+            except Exception as error:
+                await self._emit(writer, f'ERROR,{stream_id},{timestamp},{error}\n')
+            finally:
+                queue.task_done()
+
+    async def _emit(self, writer: asyncio.StreamWriter, line: str):
+        if self.sink is not None and (self.sink_errors or not line.startswith('ERROR')):
+            self.sink.write(line)
+        if self.reply:
+            await self._write(writer, line)
+        return
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, line: str):
+        if writer.is_closing():
+            return
+        try:
+            writer.write(line.encode())
+            await writer.drain()
+        except ConnectionError:
+            pass
+        return
+
+
+def parse_line(line: str):
+    """
+    Parse a line of the form 'stream_id,timestamp,value'.
+    :param line: the line without the line break
+    :return: stream_id, timestamp, value
+    """
+    fields = line.split(',')
+    if len(fields) != 3:
+        raise ValueError('expected stream_id,timestamp,value')
+    stream_id, timestamp, value = (field.strip() for field in fields)
+    value = float(value)
+    if not stream_id or math.isnan(value):
+        raise ValueError('missing stream_id or value')
+    return stream_id, timestamp, value
+
+
+async def send_lines(lines: list, host: str = '127.0.0.1', port: int = None, path: str = None):
+    """
+    Local client stand-in: send lines to an IngestionServer, then collect every answer until the server closes.
+    :param lines: 'stream_id,timestamp,value' lines without line breaks
+    :param host: address of a TCP server
+    :param port: port of a TCP server
+    :param path: path of a Unix socket (used instead of host and port if given)
+    :return: the answers, without line breaks
+    """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    async def send():
+        for line in lines:
+            writer.write((line + '\n').encode())
+            await writer.drain()
+        writer.write_eof()
+
+    sender = asyncio.get_running_loop().create_task(send())
+    answers = [line.strip() for line in (await reader.read()).decode().splitlines()]
+    await sender
+    writer.close()
+    await writer.wait_closed()
+    return answers
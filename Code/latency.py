@@ -0,0 +1,119 @@
+import time as timelib
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations with HDR-style buckets: durations below 2^sub_bucket_bits nanoseconds are counted exactly,
+    above that every power of two is split into 2^(sub_bucket_bits - 1) linear sub-buckets, so the relative error of
+    a percentile is at most 2^(1 - sub_bucket_bits) whatever its magnitude.
+    Recording is O(1) and allocation-free.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7, max_duration_bits: int = 40):
+        """
+        :param sub_bucket_bits: precision of the buckets (7: below 1.6% relative error)
+        :param max_duration_bits: durations up to 2^max_duration_bits ns (~18 minutes by default) are bucketed,
+                                  longer ones are counted in the last bucket
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.counts = [0] * self._index(1 << max_duration_bits)
+        self.total_count = 0
+        self.max_value = 0
+        return
+
+    def _index(self, value: int):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def _highest_equivalent_value(self, index: int):
+        if index < self.sub_bucket_count:
+            return index
+        shift, sub = divmod(index - self.sub_bucket_count, self.half_count)
+        return ((self.half_count + sub + 1) << (shift + 1)) - 1
+
+    def record(self, duration_ns: int, count: int = 1):
+        """
+        Count one duration.
+        :param duration_ns: duration [nanoseconds]
+        :param count: number of times the duration is counted
+        :return:
+        """
+        self.counts[min(self._index(duration_ns), len(self.counts) - 1)] += count
+        self.total_count += count
+        if duration_ns > self.max_value:
+            self.max_value = duration_ns
+        return
+
+    def get_percentile(self, percentile: float):
+        """
+        Returns the duration below which the given percentage of the recorded durations fall.
+        :param percentile: between 0 and 100
+        :return: duration [seconds], NaN if nothing has been recorded
+        """
+        if self.total_count == 0:
+            return float('nan')
+        target = max(1, int(percentile / 100 * self.total_count + .5))
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(self._highest_equivalent_value(index), self.max_value) * 1e-9
+        return self.max_value * 1e-9
+
+    def get_max(self):
+        return self.max_value * 1e-9 if self.total_count else float('nan')
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.total_count = 0
+        self.max_value = 0
+        return
+
+
+class StageLatencies:
+    """
+    One LatencyHistogram per named stage of a pipeline, fed from the monotonic clock.
+    """
+
+    def __init__(self, stages: list):
+        """
+        :param stages: names of the stages, in pipeline order
+        """
+        self.histograms = {stage: LatencyHistogram() for stage in stages}
+        return
+
+    @staticmethod
+    def now():
+        return timelib.perf_counter_ns()
+
+    def record(self, stage: str, begin: int, end: int, count: int = 1):
+        """
+        Count the duration of one run of a stage.
+        :param stage: name of the stage
+        :param begin: now() when the stage started
+        :param end: now() when the stage finished
+        :param count: number of items the stage processed at once (e.g. a batch), each is counted with the average
+                      duration
+        :return:
+        """
+        self.histograms[stage].record((end - begin) // count, count)
+        return
+
+    def get_stats(self):
+        """
+        Returns {stage: {'count', 'p50', 'p99', 'max'}} with the durations in seconds.
+        """
+        return {stage: {'count': histogram.total_count,
+                        'p50': histogram.get_percentile(50),
+                        'p99': histogram.get_percentile(99),
+                        'max': histogram.get_max()}
+                for stage, histogram in self.histograms.items()}
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        return
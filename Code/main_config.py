@@ -21,6 +21,8 @@ OFFLINE_PREP_OPTIMAL_PARAMS_FILE = RESULTS_DIR + '/offline_prep_optimal_params_'
 
 SEPARATOR = '/'
 
+NUM_WORKERS = None  # number of processes running the experiment in main.py, None: one per CPU core
+
 # AnDePeD related parameters
 ANDEPED_MAIN_DIR = 'AnDePeD'
 ANDEPED_EXPORT_FILE = 'AnDePeD/eval_results_temp.csv'
@@ -31,6 +33,18 @@ ANDEPED_TESTRUN_COLUMNS = ['B', 'THRESHOLD_STRENGTH', 'USE_WINDOW', 'WINDOW_SIZE
                         'NUM_EPOCHS', 'NUM_NEURONS', 'FILENAME']
 ANDEPED_TESTRUN_PARAMETERS = [30, 3.0, 'T', 1000, 'T', 'T', 'F', 2.0, 'F', 'F', 1, 'F', 0, 0, 30, 30]
 ANDEPED_PRO_TESTRUN_PARAMETERS = [30, 3.0, 'T', 800, 'T', 'T', 'F', 2.5, 'T', 'T', 1, 'T', 0, 0, 30, 30]
+ANDEPED_AGEING_KERNEL = 'polynomial'  # 'polynomial' or 'exponential' (AARE and thd updated in O(1) per timestep)
+ANDEPED_HALF_LIFE = None  # 'exponential' only: age of half weight [timesteps], None: equivalent of AGE_POWER
+ANDEPED_BOUNDED_MEMORY = False  # keep only the timesteps AnDePeD can still read (constant memory per stream)
+ANDEPED_LSTM_BACKEND = 'keras'  # 'keras' or 'numpy' (same LSTM trained in NumPy, no TensorFlow needed)
+ANDEPED_ASYNC_RETRAIN = False  # retrain in the background, suspected anomalies are provisional until it finishes
+ANDEPED_ADAPTIVE_RETRAIN = False  # retrains start from the live model and stop once the loss stops improving
+# EXPERIMENTAL: also run detector 2 of ReRe (concurrently), anomalies need both detectors; the run is not close to
+# the duration of detector 1 alone: with ANDEPED_LSTM_BACKEND = 'numpy' (whose trainer holds the GIL) the whole run
+# on the first 1500 values of grok_asg_anomaly took 1.0-1.3x as long on one core and 3.3x (37.5 s instead of 11.3 s)
+# on several cores, see benchmark.benchmark_andeped_detector_2; whether 'keras' (which releases the GIL while
+# training) gains anything from more cores has not been measured yet
+ANDEPED_DETECTOR_2 = False
 
 
 # NAB related parameters
@@ -0,0 +1,100 @@
+import threading
+
+import numpy as np
+
+import read_files
+
+
+class ModesStar:
+    """
+    Read-only, pre-tiled copy of a sum of modes (modes_star) used for Mode II mode removal.
+    The sum of modes is repeated periodically, its first sample belonging to the first sample of the offline dataset.
+    """
+
+    def __init__(self, values: np.ndarray):
+        """
+        Tile the sum of modes once so that any window of up to period samples is a contiguous slice.
+        :param values: one period of the sum of modes
+        """
+        self.period = len(values)
+        if self.period == 0:
+            raise ValueError('The sum of modes (modes_star) cannot be empty!')
+
+        self.values = np.array(values, dtype=float)
+        self.values.flags.writeable = False
+
+        self.tiled = np.empty(shape=0)
+        self._tile(self.period)
+
+        return
+
+    def _tile(self, max_window_length: int):
+        """
+        Tile the sum of modes so that any window of up to max_window_length samples is a contiguous slice.
+        :param max_window_length: the longest window that has to be served as a view
+        :return:
+        """
+        reps = int(np.ceil((self.period + max_window_length - 1) / self.period))
+        tiled = np.tile(self.values, reps)
+        tiled.flags.writeable = False
+        self.tiled = tiled
+        return
+
+    def window(self, start: int, length: int):
+        """
+        Returns the sum of modes belonging to the samples start, start + 1, ..., start + length - 1 as a read-only view.
+        :param start: position of the first sample, counted from the beginning of the offline dataset
+        :param length: number of samples
+        :return:
+        """
+        offset = start % self.period
+        if offset + length > len(self.tiled):
+            with _CACHE_LOCK:
+                if offset + length > len(self.tiled):
+                    self._tile(length)
+        return self.tiled[offset:offset + length]
+
+    def take(self, start: int, length: int):
+        """
+        Returns the sum of modes belonging to the samples start, start + 1, ..., start + length - 1 as a new array.
+        Unlike window, this does not extend the shared tiled array, so it is meant for long batches.
+        :param start: position of the first sample, counted from the beginning of the offline dataset
+        :param length: number of samples
+        :return:
+        """
+        return self.values[(start + np.arange(length)) % self.period]
+
+    def value_at(self, position: int):
+        """
+        Returns the sum of modes belonging to a single sample.
+        :param position: position of the sample, counted from the beginning of the offline dataset
+        :return:
+        """
+        return self.values[position % self.period]
+
+
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def load_modes_star(path: str):
+    """
+    Returns the cached, pre-tiled sum of modes stored in path, reading the file only the first time it is requested.
+    Streams using the same dataset therefore share the same read-only array.
+    :param path: path of the csv file containing the sum of modes in its 'value' column
+    :return: ModesStar
+    """
+    with _CACHE_LOCK:
+        if path not in _CACHE:
+            _CACHE[path] = ModesStar(read_files.read_file_pandas(path, column='value', to_numpy=True))
+        return _CACHE[path]
+
+
+def clear_cache():
+    """
+    Forget every cached sum of modes, e.g. after the offline preparation has rewritten the files.
+    :return:
+    """
+    with _CACHE_LOCK:
+        _CACHE.clear()
+    return
@@ -8,13 +8,14 @@ import optimiser
 import printer
 
 
-def prepare_procedure(mode: str, algorithm: str, dataset: str, test_id: str):
+def prepare_procedure(mode: str, algorithm: str, dataset: str, test_id: str, init_files: bool = True):
     """
     Offline preparation for real-time VMD-based mode removal and pre-processing
     :param mode: 'I' or 'II'
     :param algorithm: standard name of the anomaly detection algorithm
     :param dataset: path of dataset to analyse
     :param test_id: any user_specified string to use when saving some files
+    :param init_files: whether to (re)create the file the parameters of each Optuna trial are saved to
     :return: alpha_star, k_star, l_vmd, modes_star_path, data_min, data_max
     """
 
@@ -24,8 +25,9 @@ def prepare_procedure(mode: str, algorithm: str, dataset: str, test_id: str):
     data_min, data_max, orig_length = get_min_max_len_of_orig_data(dataset)
 
     if mode == 'I':
-        write_files.init_file_pandas(conf.OPTUNA_PARAMS_SAVE_FILE.format('f_score', test_id),
-                                     ['algorithm', 'dataset', 'alpha', 'k', 'f_score'])
+        if init_files:
+            write_files.init_file_pandas(conf.OPTUNA_PARAMS_SAVE_FILE.format('f_score', test_id),
+                                         ['algorithm', 'dataset', 'alpha', 'k', 'f_score'])
 
         # run Optuna, get optimal results
         alpha_star, k_star, omega_star, _ = optimiser.optimise_main(mode, algorithm, dataset, test_id)
@@ -41,8 +43,9 @@ def prepare_procedure(mode: str, algorithm: str, dataset: str, test_id: str):
         return alpha_star, k_star, l_vmd, '-1', data_min, data_max
 
     elif mode == 'II':
-        write_files.init_file_pandas(conf.OPTUNA_PARAMS_SAVE_FILE.format('mse', test_id),
-                                     ['algorithm', 'dataset', 'alpha', 'k', 'mse'])
+        if init_files:
+            write_files.init_file_pandas(conf.OPTUNA_PARAMS_SAVE_FILE.format('mse', test_id),
+                                         ['algorithm', 'dataset', 'alpha', 'k', 'mse'])
 
         # run Optuna, get optimal results
         _, __, omega_star, modes_star_path = optimiser.optimise_main(mode, algorithm, dataset, test_id)
@@ -1,13 +1,36 @@
-import numpy as np
+import mmap
+import os
+import time
 
-import collections
-import itertools
+import numpy as np
 
 
 class CircularBuffer:
+    """
+    Fixed-size FIFO buffer of floats backed by a mirrored NumPy array of twice its size: every item is written to
+    both halves, so the items of the buffer, oldest first, are always a contiguous slice and can be returned as a
+    read-only view in O(1) instead of being copied.
+    The views share memory with the buffer, so they are only valid until the next add_item or load.
+    """
+
     def __init__(self, size: int):
         self.size = size
-        self.buffer = collections.deque(maxlen=size)
+        self.buffer = np.zeros(2 * size)
+        self.view = self.buffer.view()
+        self.view.flags.writeable = False
+        self.head = 0  # index of the oldest item
+        self.count = 0  # number of items in the buffer
+        return
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['view'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.view = self.buffer.view()
+        self.view.flags.writeable = False
         return
 
     def load(self, data: list):
@@ -17,8 +40,12 @@ class CircularBuffer:
         :param data: list of values to load into buffer
         :return:
         """
-        self.buffer.clear()
-        self.buffer.extend(data)
+        data = np.asarray(data, dtype=float)
+        data = data[len(data) - min(len(data), self.size):]
+        self.buffer[:len(data)] = data
+        self.buffer[self.size:self.size + len(data)] = data
+        self.head = 0
+        self.count = len(data)
         return
 
     def add_item(self, item):
@@ -28,25 +55,222 @@ class CircularBuffer:
         :param item: item to add
         :return:
         """
-        self.buffer.append(item)
+        if self.count < self.size:
+            position = self.head + self.count
+            if position >= self.size:
+                position -= self.size
+            self.count += 1
+        else:
+            position = self.head
+            self.head = self.head + 1 if self.head + 1 < self.size else 0
+        self.buffer[position] = item
+        self.buffer[position + self.size] = item
         return
 
     def get_last_n_items(self, n: int):
         """
-        Returns the last n items from the buffer.
+        Returns the last n items from the buffer (all of them if there are less than n), oldest first.
         :param n: how many items
+        :return: read-only view
+        """
+        end = self.head + self.count
+        return self.view[end - min(n, self.count):end]
+
+    def get_last_item(self):
+        return self.buffer[self.head + self.count - 1]
+
+    def get_all_items(self):
+        """
+        Returns every item of the buffer, oldest first.
+        :return: read-only view
+        """
+        return self.view[self.head:self.head + self.count]
+
+    def get_size(self):
+        return self.size
+
+
+class SharedCircularBuffer:
+    """
+    CircularBuffer stored in a memory-mapped file, so that one writer process and any number of reader processes
+    share the same items, and the items survive a restart of any of them.
+    The file holds a header (format, size, sequence lock, number of items ever written) and the mirrored array of
+    CircularBuffer. The writer makes the sequence lock odd while it changes the buffer; readers copy the items and
+    retry if the sequence lock was odd or changed meanwhile, so they never see a torn read.
+    An item is committed by a single 8-byte write of the number of items ever written. Its upper copy, which is never
+    part of the window of the committed items before it, is written first, so a writer reopening the file after a
+    crash can restore the lower copies from the committed items.
+    """
+
+    MAGIC = 0x42425246_44504544  # 'DEPDFRBB'
+    VERSION = 1
+    HEADER_FIELDS = 6  # magic, version, size, sequence lock, items written, reserved
+    HEADER_BYTES = 8 * HEADER_FIELDS
+
+    def __init__(self, path: str, size: int = None, writer: bool = False, timeout: float = 1.0):
+        """
+        :param path: path of the file backing the buffer (e.g. under /dev/shm to keep it in memory)
+        :param size: size of the buffer, needed when the writer creates the file
+        :param writer: open for writing (only one process may do so at a time), otherwise read-only
+        :param timeout: readers give up after waiting this long for a write to finish [seconds]
+        """
+        self.path = path
+        self.writer = writer
+        self.timeout = timeout
+
+        if writer and not os.path.exists(path):
+            if size is None or size < 2:
+                raise ValueError('A size of at least 2 is needed to create the file of a shared buffer.')
+            with open(path + '.tmp', 'wb') as file:
+                file.truncate(self.HEADER_BYTES + 16 * size)
+                file.write(np.array([self.MAGIC, self.VERSION, size, 0, 0, 0], dtype=np.uint64).tobytes())
+            os.replace(path + '.tmp', path)
+
+        self.file = open(path, 'r+b' if writer else 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writer else mmap.ACCESS_READ)
+        self.header = np.frombuffer(self.mmap, dtype=np.uint64, count=self.HEADER_FIELDS)
+        if self.header[0] != self.MAGIC or self.header[1] > self.VERSION:
+            raise ValueError(f'{path} is not a shared circular buffer.')
+        self.size = int(self.header[2])
+        if size is not None and size != self.size:
+            raise ValueError(f'{path} holds a buffer of size {self.size}, not {size}.')
+        self.buffer = np.frombuffer(self.mmap, dtype=np.float64, count=2 * self.size, offset=self.HEADER_BYTES)
+
+        if writer:
+            self._recover()
+
+        return
+
+    def __getstate__(self):
+        raise TypeError('A SharedCircularBuffer cannot be pickled, open its file in the other process instead.')
+
+    def _window(self, written: int):
+        count = min(written, self.size)
+        head = written % self.size if written >= self.size else 0
+        return head, count
+
+    def _recover(self):
+        # a crash while writing may leave the sequence lock odd and the lower copy of the newest item unwritten
+        written = int(self.header[4])
+        self.header[3] += self.header[3] % 2
+        self.header[3] += 1
+        if written > 0:
+            newest = (written - 1) % self.size
+            self.buffer[newest] = self.buffer[newest + self.size]
+        head, count = self._window(written)
+        items = self.buffer[head:head + count].copy()
+        slots = np.arange(head, head + count) % self.size
+        self.buffer[slots] = items
+        self.buffer[slots + self.size] = items
+        self.header[3] += 1
+        return
+
+    def _check_writer(self):
+        if not self.writer:
+            raise RuntimeError(f'{self.path} is opened read-only, only its writer can change it.')
+
+    def load(self, data: list):
+        """
+        Clear then load buffer with data.
+        If data is longer then the size of the buffer, only the last N points will be in the buffer (if N=len(data)).
+        The sequence restarts from the number of loaded items, so readers have to start again from get_sequence().
+        :param data: list of values to load into buffer
         :return:
         """
-        begin = self.size - n
-        end = self.size
-        return list(itertools.islice(self.buffer, begin, end))
+        self._check_writer()
+        data = np.asarray(data, dtype=float)
+        data = data[len(data) - min(len(data), self.size):]
+        self.header[3] += 1
+        self.buffer[:len(data)] = data
+        self.buffer[self.size:self.size + len(data)] = data
+        self.header[4] = len(data)
+        self.header[3] += 1
+        return
+
+    def add_item(self, item):
+        """
+        Add the item into the buffer.
+        If the buffer is already full, the first item is dropped to make way for the new one.
+        :param item: item to add
+        :return:
+        """
+        self._check_writer()
+        written = int(self.header[4])
+        position = written % self.size
+        self.header[3] += 1
+        # the upper copy is outside of the window of the committed items, the lower one may be its oldest item
+        self.buffer[position + self.size] = item
+        self.header[4] = written + 1
+        self.buffer[position] = item
+        self.header[3] += 1
+        return
+
+    def _read(self, reader):
+        # sequence lock: retry until no write happened while reading
+        deadline = time.monotonic() + self.timeout
+        while True:
+            before = int(self.header[3])
+            if before % 2 == 0:
+                result = reader(int(self.header[4]))
+                if int(self.header[3]) == before:
+                    return result
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'The writer of {self.path} did not finish writing, it may have crashed.')
+            time.sleep(0)
+
+    def get_last_n_items(self, n: int):
+        """
+        Returns the last n items from the buffer (all of them if there are less than n), oldest first.
+        :param n: how many items
+        :return: copy of the items (read-only view for the writer)
+        """
+        def reader(written):
+            head, count = self._window(written)
+            return self.buffer[head + count - min(n, count):head + count]
+        if self.writer:
+            return _read_only(reader(int(self.header[4])))
+        return self._read(lambda written: reader(written).copy())
 
     def get_last_item(self):
-        return self.buffer[-1]
+        return self.get_last_n_items(1)[0]
 
     def get_all_items(self):
-        to_ret = np.asarray(self.buffer)
-        return to_ret
+        """
+        Returns every item of the buffer, oldest first.
+        :return: copy of the items (read-only view for the writer)
+        """
+        return self.get_last_n_items(self.size)
 
     def get_size(self):
         return self.size
+
+    def get_sequence(self):
+        """
+        Returns the number of items ever written to the buffer.
+        """
+        return int(self.header[4])
+
+    def read_since(self, sequence: int):
+        """
+        Returns the items written after the first sequence items, as far as they are still in the buffer.
+        :param sequence: number of items already read (e.g. the sequence returned by the previous call)
+        :return: items, the new sequence and the number of items that were overwritten before they could be read
+        """
+        def reader(written):
+            head, count = self._window(written)
+            new = min(written - sequence, count)
+            return self.buffer[head + count - new:head + count].copy(), written
+        items, written = self._read(reader)
+        return items, written, written - sequence - len(items)
+
+    def close(self):
+        del self.header, self.buffer
+        self.mmap.close()
+        self.file.close()
+        return
+
+
+def _read_only(array: np.ndarray):
+    view = array.view()
+    view.flags.writeable = False
+    return view
@@ -1,9 +1,13 @@
 import numpy as np
-import pandas as pd
 
+import checkpoint
+import latency
 import read_files
+import main_config as conf
 
 import online_buffer as obuff
+import modes_star as mstar
+import result_store
 import scaling
 import vmd
 
@@ -16,12 +20,23 @@ from OnlineDetectors.knncad.knncad_detector import KnncadDetector
 from OnlineDetectors.AnDePeD.AnDePeD_detector import ANDEPEDDetector
 
 
+# stages of next_timestep whose latency is recorded when profile_stages is on
+STAGES = ['buffer', 'scaling', 'mode_removal', 'detector', 'recording', 'total']
+
+# the verdict column of the saved results: 'final', or 'provisional' while the detector may still revise the score
+VERDICT_DTYPE = np.dtype('U11')
+
+
 class OnlineProcedure:
     """
     This class is responsible for executing online pre-processing and anomaly detection using a circular buffer.
     """
 
-    def __init__(self, mode: str, data_parameters: list, algorithm: str, dataset: str, initial_data: list):
+    def __init__(self, mode: str, data_parameters: list, algorithm: str, dataset: str, initial_data: list,
+                 fast_path: bool = True, max_saved_rows: int = None, spill_path: str = None,
+                 spill_every: int = 10000, vmd_warm_start: bool = False, vmd_verify: bool = False,
+                 vmd_every: int = 1, vmd_drift_threshold: float = None, vmd_budget: float = None,
+                 snapshot_path: str = None, snapshot_every: int = 10000, profile_stages: bool = False):
         """
         Initialise online pre-processing and anomaly detection.
         :param mode: 'I' or 'II'
@@ -29,6 +44,19 @@ class OnlineProcedure:
         :param algorithm: name of anomaly detector
         :param dataset: any string to reference the data by
         :param initial_data: to load the buffer with
+        :param fast_path: in Mode II, only compute the newest remainder in O(1) instead of processing the whole buffer
+        :param max_saved_rows: only keep the results of the last max_saved_rows timesteps and every anomalous one
+        :param spill_path: csv file to periodically spill the saved results to (cannot be used with max_saved_rows)
+        :param spill_every: number of timesteps between two spills
+        :param vmd_warm_start: in Mode I, seed the VMD of each timestep with the decomposition of the previous one
+        :param vmd_verify: also run the VMD from scratch to measure the error and the speedup of the warm start
+        :param vmd_every: in Mode I, run VMD only every vmd_every timesteps and extend the modes in between
+        :param vmd_drift_threshold: in Mode I, run VMD earlier when the remainders drift (see vmd.ScheduledVMD)
+        :param vmd_budget: in Mode I, average VMD time allowed per timestep [seconds]
+        :param snapshot_path: file to write a full snapshot to every snapshot_every timesteps (None: off), the state is
+                              pickled on the calling thread and written in the background
+        :param snapshot_every: number of timesteps between two background snapshots
+        :param profile_stages: record a latency histogram of each stage of next_timestep (see get_stage_latencies)
         """
 
         self.mode = mode
@@ -39,48 +67,262 @@ class OnlineProcedure:
         self.buffer = obuff.CircularBuffer(self._get_buffer_size())
         self.buffer.load(initial_data)
 
+        # the online samples follow the offline ones, whose first sample is the origin of modes_star
+        self.stream_offset = len(initial_data)
+        self.modes_star = mstar.load_modes_star(self.modes_star_path) if self.mode == 'II' else None
+
+        self.decomposer = vmd.WarmStartVMD(self.alpha_star, self.k_star, verify=vmd_verify) \
+            if vmd_warm_start and self.mode == 'I' else None
+        # scheduled recomputation replaces the per-timestep VMD (and its warm start)
+        self.scheduler = vmd.ScheduledVMD(self.alpha_star, self.k_star, every=vmd_every,
+                                          drift_threshold=vmd_drift_threshold, budget=vmd_budget, l=self.l) \
+            if self.mode == 'I' and (vmd_every > 1 or vmd_drift_threshold is not None or vmd_budget is not None) \
+            else None
+
+        # Mode II only needs the newest remainder, which can be computed from the window's minimum and maximum
+        self.fast_path = fast_path and self.mode == 'II'
+        if self.fast_path:
+            self.scaler = scaling.SlidingMinMaxScaler(self.buffer.get_size())
+            self.scaler.load(initial_data)
+
         self.algorithm = algorithm
         self.dataset = dataset
         self.detector = self.initialise_online_detector()
 
-        self.save_data = pd.DataFrame(columns=['algorithm', 'dataset', 'timestep', 'orig_value',
-                                               'remainder_value', 'anomaly_score'])
+        anomaly_threshold = read_files.read_detection_threshold(self.algorithm, conf.THRESHOLDS_FILE) \
+            if max_saved_rows is not None else .5
+        self.save_data = result_store.ColumnarRecorder(
+            columns=['timestep', 'orig_value', 'remainder_value', 'anomaly_score', 'verdict'],
+            dtypes=[np.int64, np.float64, np.float64, np.float64, VERDICT_DTYPE],
+            constants={'algorithm': self.algorithm, 'dataset': self.dataset},
+            max_rows=max_saved_rows, anomaly_column='anomaly_score', anomaly_threshold=anomaly_threshold,
+            spill_path=spill_path, spill_every=spill_every if spill_path is not None else 0,
+            pending_column='verdict', pending_value='provisional')
 
         self.time = 0
 
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.snapshotter = checkpoint.BackgroundSnapshotter(snapshot_path) if snapshot_path is not None else None
+
+        self.stage_latencies = latency.StageLatencies(STAGES) if profile_stages else None
+
+        return
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the background thread cannot be pickled, the shared sum of modes is reloaded from its file instead
+        state['snapshotter'] = None
+        state['modes_star'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.mode == 'II':
+            self.modes_star = mstar.load_modes_star(self.modes_star_path)
+        if self.snapshot_path is not None:
+            self.snapshotter = checkpoint.BackgroundSnapshotter(self.snapshot_path)
+        return
+
+    def snapshot(self, path: str):
+        """
+        Save the whole state of the procedure (buffer, scaler, detector including LSTM weights, saved results) to a
+        file, so that it can continue with restore() without replaying the stream.
+        Snapshots are not incremental: every one pickles the whole procedure again, only the rows already spilled to
+        disk are left out (and the sum of modes, which is reloaded from its file).
+        :param path: path of the snapshot file
+        :return:
+        """
+        checkpoint.write_snapshot(checkpoint.serialise(self), path)
+        return
+
+    @classmethod
+    def restore(cls, path: str):
+        """
+        Load a procedure saved by snapshot() (or by the background snapshots).
+        When the results are spilled to disk, the rows spilled after the snapshot are removed from the spill file, as
+        the restored procedure holds them in memory.
+        :param path: path of the snapshot file
+        :return: the procedure, continuing from the timestep the snapshot was taken at
+        """
+        procedure = checkpoint.read_snapshot(path)
+        if not isinstance(procedure, cls):
+            raise ValueError(f'{path} does not contain an {cls.__name__}.')
+        procedure.save_data.truncate_spill()
+        return procedure
+
+    def close(self):
+        """
+        Wait for the provisional anomaly scores to be decided and for the background snapshot being written (if any),
+        then stop the background threads of the procedure and of its detector.
+        """
+        self._apply_final_verdicts(wait=True)
+        self.detector.close()
+        if self.snapshotter is not None:
+            self.snapshotter.close()
+            self.snapshotter = None
+        return
+
+    def _snapshot_in_background(self, steps: int):
+        # take a snapshot if a multiple of snapshot_every has been reached during the last steps timesteps; the whole
+        # procedure is pickled here, on the stream thread, which pauses the stream in proportion to the size of the
+        # state; only compressing and writing the snapshot happen in the background
+        if self.snapshotter is None:
+            return
+        if self.time // self.snapshot_every > (self.time - steps) // self.snapshot_every:
+            self.snapshotter.submit(checkpoint.serialise(self))
         return
 
     def next_timestep(self, new_value: float):
+        t0 = self._lap()
+
         # (1) add data to buffer
         self.buffer.add_item(new_value)
+        t1 = self._lap('buffer', t0)
 
-        # (2) scale data
-        values = self.buffer.get_all_items()
-        scaled_values = scaling.preprocess(values)
+        if self.fast_path:
+            # (2) scale the new value using the incrementally updated minimum and maximum of the buffer
+            scaled_value = self.scaler.add_and_scale(new_value)
+            t2 = self._lap('scaling', t1)
+
+            # (3) only mode removal using the pre-computed modes belonging to the new value
+            new_remainder = self._mode_ii_fast_next_timestep(scaled_value)
+
+        elif self.scheduler is not None:
+            # (2-3) scale and remove the (possibly extended) modes from the newest value only; the scaling is part of
+            # the scheduled decomposition, so it is counted in mode_removal
+            t2 = self._lap('scaling', t1, end=t1)
+            new_remainder = self.scheduler.next_timestep(self.buffer.get_all_items())
 
-        # (3) ...
-        if self.mode == 'I':
-            remainder_values = self._mode_i_next_timestep(scaled_values)
-        elif self.mode == 'II':
-            remainder_values = self._mode_ii_next_timestep(scaled_values)
         else:
-            remainder_values = [-1]
+            # (2) scale data
+            values = self.buffer.get_all_items()
+            scaled_values = scaling.preprocess(values)
+            t2 = self._lap('scaling', t1)
+
+            # (3) ...
+            if self.mode == 'I':
+                remainder_values = self._mode_i_next_timestep(scaled_values)
+            elif self.mode == 'II':
+                remainder_values = self._mode_ii_next_timestep(scaled_values)
+            else:
+                remainder_values = [-1]
+
+            new_remainder = remainder_values[-1]
+        t3 = self._lap('mode_removal', t2)
 
         # (4) feed the new value to the anomaly detector
-        new_remainder = remainder_values[-1]
         anom_score = self.detector.next_timestep(new_remainder)
+        t4 = self._lap('detector', t3)
 
         # (5) save results for later analysis
-        self.save_data.loc[len(self.save_data)] = [self.algorithm, self.dataset, self.time,
-                                                   new_value, new_remainder, anom_score]
+        self.save_data.append(self.time, new_value, new_remainder, anom_score, self.detector.get_verdict(self.time))
+        self._apply_final_verdicts()
 
         self.time += 1
+        self._snapshot_in_background(1)
+        t5 = self._lap('recording', t4)
+        self._lap('total', t0, end=t5)
+
+        return anom_score
+
+    def _lap(self, stage: str = None, begin: int = 0, count: int = 1, end: int = None):
+        # with profile_stages: returns the time now (or end), after recording that stage has lasted since begin for
+        # count timesteps; without it, nothing is measured
+        if self.stage_latencies is None:
+            return 0
+        if end is None:
+            end = self.stage_latencies.now()
+        if stage is not None:
+            self.stage_latencies.record(stage, begin, end, count)
+        return end
+
+    def get_stage_latencies(self):
+        """
+        Returns the latency of each stage of next_timestep since the last reset (profile_stages has to be on).
+        Stages: buffer, scaling, mode_removal (VMD, scheduled VMD or modes_star subtraction), detector, recording
+        and total. With the scheduled VMD, the scaling is part of mode_removal and lasts 0 on its own. The timesteps of
+        a batch (run_batch, process_shared) are counted with the average duration of each stage in the batch.
+        :return: {stage: {'count', 'p50', 'p99', 'max'}} with the durations in seconds
+        """
+        if self.stage_latencies is None:
+            raise RuntimeError('Stage latencies are only recorded when the procedure is created with profile_stages.')
+        return self.stage_latencies.get_stats()
 
+    def reset_stage_latencies(self):
+        if self.stage_latencies is not None:
+            self.stage_latencies.reset()
         return
 
+    def run_batch(self, new_values):
+        """
+        Process several consecutive values at once, with the same results as calling next_timestep for each of them.
+        In Mode II (fast path), every remainder is computed in one vectorised step and the detector scores the whole
+        batch if it supports it; otherwise the values are processed one by one. No detector scores a whole batch yet,
+        so only the pre-processing is faster: end to end, a replay takes about as long as with next_timestep.
+        :param new_values: values in the order of arrival
+        :return: anomaly scores of the values
+        """
+        return self._run_batch(new_values, self._lap())
+
+    def _run_batch(self, new_values, t0: int):
+        # t0: when the batch started, for the latency of the buffer stage
+        new_values = np.asarray(new_values, dtype=float)
+        if not self.fast_path or len(new_values) == 0:
+            return np.array([self.next_timestep(new_value) for new_value in new_values], dtype=float)
+        count = len(new_values)
+
+        # (1) bring the buffer and the scaler to the state they would have after adding the values one by one
+        values = np.concatenate([self.buffer.get_all_items(), new_values])
+        kept = values[-self.buffer.get_size():]
+        self.buffer.load(kept)
+        self.scaler.load(kept)
+        t1 = self._lap('buffer', t0, count)
+
+        # (2) scale every value, using the buffer contents before the batch
+        scaled_values = scaling.preprocess_sliding(values[:-count], new_values, self.buffer.get_size())
+        t2 = self._lap('scaling', t1, count)
+
+        # (3) remove the modes from every value
+        remainders = scaled_values - self.modes_star.take(self.stream_offset + self.time, count)
+        t3 = self._lap('mode_removal', t2, count)
+
+        # (4) feed the new values to the anomaly detector
+        anom_scores = self.detector.next_batch(remainders)
+        t4 = self._lap('detector', t3, count)
+
+        # (5) save results for later analysis
+        timesteps = np.arange(self.time, self.time + count)
+        self.save_data.extend(timesteps, new_values, remainders, anom_scores,
+                              np.array([self.detector.get_verdict(time) for time in timesteps], dtype=VERDICT_DTYPE))
+        self._apply_final_verdicts()
+
+        self.time += count
+        self._snapshot_in_background(count)
+        t5 = self._lap('recording', t4, count)
+        self._lap('total', t0, count, end=t5)
+
+        return anom_scores
+
+    def process_shared(self, shared_buffer: obuff.SharedCircularBuffer, sequence: int):
+        """
+        Process the values written to a shared circular buffer (by another process) since the last call.
+        Reading the shared buffer is counted in the buffer stage of the stage latencies.
+        :param shared_buffer: the buffer, opened read-only
+        :param sequence: the sequence returned by the previous call (0 or shared_buffer.get_sequence() at first)
+        :return: anomaly scores of the new values, the new sequence, number of values overwritten before being read
+        """
+        t0 = self._lap()
+        new_values, sequence, missed = shared_buffer.read_since(sequence)
+        anom_scores = self._run_batch(new_values, t0) if len(new_values) > 0 else np.empty(0)
+        return anom_scores, sequence, missed
+
     def _mode_i_next_timestep(self, scaled_values: np.ndarray):
         # (3.1) VMD + mode removal using (alpha_star, K_star)
-        remainder_values, _, _ = vmd.decompose(scaled_values, self.alpha_star, self.k_star)
+        if self.decomposer is not None:
+            remainder_values, _, _ = self.decomposer.decompose(scaled_values)
+        else:
+            remainder_values, _, _ = vmd.decompose(scaled_values, self.alpha_star, self.k_star)
 
         # vmd.decompose returns a 2D numpy array (time, data), where the second column is needed
         remainder_values = remainder_values[:, 1]
@@ -90,11 +332,16 @@ class OnlineProcedure:
         return remainder_values
 
     def _mode_ii_next_timestep(self, scaled_values: np.ndarray):
-        # (3) only mode removal using pre-computed modes
-        modes_star = self.read_and_extend_modes_star_to_given_length(len(scaled_values))
+        # (3) only mode removal using pre-computed modes, aligned to the position of the samples in the stream
+        window_start = self.stream_offset + self.time - len(scaled_values) + 1
+        modes_star = self.modes_star.window(window_start, len(scaled_values))
         remainder_values = scaled_values - modes_star
         return remainder_values
 
+    def _mode_ii_fast_next_timestep(self, scaled_value: float):
+        # (3) only mode removal using the pre-computed modes belonging to the new value
+        return scaled_value - self.modes_star.value_at(self.stream_offset + self.time)
+
     def _get_buffer_size(self):
         to_ret = -1
         if self.mode == 'I':
@@ -107,52 +354,63 @@ class OnlineProcedure:
             return -1
 
     def initialise_online_detector(self):
-        if self.algorithm == 'bayesChangePt':
-            det = BayesChangePtDetector(input_min=self.data_min, input_max=self.data_max)
-
-        elif self.algorithm == 'windowedGaussian':
-            det = WindowedGaussianDetector(input_min=self.data_min, input_max=self.data_max)
-
-        elif self.algorithm == 'relativeEntropy':
-            det = RelativeEntropyDetector(input_min=self.data_min, input_max=self.data_max)
+        return create_online_detector(self.algorithm, self.data_min, self.data_max)
 
-        elif self.algorithm == 'earthgeckoSkyline':
-            det = EarthgeckoSkylineDetector(input_min=self.data_min, input_max=self.data_max)
+    def _apply_final_verdicts(self, wait: bool = False):
+        # replace the provisional anomaly scores decided by the detector since the last call with the final ones
+        for time, anom_score in self.detector.pop_final_verdicts(wait):
+            self.save_data.update(time, anomaly_score=anom_score, verdict='final')
+        return
 
-        elif self.algorithm == 'contextOSE':
-            det = ContextOSEDetector(input_min=self.data_min, input_max=self.data_max)
+    def export_saved_data(self, filepath: str):
+        # every saved anomaly score is final in the exported results
+        self._apply_final_verdicts(wait=True)
+        self.save_data.export(filepath)
+        return
 
-        elif self.algorithm == 'knncad':
-            det = KnncadDetector(input_min=self.data_min, input_max=self.data_max)
 
-        elif self.algorithm == 'AnDePeDPro':
-            det = ANDEPEDDetector(buffer_size=100000, algorithm='AnDePeDPro',
-                                  input_min=self.data_min, input_max=self.data_max)
+def create_online_detector(algorithm: str, data_min: float, data_max: float):
+    """
+    Create and initialise the online anomaly detector called algorithm.
+    :param algorithm: name of anomaly detector
+    :param data_min: minimum of the offline data
+    :param data_max: maximum of the offline data
+    :return: the detector, or -1 if algorithm is unknown
+    """
+    if algorithm == 'bayesChangePt':
+        det = BayesChangePtDetector(input_min=data_min, input_max=data_max)
 
-        elif self.algorithm == 'AnDePeD':
-            det = ANDEPEDDetector(buffer_size=100000, algorithm='AnDePeD',
-                                  input_min=self.data_min, input_max=self.data_max)
+    elif algorithm == 'windowedGaussian':
+        det = WindowedGaussianDetector(input_min=data_min, input_max=data_max)
 
-        else:
-            return -1
+    elif algorithm == 'relativeEntropy':
+        det = RelativeEntropyDetector(input_min=data_min, input_max=data_max)
 
-        # call the children's initialisation functions
-        det.initialize()
+    elif algorithm == 'earthgeckoSkyline':
+        det = EarthgeckoSkylineDetector(input_min=data_min, input_max=data_max)
 
-        return det
+    elif algorithm == 'contextOSE':
+        det = ContextOSEDetector(input_min=data_min, input_max=data_max)
 
-    def export_saved_data(self, filepath: str):
-        self.save_data.to_csv(filepath)
-        return
+    elif algorithm == 'knncad':
+        det = KnncadDetector(input_min=data_min, input_max=data_max)
 
-    def read_and_extend_modes_star_to_given_length(self, desired_length: int):
-        ms_orig = read_files.read_file_pandas(self.modes_star_path, column='value', to_numpy=True)
-        ms_new = np.empty(shape=0)
+    elif algorithm == 'AnDePeDPro':
+        det = ANDEPEDDetector(buffer_size=100000, algorithm='AnDePeDPro', bounded=conf.ANDEPED_BOUNDED_MEMORY,
+                              lstm_backend=conf.ANDEPED_LSTM_BACKEND,
+                              async_retrain=conf.ANDEPED_ASYNC_RETRAIN, detector_2=conf.ANDEPED_DETECTOR_2,
+                              adaptive_retrain=conf.ANDEPED_ADAPTIVE_RETRAIN, input_min=data_min, input_max=data_max)
 
-        while len(ms_new) + len(ms_orig) < desired_length:
-            ms_new = np.append(ms_new, ms_orig)
+    elif algorithm == 'AnDePeD':
+        det = ANDEPEDDetector(buffer_size=100000, algorithm='AnDePeD', bounded=conf.ANDEPED_BOUNDED_MEMORY,
+                              lstm_backend=conf.ANDEPED_LSTM_BACKEND,
+                              async_retrain=conf.ANDEPED_ASYNC_RETRAIN, detector_2=conf.ANDEPED_DETECTOR_2,
+                              adaptive_retrain=conf.ANDEPED_ADAPTIVE_RETRAIN, input_min=data_min, input_max=data_max)
 
-        ms_new = np.append(ms_new, ms_orig[ : desired_length - len(ms_new)])
+    else:
+        return -1
 
-        return ms_new
+    # call the children's initialisation functions
+    det.initialize()
 
+    return det
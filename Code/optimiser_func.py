@@ -45,7 +45,8 @@ def read_preprocess_save_data_get_mse(dataset: str, alpha: float, k: int, omegas
 
     # and save usum (sum of modes) for online use
     export_usum = pd.DataFrame(usum, columns=['timestep', 'value'])
-    usum_name = 'usum_' + str(datetime.now().strftime('%Y-%m-%d_%H%M%S_%f'))[:-3] + '.csv'
+    # the process id keeps the names unique when several datasets are prepared in parallel
+    usum_name = 'usum_' + str(datetime.now().strftime('%Y-%m-%d_%H%M%S_%f'))[:-3] + f'_{os.getpid()}.csv'
     usum_path = conf.MODE_SUM_DIR + '/' + usum_name
     export_usum.to_csv(usum_path)
 
@@ -21,14 +21,24 @@ def read_anomaly_detections(filename: str, detector: str, thds_file: str, data_c
     """
     data = pd.read_csv(filename)
     results = data[data_column]
-    if detector in HALVER_DETECTORS:
-        threshold = .5
-    else:
-        with open(thds_file) as json_file:
-            threshold = float(json.load(json_file)[detector][thresholds_type]['threshold'])
+    threshold = read_detection_threshold(detector, thds_file, thresholds_type)
     return [True if score >= threshold else False for score in results]
 
 
+def read_detection_threshold(detector: str, thds_file: str, thresholds_type: str = 'standard'):
+    """
+    Returns the anomaly score threshold above which a detection is considered an anomaly.
+    :param detector: The name of the anomaly detection algorithm.
+    :param thds_file: The path leading to the detection thresholds.
+    :param thresholds_type: Choose the type of threshold to access.
+    :return: The detection threshold.
+    """
+    if detector in HALVER_DETECTORS:
+        return .5
+    with open(thds_file) as json_file:
+        return float(json.load(json_file)[detector][thresholds_type]['threshold'])
+
+
 def read_anomaly_flags(dataset: str, eval_data_dir: str, flags_filename: str = conf.NAB_LABELS_FILE):
     """
     Read anomaly flags and return where they are (indices) in the dataset.
@@ -0,0 +1,282 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class ColumnarRecorder:
+    """
+    Append-only, columnar store for per-timestep results.
+    Rows are written into typed NumPy chunks whose capacity grows geometrically, so appending is O(1) and no pandas
+    object is built until the results are exported.
+    Optionally, rows can be spilled to a csv file periodically, or only the last rows and the anomalous rows can be
+    kept in memory (bounded mode) for unbounded streams.
+    Rows still in memory can be changed with update(), e.g. when a provisional anomaly score gets its final value.
+    """
+
+    def __init__(self, columns: list, dtypes: list, constants: dict = None, initial_capacity: int = 1024,
+                 max_rows: int = None, anomaly_column: str = None, anomaly_threshold: float = .5,
+                 spill_path: str = None, spill_every: int = 0, pending_column: str = None, pending_value=None):
+        """
+        :param columns: names of the recorded columns, in the order they are appended
+        :param dtypes: NumPy dtype of each recorded column
+        :param constants: {column name: value} for columns that are the same in every row (stored only once)
+        :param initial_capacity: number of rows in the first chunk, every new chunk is twice the size of the last one
+        :param max_rows: bounded mode, keep only the last max_rows rows plus every anomalous row (None: keep all)
+        :param anomaly_column: column compared to anomaly_threshold to decide whether a row is anomalous
+        :param anomaly_threshold: rows with anomaly_column >= anomaly_threshold are anomalous
+        :param spill_path: csv file to spill rows to (None: keep everything in memory)
+        :param spill_every: number of rows to collect in memory between two spills
+        :param pending_column: rows with pending_column == pending_value may still be updated, so neither they nor the
+                               rows after them are spilled
+        :param pending_value: see pending_column
+        """
+        if len(columns) != len(dtypes):
+            raise ValueError('The number of columns and dtypes has to be the same.')
+        if max_rows is not None and spill_path is not None:
+            raise ValueError('Bounded mode (max_rows) and spilling to disk (spill_path) cannot be used together.')
+        if max_rows is not None and anomaly_column not in columns:
+            raise ValueError('Bounded mode needs an anomaly_column that is one of the recorded columns.')
+        if spill_path is not None and spill_every < 1:
+            raise ValueError('spill_every has to be at least one when spilling to disk.')
+
+        self.columns = list(columns)
+        self.dtypes = [np.dtype(d) for d in dtypes]
+        self.constants = constants if constants is not None else {}
+
+        self.initial_capacity = initial_capacity
+        self.max_rows = max_rows
+        self.anomaly_index = self.columns.index(anomaly_column) if anomaly_column is not None else None
+        self.anomaly_threshold = anomaly_threshold
+        self.spill_path = spill_path
+        self.spill_every = spill_every
+        self.pending_index = self.columns.index(pending_column) if pending_column is not None else None
+        self.pending_value = pending_value
+
+        self.num_rows = 0  # total number of rows appended, including the spilled and dropped ones
+        self.num_spilled = 0  # the rows before this one are in the spill file
+        self.last_spill = 0  # the number of rows at the last spill
+        self.spill_bytes = 0  # the size of the spill file after the last spill
+
+        # unbounded storage: list of chunks, each chunk holds one array per column plus the row numbers
+        self.chunks = []
+        self.chunk_fill = 0
+        # bounded storage: a ring of the last max_rows rows, older anomalous rows are moved to self.chunks
+        if self.max_rows is not None:
+            self.ring = self._new_chunk(self.max_rows)
+
+        return
+
+    def _new_chunk(self, capacity: int):
+        chunk = [np.empty(capacity, dtype=d) for d in self.dtypes]
+        chunk.append(np.empty(capacity, dtype=np.int64))  # row numbers
+        return chunk
+
+    def _append_to_chunks(self, row: tuple, row_number: int):
+        if not self.chunks or self.chunk_fill == len(self.chunks[-1][-1]):
+            capacity = self.initial_capacity if not self.chunks else 2 * len(self.chunks[-1][-1])
+            self.chunks.append(self._new_chunk(capacity))
+            self.chunk_fill = 0
+
+        chunk = self.chunks[-1]
+        for column, value in zip(chunk, row):
+            column[self.chunk_fill] = value
+        chunk[-1][self.chunk_fill] = row_number
+        self.chunk_fill += 1
+        return
+
+    def append(self, *row):
+        """
+        Append a row to the store.
+        :param row: one value for each recorded column, in the order of columns
+        :return:
+        """
+        if self.max_rows is None:
+            self._append_to_chunks(row, self.num_rows)
+        else:
+            slot = self.num_rows % self.max_rows
+            # the row about to be overwritten is kept only if it is anomalous
+            if self.num_rows >= self.max_rows and \
+                    self.ring[self.anomaly_index][slot] >= self.anomaly_threshold:
+                self._append_to_chunks(tuple(column[slot] for column in self.ring[:-1]), self.ring[-1][slot])
+            for column, value in zip(self.ring, row):
+                column[slot] = value
+            self.ring[-1][slot] = self.num_rows
+
+        self.num_rows += 1
+
+        if self.spill_path is not None and self.num_rows - self.last_spill >= self.spill_every:
+            self.spill()
+
+        return
+
+    def extend(self, *columns):
+        """
+        Append several rows to the store at once.
+        :param columns: one array-like for each recorded column (in the order of columns), or a scalar to repeat
+        :return:
+        """
+        length = max(np.size(c) for c in columns)
+        columns = [np.broadcast_to(c, length) for c in columns]
+
+        if self.max_rows is not None or self.spill_path is not None:
+            for row in zip(*columns):
+                self.append(*row)
+            return
+
+        done = 0
+        while done < length:
+            if not self.chunks or self.chunk_fill == len(self.chunks[-1][-1]):
+                capacity = self.initial_capacity if not self.chunks else 2 * len(self.chunks[-1][-1])
+                self.chunks.append(self._new_chunk(max(capacity, length - done)))
+                self.chunk_fill = 0
+            chunk = self.chunks[-1]
+            count = min(length - done, len(chunk[-1]) - self.chunk_fill)
+            for column, values in zip(chunk, columns):
+                column[self.chunk_fill:self.chunk_fill + count] = values[done:done + count]
+            chunk[-1][self.chunk_fill:self.chunk_fill + count] = np.arange(self.num_rows, self.num_rows + count)
+            self.chunk_fill += count
+            self.num_rows += count
+            done += count
+
+        return
+
+    def update(self, row_number: int, **values):
+        """
+        Change the recorded values of a row that is still kept in memory.
+        :param row_number: number of the row, in the order of appending
+        :param values: {column name: new value}
+        :return: whether the row was found (spilled and dropped rows cannot be changed)
+        """
+        if self.max_rows is not None and self.num_rows - self.max_rows <= row_number < self.num_rows:
+            chunk, position = self.ring, row_number % self.max_rows
+        else:
+            # the row numbers increase along the chunks, recent rows are the likeliest to be updated
+            for i in range(len(self.chunks) - 1, -1, -1):
+                fill = self.chunk_fill if i == len(self.chunks) - 1 else len(self.chunks[i][-1])
+                row_numbers = self.chunks[i][-1][:fill]
+                if fill > 0 and row_numbers[0] <= row_number:
+                    position = np.searchsorted(row_numbers, row_number)
+                    if position == fill or row_numbers[position] != row_number:
+                        return False
+                    chunk = self.chunks[i]
+                    break
+            else:
+                return False
+
+        for name, value in values.items():
+            chunk[self.columns.index(name)][position] = value
+        return True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # only the filled part of the last chunk is saved, the next row will open a new chunk
+        if self.chunks:
+            state['chunks'] = self.chunks[:-1] + [[column[:self.chunk_fill].copy() for column in self.chunks[-1]]]
+        return state
+
+    def __len__(self):
+        return self.num_rows
+
+    def _memory_columns(self):
+        """
+        Returns the rows kept in memory as one contiguous array per column (the row numbers are the last array).
+        """
+        columns = [[] for _ in range(len(self.columns) + 1)]
+        for i, chunk in enumerate(self.chunks):
+            fill = self.chunk_fill if i == len(self.chunks) - 1 else len(chunk[-1])
+            for c, column in enumerate(chunk):
+                columns[c].append(column[:fill])
+
+        if self.max_rows is not None:
+            ring_fill = min(self.num_rows, self.max_rows)
+            # oldest row first
+            order = np.arange(self.num_rows - ring_fill, self.num_rows) % self.max_rows
+            for c, column in enumerate(self.ring):
+                columns[c].append(column[order])
+
+        return [np.concatenate(c) if c else np.empty(0, dtype=d)
+                for c, d in zip(columns, self.dtypes + [np.dtype(np.int64)])]
+
+    def _build_dataframe(self, columns: list):
+        data = {}
+        for name in self._all_column_names():
+            if name in self.constants:
+                data[name] = np.full(len(columns[-1]), self.constants[name], dtype=object)
+            else:
+                data[name] = columns[self.columns.index(name)]
+        return pd.DataFrame(data, index=pd.Index(columns[-1]))
+
+    def _all_column_names(self):
+        return list(self.constants) + self.columns
+
+    def spill(self):
+        """
+        Append the rows held in memory to the spill file, then free them. Pending rows and the rows after them stay in
+        memory, so the spill file is in the order of the rows.
+        :return:
+        """
+        if self.spill_path is None:
+            return
+        columns = self._memory_columns()
+        kept = len(columns[-1])
+        if self.pending_index is not None:
+            pending = np.flatnonzero(columns[self.pending_index] == self.pending_value)
+            kept = pending[0] if len(pending) > 0 else kept
+        if kept > 0 or self.num_spilled == 0:
+            self._build_dataframe([column[:kept] for column in columns]).to_csv(
+                self.spill_path, mode='a' if self.num_spilled > 0 else 'w', header=self.num_spilled == 0)
+            self.spill_bytes = os.path.getsize(self.spill_path)
+
+        self.chunks = []
+        self.chunk_fill = 0
+        if kept < len(columns[-1]):
+            self.num_spilled = int(columns[-1][kept])
+            chunk = self._new_chunk(max(self.initial_capacity, len(columns[-1]) - kept))
+            for column, values in zip(chunk, columns):
+                column[:len(values) - kept] = values[kept:]
+            self.chunks.append(chunk)
+            self.chunk_fill = len(columns[-1]) - kept
+        else:
+            self.num_spilled = self.num_rows
+        self.last_spill = self.num_rows
+        return
+
+    def truncate_spill(self):
+        """
+        Cut the spill file back to its size at the last spill of this state, e.g. after restoring a saved state: the
+        rows spilled after the state was saved are still in memory in it, and will be spilled again.
+        :return:
+        """
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return
+        size = os.path.getsize(self.spill_path)
+        if size < self.spill_bytes:
+            raise ValueError(f'{self.spill_path} is shorter than when the results were saved ({size} < '
+                             f'{self.spill_bytes} bytes).')
+        if size > self.spill_bytes:
+            os.truncate(self.spill_path, self.spill_bytes)
+        return
+
+    def to_dataframe(self):
+        """
+        Build a DataFrame of every row that has been kept (including the spilled ones), indexed by row number.
+        :return:
+        """
+        memory = self._build_dataframe(self._memory_columns())
+        if self.spill_path is None or self.num_spilled == 0:
+            return memory
+        spilled = pd.read_csv(self.spill_path, index_col=0)
+        return pd.concat([spilled, memory]) if len(memory) > 0 else spilled
+
+    def export(self, filepath: str):
+        """
+        Write every row that has been kept to a csv file.
+        :param filepath: path of the csv file
+        :return:
+        """
+        if self.spill_path is not None and os.path.abspath(filepath) == os.path.abspath(self.spill_path):
+            self.spill()
+        else:
+            self.to_dataframe().to_csv(filepath)
+        return
@@ -1,3 +1,5 @@
+import collections
+
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
 
@@ -19,3 +21,121 @@ def preprocess(data, mode=MODE, out_range=(SCALE_MIN, SCALE_MAX)):
     new_data = new_data.flatten()
 
     return new_data
+
+
+def preprocess_sliding(previous, new, size: int, out_range=(SCALE_MIN, SCALE_MAX)):
+    """
+    Min-max scale each of the new values using the window of the last size values ending with it, as if the values
+    were added one by one to a circular buffer already containing the previous values.
+    The same as taking the last element of preprocess(window) for each window, but vectorised.
+    :param previous: values in the buffer before the first new value (only the last size - 1 are used)
+    :param new: new values to scale
+    :param size: length of the sliding window (the same as the size of the circular buffer)
+    :param out_range: (min, max) of the scaled values
+    :return: scaled version of each new value
+    """
+    new = np.asarray(new, dtype=float)
+    previous = np.asarray(previous, dtype=float)[len(previous) - min(len(previous), size - 1):]
+    full = np.concatenate([previous, new])
+
+    # windows of the first values may be shorter than size, padding with the first value does not change their extrema
+    pad = size - 1 - len(previous)
+    if pad > 0:
+        full = np.concatenate([np.full(pad, full[0]), full])
+
+    windows = np.lib.stride_tricks.sliding_window_view(full, size)
+    data_min = windows.min(axis=1)
+    data_range = windows.max(axis=1) - data_min
+    # constant windows are handled the same way as in sklearn (_handle_zeros_in_scale)
+    data_range[data_range < 10 * np.finfo(np.float64).eps] = 1.0
+    scale = (out_range[1] - out_range[0]) / data_range
+    return new * scale + (out_range[0] - data_min * scale)
+
+
+class SlidingMinMaxScaler:
+    """
+    Min-max scaling of the newest value of a sliding window in O(1) amortised time per value.
+    The result equals the last element of preprocess(window), as the window minimum and maximum are kept up to date
+    with monotonic deques instead of refitting MinMaxScaler over the whole window.
+    """
+
+    def __init__(self, size: int, out_range=(SCALE_MIN, SCALE_MAX)):
+        """
+        :param size: length of the sliding window (the same as the size of the circular buffer)
+        :param out_range: (min, max) of the scaled values
+        """
+        self.size = size
+        self.out_range = out_range
+
+        self.count = 0  # number of values added so far
+        self.min_deque = collections.deque()  # (index, value) pairs with increasing values
+        self.max_deque = collections.deque()  # (index, value) pairs with decreasing values
+
+        return
+
+    def load(self, data: list):
+        """
+        Clear then load the window with data, only the last size values are kept.
+        :param data: list of values to load into the window
+        :return:
+        """
+        self.count = 0
+        self.min_deque.clear()
+        self.max_deque.clear()
+        for value in data[-self.size:]:
+            self.add_item(value)
+        return
+
+    def add_item(self, value: float):
+        """
+        Add a value to the window, dropping the oldest one if the window is already full.
+        :param value: value to add
+        :return:
+        """
+        index = self.count
+
+        while self.min_deque and self.min_deque[-1][1] >= value:
+            self.min_deque.pop()
+        self.min_deque.append((index, value))
+        while self.max_deque and self.max_deque[-1][1] <= value:
+            self.max_deque.pop()
+        self.max_deque.append((index, value))
+
+        # drop the values that have left the window
+        oldest_index = index - self.size + 1
+        if self.min_deque[0][0] < oldest_index:
+            self.min_deque.popleft()
+        if self.max_deque[0][0] < oldest_index:
+            self.max_deque.popleft()
+
+        self.count += 1
+        return
+
+    def get_min(self):
+        return self.min_deque[0][1]
+
+    def get_max(self):
+        return self.max_deque[0][1]
+
+    def scale(self, value: float):
+        """
+        Scale a value using the minimum and maximum of the current window, the same way MinMaxScaler does.
+        :param value: value to scale
+        :return:
+        """
+        data_min = self.get_min()
+        data_range = self.get_max() - data_min
+        # constant windows are handled the same way as in sklearn (_handle_zeros_in_scale)
+        if data_range < 10 * np.finfo(np.float64).eps:
+            data_range = 1.0
+        scale = (self.out_range[1] - self.out_range[0]) / data_range
+        return value * scale + (self.out_range[0] - data_min * scale)
+
+    def add_and_scale(self, value: float):
+        """
+        Add a value to the window, then return its scaled version.
+        :param value: value to add
+        :return:
+        """
+        self.add_item(value)
+        return self.scale(value)
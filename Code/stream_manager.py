@@ -0,0 +1,300 @@
+import sys
+
+import numpy as np
+
+import main_config as conf
+import modes_star as mstar
+import online_use as use
+import scaling
+
+
+def deep_sizeof(obj, seen: set = None):
+    """
+    Approximate the memory used by an object and everything it references (NumPy buffers included).
+    :param obj: any object
+    :param seen: ids of the objects already counted
+    :return: size [bytes]
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) if obj.base is None else obj.nbytes
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+class StreamManager:
+    """
+    Mode II online pre-processing and anomaly detection for many streams in one process.
+    The state of every stream is stored in struct-of-arrays form (one row per stream): a 2-D circular buffer, the
+    minimum and maximum of each buffer and the position of each stream in its sum of modes (modes_star).
+    A tick of values for all streams is scaled and has its modes removed in one vectorised call, only the anomaly
+    detectors are called one by one.
+    """
+
+    def __init__(self, l: int = conf.L, initial_capacity: int = 64):
+        """
+        :param l: length of anomaly detection array (the buffer size is the same as in OnlineProcedure)
+        :param initial_capacity: number of streams to allocate memory for at first, doubled whenever needed
+        """
+        self.size = l + l % 2
+        self.capacity = 0
+        self.num_streams = 0
+
+        self.stream_ids = list()  # row -> stream id
+        self.rows = dict()  # stream id -> row
+        self.algorithms = list()  # row -> name of anomaly detector
+        self.detectors = list()  # row -> anomaly detector (None if only remainders are needed)
+        self.modes_star_paths = list()  # row -> path of modes_star
+
+        # struct-of-arrays state, one row per stream
+        self.ring = np.empty((0, self.size))
+        self.count = np.empty(0, dtype=np.int64)  # number of values added to the buffer
+        self.window_min = np.empty(0)
+        self.window_max = np.empty(0)
+        self.position = np.empty(0, dtype=np.int64)  # position of the next value, counted from the offline data
+        self.time = np.empty(0, dtype=np.int64)  # number of online values processed
+        self.ms_base = np.empty(0, dtype=np.int64)  # index of the stream's modes_star in modes_star_flat
+        self.ms_period = np.empty(0, dtype=np.int64)
+
+        # every modes_star used by at least one stream, concatenated; the capacity grows geometrically, and the ones no
+        # stream uses anymore are only dropped once they take up half of the filled part
+        self.modes_star_flat = np.empty(0)
+        self.modes_star_fill = 0
+        self.modes_star_unused = 0
+        self.modes_star_base = dict()  # path -> index in modes_star_flat
+        self.modes_star_users = dict()  # path -> number of streams using it
+
+        self._grow(initial_capacity)
+
+        return
+
+    def _grow(self, capacity: int):
+        def resized(array: np.ndarray):
+            new = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            new[:self.num_streams] = array[:self.num_streams]
+            return new
+
+        self.ring = resized(self.ring)
+        self.count = resized(self.count)
+        self.window_min = resized(self.window_min)
+        self.window_max = resized(self.window_max)
+        self.position = resized(self.position)
+        self.time = resized(self.time)
+        self.ms_base = resized(self.ms_base)
+        self.ms_period = resized(self.ms_period)
+        self.capacity = capacity
+        return
+
+    def _append_modes_star(self, path: str, values: np.ndarray):
+        """
+        Append a modes_star to modes_star_flat.
+        """
+        fill = self.modes_star_fill
+        if fill + len(values) > len(self.modes_star_flat):
+            grown = np.empty(max(2 * len(self.modes_star_flat), fill + len(values)))
+            grown[:fill] = self.modes_star_flat[:fill]
+            self.modes_star_flat = grown
+        self.modes_star_flat[fill:fill + len(values)] = values
+        self.modes_star_base[path] = fill
+        self.modes_star_fill += len(values)
+        return
+
+    def _compact_modes_star(self):
+        """
+        Move the modes_star still in use to the beginning of modes_star_flat and update the base index of each stream.
+        """
+        flat, base = self.modes_star_flat, self.modes_star_base
+        self.modes_star_flat = np.empty(0)
+        self.modes_star_fill = 0
+        self.modes_star_unused = 0
+        self.modes_star_base = dict()
+        for row, path in enumerate(self.modes_star_paths):
+            if path not in self.modes_star_base:
+                self._append_modes_star(path, flat[base[path]:base[path] + self.ms_period[row]])
+            self.ms_base[row] = self.modes_star_base[path]
+        return
+
+    def add_stream(self, stream_id, algorithm: str, modes_star_path: str, data_min: float, data_max: float,
+                   initial_data: list):
+        """
+        Add a new stream to the manager.
+        :param stream_id: any hashable to reference the stream by
+        :param algorithm: name of anomaly detector, or None to only compute remainders
+        :param modes_star_path: path of the sum of modes computed during offline preparation
+        :param data_min: minimum of the offline data
+        :param data_max: maximum of the offline data
+        :param initial_data: to load the buffer with (the offline data)
+        :return:
+        """
+        if stream_id in self.rows:
+            raise ValueError(f'A stream with the id {stream_id} already exists.')
+        initial_data = np.asarray(initial_data, dtype=float)
+        if len(initial_data) == 0:
+            raise ValueError('The buffer of a stream has to be loaded with at least one value.')
+
+        if self.num_streams == self.capacity:
+            self._grow(2 * self.capacity)
+
+        row = self.num_streams
+        detector = None
+        if algorithm is not None:
+            detector = use.create_online_detector(algorithm, data_min, data_max)
+            if detector == -1:
+                raise ValueError(f'Unknown anomaly detector: {algorithm}')
+
+        # slots not yet written hold the first value, which does not change the extrema of the buffer
+        kept = initial_data[-self.size:]
+        first_index = len(initial_data) - len(kept)
+        self.ring[row] = kept[0]
+        self.ring[row, np.arange(first_index, len(initial_data)) % self.size] = kept
+        self.count[row] = len(initial_data)
+        self.window_min[row] = np.min(kept)
+        self.window_max[row] = np.max(kept)
+        self.position[row] = len(initial_data)
+        self.time[row] = 0
+        if modes_star_path not in self.modes_star_base:
+            self._append_modes_star(modes_star_path, mstar.load_modes_star(modes_star_path).values)
+        self.modes_star_users[modes_star_path] = self.modes_star_users.get(modes_star_path, 0) + 1
+        self.ms_base[row] = self.modes_star_base[modes_star_path]
+        self.ms_period[row] = mstar.load_modes_star(modes_star_path).period
+
+        self.stream_ids.append(stream_id)
+        self.rows[stream_id] = row
+        self.algorithms.append(algorithm)
+        self.detectors.append(detector)
+        self.modes_star_paths.append(modes_star_path)
+        self.num_streams += 1
+
+        return
+
+    def remove_stream(self, stream_id):
+        """
+        Remove a stream from the manager, the last stream takes its row.
+        :param stream_id: id of the stream to remove
+        :return:
+        """
+        row = self.rows.pop(stream_id)
+        last = self.num_streams - 1
+        if self.detectors[row] is not None:
+            self.detectors[row].close()
+        path = self.modes_star_paths[row]
+        period = int(self.ms_period[row])
+
+        for array in (self.ring, self.count, self.window_min, self.window_max, self.position, self.time,
+                      self.ms_base, self.ms_period):
+            array[row] = array[last]
+        for lst in (self.stream_ids, self.algorithms, self.detectors, self.modes_star_paths):
+            lst[row] = lst[last]
+            lst.pop()
+        if row != last:
+            self.rows[self.stream_ids[row]] = row
+        self.num_streams -= 1
+
+        # forget the modes_star that are not used anymore
+        self.modes_star_users[path] -= 1
+        if self.modes_star_users[path] == 0:
+            del self.modes_star_users[path]
+            del self.modes_star_base[path]
+            self.modes_star_unused += period
+            if 2 * self.modes_star_unused > self.modes_star_fill:
+                self._compact_modes_star()
+
+        return
+
+    def get_stream_ids(self):
+        """
+        Returns the ids of the streams, in the order next_timestep expects their values.
+        """
+        return list(self.stream_ids)
+
+    def next_timestep(self, new_values):
+        """
+        Process one new value for every stream.
+        :param new_values: one value per stream, in the order of get_stream_ids()
+        :return: remainders and anomaly scores (NaN for streams without a detector), one per stream
+        """
+        n = self.num_streams
+        new_values = np.asarray(new_values, dtype=float)
+        if new_values.shape != (n,):
+            raise ValueError(f'Expected {n} values, one for each stream, got {new_values.shape}.')
+
+        # (1) add data to buffers
+        rows = np.arange(n)
+        slots = self.count[:n] % self.size
+        evicted = self.ring[rows, slots]
+        self.ring[rows, slots] = new_values
+        full = self.count[:n] >= self.size
+        self.count[:n] += 1
+
+        # (2) update the extrema of the buffers, and scale the new values the same way MinMaxScaler does
+        window_min = self.window_min[:n]
+        window_max = self.window_max[:n]
+        # a value leaving the buffer that was an extremum forces a rescan of that stream's buffer
+        rescan = np.flatnonzero(full & ((evicted == window_min) | (evicted == window_max)))
+        np.minimum(window_min, new_values, out=window_min)
+        np.maximum(window_max, new_values, out=window_max)
+        if len(rescan) > 0:
+            window_min[rescan] = self.ring[rescan].min(axis=1)
+            window_max[rescan] = self.ring[rescan].max(axis=1)
+
+        data_range = window_max - window_min
+        data_range[data_range < 10 * np.finfo(np.float64).eps] = 1.0
+        scale = (scaling.SCALE_MAX - scaling.SCALE_MIN) / data_range
+        scaled_values = new_values * scale + (scaling.SCALE_MIN - window_min * scale)
+
+        # (3) only mode removal using the pre-computed modes belonging to the new values
+        positions = self.position[:n]
+        remainders = scaled_values - self.modes_star_flat[self.ms_base[:n] + positions % self.ms_period[:n]]
+        positions += 1
+        self.time[:n] += 1
+
+        # (4) feed the new values to the anomaly detectors that need them
+        anom_scores = np.full(n, np.nan)
+        for row, detector in enumerate(self.detectors):
+            if detector is not None:
+                anom_scores[row] = detector.next_timestep(remainders[row])
+
+        return remainders, anom_scores
+
+    def memory_usage(self, stream_id):
+        """
+        Approximate the memory used by one stream.
+        :param stream_id: id of the stream
+        :return: {'buffer', 'state', 'modes_star', 'detector', 'total'} in bytes, modes_star is the stream's part of
+                 modes_star_flat, divided between the streams sharing it
+        """
+        row = self.rows[stream_id]
+        sharing = self.modes_star_users[self.modes_star_paths[row]]
+
+        usage = {
+            'buffer': self.ring[row].nbytes,
+            'state': sum(array[row].nbytes for array in (self.count, self.window_min, self.window_max,
+                                                          self.position, self.time, self.ms_base, self.ms_period)),
+            'modes_star': int(self.ms_period[row]) * self.modes_star_flat.itemsize // sharing,
+            'detector': deep_sizeof(self.detectors[row]) if self.detectors[row] is not None else 0,
+        }
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def total_memory_usage(self):
+        """
+        Approximate the memory used by all streams, including the capacity allocated for future streams and
+        modes_star.
+        :return: size [bytes]
+        """
+        arrays = (self.ring, self.count, self.window_min, self.window_max, self.position, self.time,
+                  self.ms_base, self.ms_period, self.modes_star_flat)
+        detectors = sum(deep_sizeof(d) for d in self.detectors if d is not None)
+        return sum(array.nbytes for array in arrays) + detectors
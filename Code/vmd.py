@@ -1,6 +1,10 @@
+import time as timelib
+
 import numpy as np
 from vmdpy import VMD
 
+import scaling
+
 # VMD default parameters
 # bandwidth constraint (the higher, the smaller bandwidth)
 ALPHA = 100
@@ -22,6 +26,10 @@ VMD_SUM_FROM = 0
 def decompose(values, alpha=ALPHA, k=K, tau=TAU, dc=DC, init=INIT, tol=TOL, vmd_sum_from=VMD_SUM_FROM):
     values = np.array(values)
     u, u_hat, omega = VMD(values, alpha, tau, k, dc, init, tol)
+    return remove_modes(values, u, omega, vmd_sum_from)
+
+
+def remove_modes(values, u, omega, vmd_sum_from=VMD_SUM_FROM):
     usum = sum(u[vmd_sum_from:])
 
     if values.shape[0] - usum.shape[0] > 0:
@@ -35,3 +43,428 @@ def decompose(values, alpha=ALPHA, k=K, tau=TAU, dc=DC, init=INIT, tol=TOL, vmd_
     usum = np.transpose(np.array([time, usum]))
 
     return data, omega, usum
+
+
+# Run VMD (the same ADMM as vmdpy.VMD), optionally starting from given centre frequencies and mode spectra
+def vmd_admm(f, alpha, tau, k, dc, init, tol, omega_init=None, u_hat_plus_init=None):
+    """
+    Variational mode decomposition, identical to vmdpy.VMD when no initial state is given.
+    Only the last two iterates are kept in memory instead of every one of them.
+    :param omega_init: centre frequencies to start from (warm start), overrides init
+    :param u_hat_plus_init: (T, k) spectra of the modes of the mirrored signal to start from (warm start)
+    :return: u, u_hat, omega, (u_hat_plus, omega_plus) of the last iteration, number of iterations
+    """
+    if len(f) % 2:
+        f = f[:-1]
+
+    # Period and sampling frequency of input signal
+    fs = 1. / len(f)
+
+    ltemp = len(f) // 2
+    f_mirr = np.append(np.flip(f[:ltemp], axis=0), f)
+    f_mirr = np.append(f_mirr, np.flip(f[-ltemp:], axis=0))
+
+    # Time Domain 0 to T (of mirrored signal)
+    T = len(f_mirr)
+    t = np.arange(1, T + 1) / T
+
+    # Spectral Domain discretization
+    freqs = t - 0.5 - (1 / T)
+
+    # Maximum number of iterations (if not converged yet, then it won't anyway)
+    n_iter = 500
+    Alpha = alpha * np.ones(k)
+
+    # Construct and center f_hat
+    f_hat = np.fft.fftshift((np.fft.fft(f_mirr)))
+    f_hat_plus = np.copy(f_hat)
+    f_hat_plus[:T // 2] = 0
+
+    # Initialization of omega_k
+    omega_plus = np.zeros(k)
+    if omega_init is not None:
+        omega_plus[:] = omega_init
+    elif init == 1:
+        for i in range(k):
+            omega_plus[i] = (0.5 / k) * i
+    elif init == 2:
+        omega_plus[:] = np.sort(np.exp(np.log(fs) + (np.log(0.5) - np.log(fs)) * np.random.rand(1, k)))
+    # if DC mode imposed, set its omega to 0
+    if dc:
+        omega_plus[0] = 0
+
+    # start with empty dual variables
+    lambda_hat = np.zeros(len(freqs), dtype=complex)
+
+    # initial mode spectra, and the accumulator holding the sum of every mode but the last one
+    u_hat_plus = np.zeros([len(freqs), k], dtype=complex)
+    sum_uk = 0
+    if u_hat_plus_init is not None:
+        u_hat_plus[:] = u_hat_plus_init
+        sum_uk = np.sum(u_hat_plus[:, :k - 1], axis=1)
+
+    u_diff = tol + np.spacing(1)  # update step
+    n = 0  # loop counter
+    omega_history = [np.copy(omega_plus)]
+
+    # Main loop for iterative updates
+    while u_diff > tol and n < n_iter - 1:
+        u_hat_prev = np.copy(u_hat_plus)
+        omega_prev = np.copy(omega_plus)
+
+        # update first mode accumulator
+        sum_uk = u_hat_prev[:, k - 1] + sum_uk - u_hat_prev[:, 0]
+
+        # update spectrum of first mode through Wiener filter of residuals
+        u_hat_plus[:, 0] = (f_hat_plus - sum_uk - lambda_hat / 2) / (1. + Alpha[0] * (freqs - omega_prev[0]) ** 2)
+
+        # update first omega if not held at 0
+        if not dc:
+            omega_plus[0] = np.dot(freqs[T // 2:T], (abs(u_hat_plus[T // 2:T, 0]) ** 2)) / \
+                np.sum(abs(u_hat_plus[T // 2:T, 0]) ** 2)
+
+        # update of any other mode
+        for j in np.arange(1, k):
+            # accumulator
+            sum_uk = u_hat_plus[:, j - 1] + sum_uk - u_hat_prev[:, j]
+            # mode spectrum
+            u_hat_plus[:, j] = (f_hat_plus - sum_uk - lambda_hat / 2) / (1 + Alpha[j] * (freqs - omega_prev[j]) ** 2)
+            # center frequencies
+            omega_plus[j] = np.dot(freqs[T // 2:T], (abs(u_hat_plus[T // 2:T, j]) ** 2)) / \
+                np.sum(abs(u_hat_plus[T // 2:T, j]) ** 2)
+
+        # Dual ascent
+        lambda_hat = lambda_hat + tau * (np.sum(u_hat_plus, axis=1) - f_hat_plus)
+
+        # loop counter
+        n = n + 1
+        omega_history.append(np.copy(omega_plus))
+
+        # converged yet?
+        u_diff = np.spacing(1)
+        for i in range(k):
+            u_diff = u_diff + (1 / T) * np.dot((u_hat_plus[:, i] - u_hat_prev[:, i]),
+                                               np.conj((u_hat_plus[:, i] - u_hat_prev[:, i])))
+        u_diff = np.abs(u_diff)
+
+    # Postprocessing and cleanup (vmdpy reconstructs from the last but one iterate)
+    u_hat_last = u_hat_prev if n > 0 else u_hat_plus
+    omega = np.array(omega_history[:max(n, 1)])
+
+    idxs = np.flip(np.arange(1, T // 2 + 1), axis=0)
+    # Signal reconstruction
+    u_hat = np.zeros([T, k], dtype=complex)
+    u_hat[T // 2:T, :] = u_hat_last[T // 2:T, :]
+    u_hat[idxs, :] = np.conj(u_hat_last[T // 2:T, :])
+    u_hat[0, :] = np.conj(u_hat[-1, :])
+
+    u = np.zeros([k, len(t)])
+    for j in range(k):
+        u[j, :] = np.real(np.fft.ifft(np.fft.ifftshift(u_hat[:, j])))
+
+    # remove mirror part
+    u = u[:, T // 4:3 * T // 4]
+
+    # recompute spectrum
+    u_hat = np.zeros([u.shape[1], k], dtype=complex)
+    for j in range(k):
+        u_hat[:, j] = np.fft.fftshift(np.fft.fft(u[j, :]))
+
+    return u, u_hat, omega, (u_hat_plus, omega_plus), n
+
+
+class WarmStartVMD:
+    """
+    Runs VMD on a sliding window, seeding the ADMM of each step with the decomposition of the previous step:
+    the previous modes are shifted by one sample (linearly extrapolating the newest one), and the previous centre
+    frequencies are reused. This converges in fewer iterations than starting from scratch every timestep.
+    Iterations and wall time are recorded for every step. With verify=True, every step is also decomposed from
+    scratch to record the cold start cost and the error of the remainder, and the cold start result is used instead
+    whenever the error is larger than max_remainder_error.
+    """
+
+    def __init__(self, alpha=ALPHA, k=K, tau=TAU, dc=DC, init=INIT, tol=TOL, vmd_sum_from=VMD_SUM_FROM,
+                 verify: bool = False, max_remainder_error: float = 1e-3):
+        self.alpha = alpha
+        self.k = k
+        self.tau = tau
+        self.dc = dc
+        self.init = init
+        self.tol = tol
+        self.vmd_sum_from = vmd_sum_from
+        self.verify = verify
+        self.max_remainder_error = max_remainder_error
+
+        self.prev_u = None
+        self.prev_omega = None
+
+        # instrumentation
+        self.iterations = list()
+        self.durations = list()
+        self.cold_iterations = list()
+        self.cold_durations = list()
+        self.remainder_errors = list()
+        self.fallbacks = 0
+
+        return
+
+    def reset(self):
+        """
+        Forget the previous decomposition, the next step will start from scratch.
+        """
+        self.prev_u = None
+        self.prev_omega = None
+        return
+
+    def _seed(self, length: int):
+        """
+        Returns the centre frequencies and mirrored mode spectra to start the next decomposition from.
+        """
+        if self.prev_u is None or self.prev_u.shape[1] != length - length % 2:
+            return None, None
+
+        # shift the modes by one sample, extrapolating the newest one
+        u = np.concatenate([self.prev_u[:, 1:], 2 * self.prev_u[:, -1:] - self.prev_u[:, -2:-1]], axis=1)
+
+        # mirror and transform the same way as the signal is in the ADMM
+        half = u.shape[1] // 2
+        u_mirr = np.concatenate([np.flip(u[:, :half], axis=1), u, np.flip(u[:, -half:], axis=1)], axis=1)
+        u_hat_plus = np.fft.fftshift(np.fft.fft(u_mirr, axis=1), axes=1).T
+        u_hat_plus[:u_mirr.shape[1] // 2] = 0
+
+        return self.prev_omega, u_hat_plus
+
+    def decompose(self, values):
+        """
+        Same as decompose(), but warm-started from the previous call.
+        :param values: the window to decompose
+        :return: data, omega, usum
+        """
+        values = np.array(values)
+        omega_init, u_hat_plus_init = self._seed(len(values))
+
+        begin = timelib.perf_counter()
+        u, _, omega, (_, omega_last), n = vmd_admm(values, self.alpha, self.tau, self.k, self.dc, self.init,
+                                                   self.tol, omega_init, u_hat_plus_init)
+        self.durations.append(timelib.perf_counter() - begin)
+        self.iterations.append(n)
+
+        data, omega, usum = remove_modes(values, u, omega, self.vmd_sum_from)
+
+        if self.verify:
+            begin = timelib.perf_counter()
+            u_cold, _, omega_cold, (_, omega_last_cold), n_cold = vmd_admm(values, self.alpha, self.tau, self.k,
+                                                                           self.dc, self.init, self.tol)
+            self.cold_durations.append(timelib.perf_counter() - begin)
+            self.cold_iterations.append(n_cold)
+
+            data_cold, omega_cold, usum_cold = remove_modes(values, u_cold, omega_cold, self.vmd_sum_from)
+            error = float(np.max(np.abs(data[:, 1] - data_cold[:, 1])))
+            self.remainder_errors.append(error)
+
+            # do not let the warm start drift away from the cold start result
+            if error > self.max_remainder_error:
+                self.fallbacks += 1
+                u, omega_last = u_cold, omega_last_cold
+                data, omega, usum = data_cold, omega_cold, usum_cold
+
+        self.prev_u = u
+        self.prev_omega = omega_last
+
+        return data, omega, usum
+
+    def get_stats(self):
+        """
+        Returns the average iterations and wall time per step (warm and, if verified, cold start),
+        the largest remainder error and the number of fallbacks to the cold start result.
+        """
+        stats = {
+            'steps': len(self.iterations),
+            'avg_iterations': float(np.mean(self.iterations)) if self.iterations else np.nan,
+            'avg_duration': float(np.mean(self.durations)) if self.durations else np.nan,
+        }
+        if self.cold_iterations:
+            stats['avg_cold_iterations'] = float(np.mean(self.cold_iterations))
+            stats['avg_cold_duration'] = float(np.mean(self.cold_durations))
+            stats['max_remainder_error'] = float(np.max(self.remainder_errors))
+            stats['fallbacks'] = self.fallbacks
+        return stats
+
+
+def fit_sinusoid(values, frequency: float, search: float = .1, grid_size: int = 41):
+    """
+    Least squares fit of c0 + c1 * cos(2 pi f n) + c2 * sin(2 pi f n) to values, n being 0 at the last value.
+    The centre frequencies estimated by VMD are only approximate, so f is searched for around frequency.
+    :param values: samples to fit to
+    :param frequency: approximate frequency [cycles / sample]
+    :param search: relative width of the frequency search
+    :param grid_size: number of frequencies tried
+    :return: f, (c0, c1, c2)
+    """
+    n = np.arange(-len(values) + 1, 1)
+    grid = frequency * np.linspace(1 - search, 1 + search, grid_size) if frequency > 0 else np.zeros(1)
+
+    phases = 2 * np.pi * np.outer(grid, n)
+    basis = np.stack([np.ones_like(phases), np.cos(phases), np.sin(phases)], axis=2)  # (grid, n, 3)
+    gram = np.einsum('gni,gnj->gij', basis, basis) + 1e-12 * np.eye(3)
+    coefficients = np.linalg.solve(gram, np.einsum('gni,n->gi', basis, values)[..., None])[..., 0]
+    residuals = np.sum((np.einsum('gni,gi->gn', basis, coefficients) - values) ** 2, axis=1)
+
+    best = int(np.argmin(residuals))
+    return grid[best], coefficients[best]
+
+
+class ScheduledVMD:
+    """
+    Runs VMD on a sliding window only every `every` samples, or earlier when the signal drifts away from the last
+    decomposition, optionally limited by a CPU budget.
+    Between two decompositions, each mode is extended phase-consistently from its last samples using its centre
+    frequency, so the sum of modes belonging to the newest sample costs O(K) instead of a full decomposition.
+    Drift is measured as the mean squared remainder of the samples since the last decomposition, relative to the
+    mean squared difference between the extended modes and the newest l samples of the decomposed window.
+    """
+
+    def __init__(self, alpha=ALPHA, k=K, tau=TAU, dc=DC, init=INIT, tol=TOL, vmd_sum_from=VMD_SUM_FROM,
+                 every: int = 1, drift_threshold: float = None, budget: float = None, l: int = 200):
+        """
+        :param every: decompose at least every `every` samples
+        :param drift_threshold: decompose earlier if the drift statistic exceeds this (None: no drift detection)
+        :param budget: average VMD time allowed per sample [seconds] (None: unlimited)
+        :param l: number of remainder values the drift statistic's baseline is calculated from
+        """
+        self.alpha = alpha
+        self.k = k
+        self.tau = tau
+        self.dc = dc
+        self.init = init
+        self.tol = tol
+        self.vmd_sum_from = vmd_sum_from
+        self.every = every
+        self.drift_threshold = drift_threshold
+        self.budget = budget
+        self.l = l
+
+        self.steps_since = None  # samples since the last decomposition (None: no decomposition yet)
+        self.coefficients = None  # (modes, 3) offset, cosine and sine amplitudes of each mode at the last sample
+        self.frequencies = None  # centre frequency of each mode [cycles / sample]
+        self.scale_min = 0.0
+        self.scale_range = 1.0
+        self.baseline_energy = 0.0
+        self.energy_sum = 0.0
+        self.credit = 0.0
+
+        # instrumentation
+        self.recomputations = 0
+        self.drift_recomputations = 0
+        self.step_durations = list()
+        self.vmd_durations = list()
+
+        return
+
+    def _due(self):
+        if self.steps_since is None:
+            return True
+
+        due = self.steps_since >= self.every
+        if not due and self.drift_threshold is not None and self.steps_since > 0:
+            due = self.get_drift() > self.drift_threshold
+        if due and self.budget is not None and self.vmd_durations:
+            due = self.credit >= self.vmd_durations[-1]
+        return due
+
+    def get_drift(self):
+        if not self.steps_since:
+            return 0.0
+        return (self.energy_sum / self.steps_since) / max(self.baseline_energy, np.finfo(np.float64).eps)
+
+    @staticmethod
+    def _range(values):
+        data_min = np.min(values)
+        data_range = np.max(values) - data_min
+        # constant windows are handled the same way as in sklearn (_handle_zeros_in_scale)
+        if data_range < 10 * np.finfo(np.float64).eps:
+            data_range = 1.0
+        return data_min, data_range
+
+    def _decompose(self, values):
+        scaled_values = scaling.preprocess(values)
+
+        begin = timelib.perf_counter()
+        u, _, omega, (_, omega_last), _ = vmd_admm(scaled_values, self.alpha, self.tau, self.k, self.dc, self.init,
+                                                   self.tol)
+        data, _, _ = remove_modes(scaled_values, u, omega, self.vmd_sum_from)
+        self.vmd_durations.append(timelib.perf_counter() - begin)
+
+        # fit an offset plus a sinusoid near the centre frequency to the newer half of each mode
+        modes = u[self.vmd_sum_from:]
+        fit_length = max(u.shape[1] // 2, 2)
+        self.frequencies = np.zeros(len(modes))
+        self.coefficients = np.zeros((len(modes), 3))
+        for j, (mode, frequency) in enumerate(zip(modes, omega_last[self.vmd_sum_from:])):
+            self.frequencies[j], self.coefficients[j] = fit_sinusoid(mode[-fit_length:], frequency)
+
+        # the baseline of the drift statistic is how well the extended modes describe the newest l samples
+        self.scale_min, self.scale_range = self._range(values)
+        steps = np.arange(-min(self.l, fit_length, u.shape[1]) + 1, 1)
+        fitted = np.array([self._extrapolate(step) for step in steps])
+        self.baseline_energy = float(np.mean((scaled_values[:u.shape[1]][-len(steps):] - fitted) ** 2))
+        self.energy_sum = 0.0
+        self.steps_since = 0
+        self.recomputations += 1
+
+        return data[:, 1]
+
+    def _extrapolate(self, steps: int):
+        """
+        Returns the sum of modes `steps` samples after the last decomposed sample.
+        """
+        phases = 2 * np.pi * self.frequencies * steps
+        return float(np.sum(self.coefficients[:, 0] + self.coefficients[:, 1] * np.cos(phases) +
+                            self.coefficients[:, 2] * np.sin(phases)))
+
+    def next_timestep(self, values):
+        """
+        Returns the remainder of the newest value of the window.
+        :param values: the window (unscaled), its last element being the newest value
+        :return: remainder of the newest value
+        """
+        begin = timelib.perf_counter()
+        if self.budget is not None:
+            # never save up more than what a couple of decompositions need
+            cap = 2 * self.vmd_durations[-1] if self.vmd_durations else self.budget
+            self.credit = min(self.credit + self.budget, max(cap, self.budget))
+
+        if self.steps_since is not None:
+            self.steps_since += 1
+            # remainder in the scaling of the last decomposition, then rescaled to the current window
+            scaled_value = (values[-1] - self.scale_min) * (scaling.SCALE_MAX - scaling.SCALE_MIN) / \
+                self.scale_range + scaling.SCALE_MIN
+            remainder = scaled_value - self._extrapolate(self.steps_since)
+            self.energy_sum += remainder ** 2
+
+        if self._due():
+            if self.steps_since is not None and self.drift_threshold is not None and \
+                    self.steps_since < self.every:
+                self.drift_recomputations += 1
+            remainder = self._decompose(values)[-1]
+            if self.budget is not None:
+                self.credit -= self.vmd_durations[-1]
+        else:
+            remainder = remainder * self.scale_range / self._range(values)[1]
+
+        self.step_durations.append(timelib.perf_counter() - begin)
+        return remainder
+
+    def get_stats(self):
+        """
+        Returns the number of steps and decompositions, and the average, 99th percentile and maximum step latency.
+        """
+        durations = np.asarray(self.step_durations)
+        return {
+            'steps': len(durations),
+            'recomputations': self.recomputations,
+            'drift_recomputations': self.drift_recomputations,
+            'avg_duration': float(np.mean(durations)) if len(durations) else np.nan,
+            'p99_duration': float(np.percentile(durations, 99)) if len(durations) else np.nan,
+            'max_duration': float(np.max(durations)) if len(durations) else np.nan,
+        }
@@ -1,6 +1,23 @@
+import contextlib
+
 import pandas as pd
 
 
+# lock shared by the processes of an experiment, so that they do not append to the same file at the same time
+_lock = None
+
+
+def set_lock(lock):
+    """
+    Set the lock that append_file_pandas holds while updating a file.
+    :param lock: a multiprocessing lock, or None when only one process writes the files.
+    :return: No return value.
+    """
+    global _lock
+    _lock = lock
+    return
+
+
 def init_file_pandas(filename: str, columns: list):
     """
     A general purpose function for quickly initialising csv files using pandas.
@@ -20,8 +37,9 @@ def append_file_pandas(filename: str, new_row: list):
     :param new_row: The data to be inserted into the file.
     :return: No return value.
     """
-    data = pd.read_csv(filename)
-    update_index = len(data)
-    data.loc[update_index] = new_row
-    data.to_csv(filename, index=False)
+    with _lock if _lock is not None else contextlib.nullcontext():
+        data = pd.read_csv(filename)
+        update_index = len(data)
+        data.loc[update_index] = new_row
+        data.to_csv(filename, index=False)
     return